@@ -4,12 +4,14 @@
 
 # write model loading functions here
 
-def load_model(model_path, task):
+def load_model(model_path, task, backend="torch"):
     """
     Loads the model and tokenizer from the model path.
     params:
         model_path: path to the model
         task: task of the model
+        backend: "torch", or "onnx" for a Translation model exported with
+            aimped.nlp.translation_onnx.export_seq2seq_onnx
     returns:
         model: the model
         tokenizer: the tokenizer
@@ -29,6 +31,12 @@ def load_model(model_path, task):
         tokenizer = AutoTokenizer.from_pretrained(model_path)
         model = AutoModelForSeq2SeqLM.from_pretrained(model_path)
         return model, tokenizer
+    elif task == "Translation" and backend == "onnx":
+        from transformers import AutoTokenizer
+        from aimped.nlp.translation_onnx import OnnxSeq2SeqModel
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = OnnxSeq2SeqModel(model_path)
+        return model, tokenizer
     elif task == "Translation":
         from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
         tokenizer = AutoTokenizer.from_pretrained(model_path)
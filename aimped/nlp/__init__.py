@@ -1,4 +1,5 @@
 from aimped.nlp import assertion
+from aimped.nlp import assertion_span
 from aimped.nlp import chunker
 from aimped.nlp import tools
 from aimped.nlp import deid
@@ -6,7 +7,9 @@ from aimped.nlp import ner
 from aimped.nlp import regex_parser
 from aimped.nlp import tokenizer
 from aimped.nlp import relation
+from aimped.nlp import relation_graph
 from aimped.nlp import pipeline
 from aimped.nlp import translation
+from aimped.nlp import translation_onnx
 from aimped.nlp import ner_cls_report
 from aimped.nlp import medical_coding
\ No newline at end of file
@@ -2,30 +2,170 @@
 # Date 2023-March-12
 # Description This file contains the pipeline for assertion detection of clinical notes
 
-import pandas as pd
-import numpy as np
+import threading
+from collections import OrderedDict
+
+
+def AssertionMarkSentence(sentence, sent_begin, sent_end):
+    """
+    It marks the entity in the sentence with [Entity] tags.
+    parameters:
+    ----------------
+    sentence: str
+    sent_begin: int
+    sent_end: int
+    return:
+    ----------------
+    new_sentence: str
+    """
+    return " ".join([
+        sentence[:sent_begin],
+        ' [Entity] ',
+        sentence[sent_begin:sent_end],
+        ' [Entity] ',
+        sentence[sent_end:]])
+
 
 def AssertionAnnotateSentence(df):
     """
     It annotates the sentence with [Entity] tags.   
     parameters:
     ----------------
-    df: pandas dataframe
+    df: pandas dataframe row or dict
     return:
     ----------------
     df['new_sentence']: str
     """
 
-    df['new_sentence'] = " ".join([
-        df['sentence'][:df['sent_begin']],
-        ' [Entity] ',
-        df['sentence'][df['sent_begin']:df['sent_end']],
-        ' [Entity] ',
-        df['sentence'][df['sent_end']:]])
+    df['new_sentence'] = AssertionMarkSentence(df['sentence'], df['sent_begin'], df['sent_end'])
     return df['new_sentence']
 
 
-def AssertionModelResults(ner_results, sentences, classifier, assertion_white_label_list, resolver = False):
+class AssertionCache:
+    """
+    Thread-safe LRU cache of the assertion classifier outputs, keyed by the [Entity] marked sentence.
+    Use one cache per classifier.
+    parameters:
+    ----------------
+    maxsize: int
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+
+def AssertionClassify(new_sentences, classifier, batch_size=None, cache=None):
+    """
+    It classifies the marked sentences. Identical sentences are classified once, cached sentences are not
+    classified again, and the remaining ones are sent to the classifier sorted by length in batches of batch_size.
+    parameters:
+    ----------------
+    new_sentences: list of str
+    classifier: transformers.Pipeline
+    batch_size: int, all the sentences are sent in one call if None
+    cache: AssertionCache
+    return:
+    ----------------
+    rel_results: list of dict, aligned with new_sentences
+    """
+    outputs = {}
+    misses = []
+    for new_sentence in dict.fromkeys(new_sentences):
+        output = cache.get(new_sentence) if cache is not None else None
+        if output is None:
+            misses.append(new_sentence)
+        else:
+            outputs[new_sentence] = output
+    if misses:
+        if batch_size is None:
+            batches = [misses]
+        else:
+            misses.sort(key=len)
+            batches = [misses[i:i + batch_size] for i in range(0, len(misses), batch_size)]
+        for batch in batches:
+            if batch_size is None:
+                rel_results = classifier(batch)
+            else:
+                rel_results = classifier(batch, batch_size=batch_size)
+            for new_sentence, rel_result in zip(batch, rel_results):
+                outputs[new_sentence] = rel_result
+                if cache is not None:
+                    cache.put(new_sentence, rel_result)
+    return [outputs[new_sentence] for new_sentence in new_sentences]
+
+
+def AssertionBatchResults(ner_results_list, sentences_list, classifier, assertion_white_label_list, resolver=False,
+                          batch_size=32, cache=None):
+    """
+    It returns the assertion detection results of a batch of texts. The marked sentences of all the texts are
+    classified together with AssertionClassify, then scattered back to their texts.
+    parameters:
+    ----------------
+    ner_results_list: list of list of dict
+    sentences_list: list of list of str
+    classifier: transformers.Pipeline
+    assertion_white_label_list: list of str
+    resolver: bool
+    batch_size: int
+    cache: AssertionCache
+    return:
+    ----------------
+    results: list of list of dict, the results of each text
+    """
+
+    # the values are read by position: ner_label, chunk, begin, end, sent_idx, sent_begin, sent_end
+    entities_list = [[list(entity.values()) for entity in ner_results] for ner_results in ner_results_list]
+    new_sentences = [AssertionMarkSentence(sentences[sent_idx], sent_begin, sent_end)
+                     for entities, sentences in zip(entities_list, sentences_list)
+                     for _, _, _, _, sent_idx, sent_begin, sent_end in entities]
+    rel_results = iter(AssertionClassify(new_sentences, classifier, batch_size=batch_size, cache=cache))
+    results_list = []
+    for entities in entities_list:
+        results = []
+        for (ner_label, chunk, begin, end, sent_idx, _, _), rel_result in zip(entities, rel_results):
+            if rel_result['label'] not in assertion_white_label_list:
+                continue
+            if not resolver:
+                results.append({'begin': begin, 'end': end, 'ner_label': ner_label, 'chunk': chunk,
+                                'assertion': rel_result['label'], 'score': rel_result['score']})
+            else:
+                results.append({'begin': begin, 'end': end, 'entity': ner_label, 'chunk': chunk,
+                                'sent_idx': sent_idx, 'assertion': rel_result['label']})
+        results_list.append(results)
+    return results_list
+
+
+def AssertionModelResults(ner_results, sentences, classifier, assertion_white_label_list, resolver = False,
+                          batch_size=None, cache=None):
     """
     It returns the assertion detection results of a text.
     parameters:
@@ -35,33 +175,17 @@ def AssertionModelResults(ner_results, sentences, classifier, assertion_white_la
     tokenizer: transformers.tokenization_utils_base.PreTrainedTokenizer
     model: transformers.modeling_utils.PreTrainedModel
     classifier: transformers.modeling_utils.PreTrainedModel
+    batch_size: int, the sentences are sent in one classifier call if None
+    cache: AssertionCache
     return:
     ----------------
-    df.to_dict(orient = 'records'): list of dict
+    results: list of dict
     """
 
-    df = pd.DataFrame()
-    if len(ner_results) >= 1:
-        ner_results = list(map(lambda x: list(x.values()), ner_results))
-        df = pd.DataFrame(ner_results)
-        df.columns = ['ner_label', 'chunk', 'begin', 'end', 'sent_idx', 'sent_begin', 'sent_end']
-        if len(df) != 0:
-            df['sentence'] = np.nan
-            for i in df.sent_idx.unique():
-                df.loc[df[df.sent_idx == i].index, 'sentence'] = sentences[i]
-            df['new_sentence'] = np.nan
-            df['new_sentence'] = df.apply(AssertionAnnotateSentence, axis=1)
-            df.reset_index(drop=True, inplace=True)
-            rel_results = classifier(list(df['new_sentence']))
-            df = pd.concat([df, pd.DataFrame(rel_results)], axis=1)
-            if not resolver:
-                df = df[['begin', 'end', 'ner_label', 'chunk', 'label','score']]
-                df.columns = ['begin','end', 'ner_label', 'chunk', 'assertion','score']
-            else:
-                df = df[['begin', 'end', 'ner_label', 'chunk', 'sent_idx','label']]
-                df.columns = ['begin','end', 'entity', 'chunk','sent_idx', 'assertion']
-            df =df[df['assertion'].isin(assertion_white_label_list)]
-    return df.to_dict(orient='records')
+    if len(ner_results) == 0:
+        return []
+    return AssertionBatchResults([ner_results], [sentences], classifier, assertion_white_label_list,
+                                 resolver=resolver, batch_size=batch_size, cache=cache)[0]
 
 
 # visualizer
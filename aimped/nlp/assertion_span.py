@@ -0,0 +1,156 @@
+# Author AIMPED
+# Date 2026-October-19
+# Description This file contains the single-forward assertion detection of all the entities of a sentence.
+
+import json
+import os
+
+import torch
+from torch import nn
+from transformers import AutoModel
+
+
+class SpanAssertionModel(nn.Module):
+    """
+    Assertion classifier that encodes each sentence once and classifies every entity span of it.
+    An entity is represented by the [CLS] vector of its sentence concatenated with the mean of the
+    token vectors of its span, so the number of encoder forward passes drops from the number of
+    entities to the number of sentences.
+    parameters:
+    ----------------
+    encoder: transformers.PreTrainedModel, a base encoder such as AutoModel
+    id2label: dict of int to str
+    dropout: float
+    """
+
+    def __init__(self, encoder, id2label, dropout=0.1):
+        super().__init__()
+        self.encoder = encoder
+        self.id2label = {int(idx): label for idx, label in id2label.items()}
+        self.dropout = nn.Dropout(dropout)
+        self.classifier = nn.Linear(2 * encoder.config.hidden_size, len(self.id2label))
+
+    def forward(self, input_ids, attention_mask, span_sentence_idxs, span_token_mask, **encoder_inputs):
+        """
+        parameters:
+        ----------------
+        input_ids: torch.LongTensor (sentences, tokens)
+        attention_mask: torch.LongTensor (sentences, tokens)
+        span_sentence_idxs: torch.LongTensor (entities,), the sentence of each entity
+        span_token_mask: torch.FloatTensor (entities, tokens), 1 for the tokens of each entity
+        return:
+        ----------------
+        logits: torch.FloatTensor (entities, labels)
+        """
+        hidden_states = self.encoder(input_ids=input_ids, attention_mask=attention_mask,
+                                     **encoder_inputs).last_hidden_state
+        hidden_states = self.dropout(hidden_states)
+        span_hidden_states = hidden_states[span_sentence_idxs]
+        span_token_mask = span_token_mask.unsqueeze(-1).to(span_hidden_states.dtype)
+        span_vectors = (span_hidden_states * span_token_mask).sum(1) / span_token_mask.sum(1).clamp(min=1)
+        cls_vectors = span_hidden_states[:, 0]
+        return self.classifier(torch.cat([cls_vectors, span_vectors], dim=-1))
+
+    def save_pretrained(self, model_path):
+        """Saves the encoder, the classification head and the labels to model_path."""
+        self.encoder.save_pretrained(model_path)
+        torch.save(self.classifier.state_dict(), os.path.join(model_path, "span_assertion_head.bin"))
+        with open(os.path.join(model_path, "span_assertion_config.json"), "w", encoding="utf8") as f:
+            json.dump({"id2label": self.id2label, "dropout": self.dropout.p}, f)
+
+    @classmethod
+    def from_pretrained(cls, model_path):
+        """Loads a model saved with save_pretrained."""
+        with open(os.path.join(model_path, "span_assertion_config.json"), encoding="utf8") as f:
+            config = json.load(f)
+        model = cls(AutoModel.from_pretrained(model_path), config["id2label"], dropout=config["dropout"])
+        model.classifier.load_state_dict(
+            torch.load(os.path.join(model_path, "span_assertion_head.bin"), map_location="cpu"))
+        return model
+
+
+def SpanAssertionInputs(sentences, spans, tokenizer, max_length=512):
+    """
+    It tokenizes the sentences once and maps each entity span to its tokens.
+    parameters:
+    ----------------
+    sentences: list of str
+    spans: list of (sentence index, sent_begin, sent_end)
+    tokenizer: transformers.PreTrainedTokenizerFast
+    max_length: int
+    return:
+    ----------------
+    model_inputs: dict of torch.Tensor, the inputs of SpanAssertionModel.forward
+    """
+    model_inputs = tokenizer(sentences, padding=True, truncation=True, max_length=max_length,
+                             return_offsets_mapping=True, return_tensors="pt")
+    offsets = model_inputs.pop("offset_mapping")
+    starts, ends = offsets[..., 0], offsets[..., 1]
+    # special and padding tokens have empty offsets
+    real_tokens = ends > starts
+    span_sentence_idxs = torch.tensor([sent_idx for sent_idx, _, _ in spans], dtype=torch.long)
+    sent_begins = torch.tensor([sent_begin for _, sent_begin, _ in spans], dtype=torch.long).unsqueeze(-1)
+    sent_ends = torch.tensor([sent_end for _, _, sent_end in spans], dtype=torch.long).unsqueeze(-1)
+    span_token_mask = ((starts[span_sentence_idxs] < sent_ends) & (ends[span_sentence_idxs] > sent_begins)
+                       & real_tokens[span_sentence_idxs])
+    model_inputs["span_sentence_idxs"] = span_sentence_idxs
+    model_inputs["span_token_mask"] = span_token_mask.float()
+    return model_inputs
+
+
+def SpanAssertionModelResults(ner_results, sentences, tokenizer, model, assertion_white_label_list, resolver=False,
+                              device="cpu", batch_size=16, max_length=512):
+    """
+    It returns the assertion detection results of a text with a SpanAssertionModel, in the format of
+    aimped.nlp.assertion.AssertionModelResults.
+    parameters:
+    ----------------
+    ner_results: list of dict
+    sentences: list of str
+    tokenizer: transformers.PreTrainedTokenizerFast
+    model: SpanAssertionModel
+    assertion_white_label_list: list of str
+    resolver: bool
+    device: str
+    batch_size: int, sentences per forward pass
+    max_length: int
+    return:
+    ----------------
+    results: list of dict
+    """
+
+    if len(ner_results) == 0:
+        return []
+    # the values are read by position: ner_label, chunk, begin, end, sent_idx, sent_begin, sent_end
+    entities = [list(entity.values()) for entity in ner_results]
+    entity_idxs_by_sentence = {}
+    for idx, entity in enumerate(entities):
+        entity_idxs_by_sentence.setdefault(entity[4], []).append(idx)
+    sent_idxs = sorted(entity_idxs_by_sentence)
+    predictions = [None] * len(entities)
+    model = model.to(device)
+    model.eval()
+    for i in range(0, len(sent_idxs), batch_size):
+        batch_sent_idxs = sent_idxs[i:i + batch_size]
+        positions = {sent_idx: position for position, sent_idx in enumerate(batch_sent_idxs)}
+        entity_idxs = [idx for sent_idx in batch_sent_idxs for idx in entity_idxs_by_sentence[sent_idx]]
+        model_inputs = SpanAssertionInputs([sentences[sent_idx] for sent_idx in batch_sent_idxs],
+                                           [(positions[entities[idx][4]], entities[idx][5], entities[idx][6])
+                                            for idx in entity_idxs],
+                                           tokenizer, max_length=max_length)
+        with torch.no_grad():
+            logits = model(**{key: value.to(device) for key, value in model_inputs.items()})
+        scores, label_ids = logits.softmax(-1).max(-1)
+        for idx, score, label_id in zip(entity_idxs, scores.tolist(), label_ids.tolist()):
+            predictions[idx] = (model.id2label[label_id], score)
+    results = []
+    for (ner_label, chunk, begin, end, sent_idx, _, _), (label, score) in zip(entities, predictions):
+        if label not in assertion_white_label_list:
+            continue
+        if not resolver:
+            results.append({'begin': begin, 'end': end, 'ner_label': ner_label, 'chunk': chunk,
+                            'assertion': label, 'score': score})
+        else:
+            results.append({'begin': begin, 'end': end, 'entity': ner_label, 'chunk': chunk,
+                            'sent_idx': sent_idx, 'assertion': label})
+    return results
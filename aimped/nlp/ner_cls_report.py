@@ -7,7 +7,16 @@ Original file is located at
     https://colab.research.google.com/drive/1LJIu53E46CcoGLqcAhgav970B6X-coYm
 """
 
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
 import pandas as pd
+import torch
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -16,7 +25,7 @@ try:
 except:
     print('seqeval is not installed. Please install it with pip install seqeval')
 
-from sklearn.metrics import classification_report
+from sklearn.metrics import classification_report as token_classification_report
     
 def ReadConll(filename):
     df = pd.read_csv(filename,
@@ -29,39 +38,388 @@ def ReadConll(filename):
     df['sentence_id'] = (df.words == '').cumsum()
     return df[df.words != '']
 
-def ClsReportNerModel(test_conll_path, tokenizer, model, device):
+
+def IterConll(filename, label_column=3):
+    """
+    It reads a CoNLL file line by line and yields its sentences, like ReadConll without loading the whole file.
+    parameters:
+    ----------------
+    filename: str
+    label_column: int, the column of the labels, the words are the first column
+    return:
+    ----------------
+    sentences: generator of (list of str, list of str), the words and the labels of each sentence
+    """
+    words, labels = [], []
+    with open(filename, encoding="utf8") as f:
+        for line in f:
+            columns = line.rstrip("\r\n").split(" ")
+            if columns[0].startswith("-DOCSTART-"):
+                continue
+            if columns[0] == "":
+                if words:
+                    yield words, labels
+                    words, labels = [], []
+                continue
+            words.append(columns[0])
+            labels.append(columns[label_column] if len(columns) > label_column else "")
+    if words:
+        yield words, labels
+
+
+def FileHash(filename, chunk_size=1 << 20):
+    """It returns the sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def TokenizerFingerprint(tokenizer):
+    """
+    It returns a hash of what decides the tokenization: the tokenizer class, its vocabulary and rules and its
+    special tokens. The path of the tokenizer is left out, so the checkpoints sharing a tokenizer share the hash.
+    """
+    digest = hashlib.sha256(type(tokenizer).__name__.encode("utf8"))
+    if getattr(tokenizer, "is_fast", False):
+        state = json.loads(tokenizer.backend_tokenizer.to_str())
+        # the truncation and padding of the last call are kept in the state
+        state.pop("truncation", None)
+        state.pop("padding", None)
+        digest.update(json.dumps(state, sort_keys=True).encode("utf8"))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf8"))
+    digest.update(json.dumps([tokenizer.all_special_tokens, tokenizer.model_input_names]).encode("utf8"))
+    return digest.hexdigest()
+
+
+def ConllSentences(df):
+    """
+    It splits the rows of ReadConll into sentences in one pass.
+    parameters:
+    ----------------
+    df: pandas.DataFrame, the output of ReadConll
+    return:
+    ----------------
+    sents_tokens_list: list of list of str
+    truth_list: list of list of str
+    """
+    sentence_ids = df.sentence_id.to_numpy()
+    # the rows of a sentence are contiguous, so a sentence starts where the id changes
+    boundaries = np.flatnonzero(sentence_ids[1:] != sentence_ids[:-1]) + 1
+    words = np.split(df.words.astype(str).to_numpy(dtype=object), boundaries) if len(df) else []
+    labels = np.split(df.labels.astype(str).to_numpy(dtype=object), boundaries) if len(df) else []
+    return [list(tokens) for tokens in words], [list(truths) for truths in labels]
+
+
+def FirstSubtokenPositions(word_ids):
+    """
+    It returns the positions of the first sub tokens of the words and the word index of each of them.
+    parameters:
+    ----------------
+    word_ids: numpy.ndarray (sentences, tokens), the word index of each sub token, -1 for the special tokens
+    return:
+    ----------------
+    rows, columns, words: numpy.ndarray
+    """
+    previous = np.full_like(word_ids, -1)
+    previous[:, 1:] = word_ids[:, :-1]
+    rows, columns = np.nonzero((word_ids >= 0) & (word_ids != previous))
+    return rows, columns, word_ids[rows, columns]
 
 
-    test = ReadConll(test_conll_path)
-    sents_tokens_list, truth_list = [],[]
+def ModelLabels(model):
+    """It returns the labels of a token classification model as an array indexed by label id."""
+    return np.array([model.config.id2label[idx] for idx in range(len(model.config.id2label))], dtype=object)
+
+
+def PredictBatch(model, model_inputs, word_ids, id2label):
+    """
+    It runs a padded batch under no_grad and returns the label of the first sub token of each word.
+    parameters:
+    ----------------
+    model: transformers.PreTrainedModel
+    model_inputs: dict of torch.Tensor, on the device of the model
+    word_ids: numpy.ndarray (sentences, tokens), -1 for the special and padding tokens
+    id2label: numpy.ndarray, the output of ModelLabels
+    return:
+    ----------------
+    preds_list: list of list of str
+    word_idxs_list: list of list of int, the word of each prediction, a word without sub tokens has none
+    """
+    with torch.no_grad():
+        predictions = model(**model_inputs).logits.argmax(dim=-1).cpu().numpy()
+    rows, columns, words = FirstSubtokenPositions(word_ids)
+    labels = id2label[predictions[rows, columns]]
+    boundaries = np.cumsum(np.bincount(rows, minlength=len(word_ids)))[:-1]
+    return ([list(preds) for preds in np.split(labels, boundaries)],
+            [word_idxs.tolist() for word_idxs in np.split(words, boundaries)])
+
+
+def AlignTruths(truth_list, word_idxs_list):
+    """
+    It returns the truth of each prediction, the words without sub tokens and the words cut by the truncation
+    have no prediction and are left out.
+    parameters:
+    ----------------
+    truth_list: list of list of str, the labels of the words of each sentence
+    word_idxs_list: list of list of int, the word of each prediction
+    return:
+    ----------------
+    truths: list of list of str
+    """
+    return [[truth[word_idx] for word_idx in word_idxs] for truth, word_idxs in zip(truth_list, word_idxs_list)]
+
+
+def NerModelPredictions(sents_tokens_list, tokenizer, model, device, batch_size=32, max_length=512):
+    """
+    It predicts the label of the first sub token of each word, the words without sub tokens and the words cut by
+    the truncation are left out.
+    parameters:
+    ----------------
+    sents_tokens_list: list of list of str
+    tokenizer: transformers.PreTrainedTokenizerFast
+    model: transformers.PreTrainedModel
+    device: str
+    batch_size: int, sentences per forward pass
+    max_length: int
+    return:
+    ----------------
+    preds_list: list of list of str, the labels of each sentence
+    word_idxs_list: list of list of int, the word of each label
+    """
+    preds_list = [None] * len(sents_tokens_list)
+    word_idxs_list = [None] * len(sents_tokens_list)
+    id2label = ModelLabels(model)
+    # the sentences of similar lengths are batched together to waste less padding
+    order = sorted(range(len(sents_tokens_list)), key=lambda idx: len(sents_tokens_list[idx]))
     model = model.to(device)
-    for i in test.sentence_id.unique():
-        sents_tokens_list.append(list(test[test.sentence_id == i].words))
-        truth_list.append(list(test[test.sentence_id == i].labels))
-    tokens,preds,truths= [],[],[]
-    for sentence_idx, sent_token_list in enumerate(sents_tokens_list):
-        model_inputs = tokenizer(sent_token_list, is_split_into_words = True, truncation=True,
-                                        padding=False, max_length=512, return_tensors="pt").to(device)
-        word_ids = model_inputs.word_ids() # sub tokenlar sent_token_list deki hangi idxteki tokena ait
-        # ornek word_ids = [None, 0, 1, 2, 2, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 11, 12, 13, 14, 15, None]
-        outputs = model(**model_inputs)
-        predictions = outputs.logits.argmax(dim=-1).tolist()[0]
-        idx = 1
-        while idx < len(word_ids)-1: # sondaki None icin islem yapmamak icin -1 yapildi
-            word_id1 = word_ids[idx]
-            word_id2 = word_ids[idx + 1]
-            label = model.config.id2label[predictions[idx]]
-            if word_id1 == word_id2:
-                while word_id1 == word_ids[idx]:                
-                    idx +=1
-                idx -=1
-
-            token = sent_token_list[word_ids[idx]]
-            truth = truth_list[sentence_idx][word_ids[idx]]
-            tokens.append(token)        
-            preds.append(label)
-            truths.append(truth)
-            idx +=1
-
-    print(classification_report([truths], [preds], digits = 4, mode = 'strict'))
-    print(classification_report(truths, preds, digits = 4))
+    model.eval()
+    for i in range(0, len(order), batch_size):
+        batch_idxs = order[i:i + batch_size]
+        model_inputs = tokenizer([sents_tokens_list[idx] for idx in batch_idxs], is_split_into_words=True,
+                                 truncation=True, padding=True, max_length=max_length, return_tensors="pt")
+        word_ids = np.array([[-1 if word_id is None else word_id for word_id in model_inputs.word_ids(j)]
+                             for j in range(len(batch_idxs))], dtype=np.int64)
+        batch_preds, batch_word_idxs = PredictBatch(model, model_inputs.to(device), word_ids, id2label)
+        for idx, preds, word_idxs in zip(batch_idxs, batch_preds, batch_word_idxs):
+            preds_list[idx], word_idxs_list[idx] = preds, word_idxs
+    return preds_list, word_idxs_list
+
+
+def _read_bin(path, dtype):
+    """It memory-maps a raw array file, numpy.memmap does not map empty files."""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class AlignedConllDataset:
+    """
+    CoNLL file tokenized and aligned once and stored as flat .npy arrays, so the evaluations of different
+    checkpoints skip the parsing and the tokenization. The datasets are cached in cache_dir under the hash of
+    the file, the fingerprint of the tokenizer and max_length, and their arrays are memory-mapped.
+    parameters:
+    ----------------
+    path: str, the directory of the dataset
+    mmap_mode: str, the numpy.load memory-map mode, None to load the arrays in memory
+    """
+
+    ARRAYS = ["input_ids", "word_ids", "token_offsets", "label_ids", "word_offsets"]
+
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        with open(os.path.join(path, "dataset.json"), encoding="utf8") as f:
+            self.meta = json.load(f)
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode))
+        self.labels = np.array(self.meta["labels"], dtype=object)
+
+    def __len__(self):
+        return len(self.token_offsets) - 1
+
+    def __repr__(self):
+        return (f"AlignedConllDataset({self.path!r}, sentences={len(self)}, "
+                f"tokens={self.meta['tokens']}, words={self.meta['words']})")
+
+    @staticmethod
+    def key(conll_path, tokenizer, max_length=512):
+        """It returns the cache key of a CoNLL file tokenized with tokenizer."""
+        return hashlib.sha256(f"{FileHash(conll_path)}:{TokenizerFingerprint(tokenizer)}:{max_length}"
+                              .encode("utf8")).hexdigest()[:32]
+
+    @classmethod
+    def get(cls, conll_path, tokenizer, cache_dir, max_length=512, chunk_sentences=1000, mmap_mode="r"):
+        """It loads the cached dataset of a CoNLL file, building it first if it is not in cache_dir."""
+        path = os.path.join(cache_dir, cls.key(conll_path, tokenizer, max_length=max_length))
+        if not os.path.exists(os.path.join(path, "dataset.json")):
+            cls.build(conll_path, tokenizer, path, max_length=max_length, chunk_sentences=chunk_sentences)
+        return cls(path, mmap_mode=mmap_mode)
+
+    @classmethod
+    def build(cls, conll_path, tokenizer, path, max_length=512, chunk_sentences=1000):
+        """
+        It streams a CoNLL file with IterConll, tokenizes chunk_sentences sentences at a time and appends them
+        to the arrays on disk, so the memory does not grow with the file. The dataset is written to a temporary
+        directory and renamed to path when it is complete.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        build_dir = tempfile.mkdtemp(dir=parent)
+        label2id = {}
+        counts = {"sentences": 0, "tokens": 0, "words": 0}
+        files = {name: open(os.path.join(build_dir, f"{name}.bin"), "wb")
+                 for name in ["input_ids", "word_ids", "token_lengths", "label_ids", "word_lengths"]}
+
+        def write(chunk):
+            words_list = [words for words, _ in chunk]
+            model_inputs = tokenizer(words_list, is_split_into_words=True, truncation=True, max_length=max_length)
+            for j, (words, labels) in enumerate(chunk):
+                word_ids = [-1 if word_id is None else word_id for word_id in model_inputs.word_ids(j)]
+                np.asarray(model_inputs["input_ids"][j], dtype=np.int32).tofile(files["input_ids"])
+                np.asarray(word_ids, dtype=np.int32).tofile(files["word_ids"])
+                np.asarray([label2id.setdefault(label, len(label2id)) for label in labels],
+                           dtype=np.int32).tofile(files["label_ids"])
+            np.asarray([len(input_ids) for input_ids in model_inputs["input_ids"]],
+                       dtype=np.int64).tofile(files["token_lengths"])
+            np.asarray([len(words) for words in words_list], dtype=np.int64).tofile(files["word_lengths"])
+            counts["sentences"] += len(chunk)
+            counts["tokens"] += sum(len(input_ids) for input_ids in model_inputs["input_ids"])
+            counts["words"] += sum(len(words) for words in words_list)
+
+        try:
+            chunk = []
+            for sentence in IterConll(conll_path):
+                chunk.append(sentence)
+                if len(chunk) == chunk_sentences:
+                    write(chunk)
+                    chunk = []
+            if chunk:
+                write(chunk)
+            for f in files.values():
+                f.close()
+            for name in ["input_ids", "word_ids", "label_ids"]:
+                np.save(os.path.join(build_dir, f"{name}.npy"), _read_bin(os.path.join(build_dir, f"{name}.bin"),
+                                                                          np.int32))
+            for name, lengths in [("token_offsets", "token_lengths"), ("word_offsets", "word_lengths")]:
+                lengths = _read_bin(os.path.join(build_dir, f"{lengths}.bin"), np.int64)
+                np.save(os.path.join(build_dir, f"{name}.npy"),
+                        np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(lengths)]))
+            for name in files:
+                os.remove(os.path.join(build_dir, f"{name}.bin"))
+            with open(os.path.join(build_dir, "dataset.json"), "w", encoding="utf8") as f:
+                json.dump({"labels": list(label2id), "conll_path": os.path.abspath(conll_path),
+                           "conll_hash": FileHash(conll_path), "tokenizer": TokenizerFingerprint(tokenizer),
+                           "tokenizer_name_or_path": getattr(tokenizer, "name_or_path", None),
+                           "max_length": max_length, "pad_token_id": tokenizer.pad_token_id or 0,
+                           "model_input_names": list(tokenizer.model_input_names), **counts}, f)
+            try:
+                os.replace(build_dir, path)
+            except OSError:
+                # built by another process in the meantime
+                if not os.path.exists(os.path.join(path, "dataset.json")):
+                    raise
+        finally:
+            for f in files.values():
+                f.close()
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def truths(self, idx=None):
+        """It returns the labels of the words of a sentence, or of every sentence if idx is None."""
+        if idx is None:
+            return [self.truths(idx) for idx in range(len(self))]
+        return list(self.labels[self.label_ids[self.word_offsets[idx]:self.word_offsets[idx + 1]]])
+
+    def batch(self, idxs):
+        """
+        It pads the tokens of the sentences idxs on the right.
+        return:
+        ----------------
+        model_inputs: dict of torch.Tensor
+        word_ids: numpy.ndarray (sentences, tokens), -1 for the special and padding tokens
+        """
+        starts, ends = self.token_offsets[idxs], self.token_offsets[np.asarray(idxs) + 1]
+        lengths = ends - starts
+        width = int(lengths.max()) if len(idxs) else 0
+        input_ids = np.full((len(idxs), width), self.meta["pad_token_id"], dtype=np.int64)
+        word_ids = np.full((len(idxs), width), -1, dtype=np.int64)
+        for row, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+            input_ids[row, :end - start] = self.input_ids[start:end]
+            word_ids[row, :end - start] = self.word_ids[start:end]
+        attention_mask = (np.arange(width) < lengths[:, None]).astype(np.int64)
+        model_inputs = {"input_ids": torch.from_numpy(input_ids), "attention_mask": torch.from_numpy(attention_mask)}
+        if "token_type_ids" in self.meta["model_input_names"]:
+            model_inputs["token_type_ids"] = torch.zeros_like(model_inputs["input_ids"])
+        return model_inputs, word_ids
+
+
+def NerDatasetPredictions(dataset, model, device, batch_size=32):
+    """
+    NerModelPredictions on an AlignedConllDataset, without tokenizing.
+    parameters:
+    ----------------
+    dataset: AlignedConllDataset
+    model: transformers.PreTrainedModel
+    device: str
+    batch_size: int, sentences per forward pass
+    return:
+    ----------------
+    preds_list: list of list of str, the labels of each sentence
+    word_idxs_list: list of list of int, the word of each label
+    """
+    preds_list = [None] * len(dataset)
+    word_idxs_list = [None] * len(dataset)
+    id2label = ModelLabels(model)
+    order = np.argsort(np.diff(dataset.token_offsets), kind="stable")
+    model = model.to(device)
+    model.eval()
+    for i in range(0, len(order), batch_size):
+        batch_idxs = order[i:i + batch_size]
+        model_inputs, word_ids = dataset.batch(batch_idxs)
+        model_inputs = {key: value.to(device) for key, value in model_inputs.items()}
+        batch_preds, batch_word_idxs = PredictBatch(model, model_inputs, word_ids, id2label)
+        for idx, preds, word_idxs in zip(batch_idxs.tolist(), batch_preds, batch_word_idxs):
+            preds_list[idx], word_idxs_list[idx] = preds, word_idxs
+    return preds_list, word_idxs_list
+
+
+def ClsReportNerModel(test_conll_path, tokenizer, model, device, batch_size=32, max_length=512, cache_dir=None):
+    """
+    It prints the seqeval entity report and the token report of a token classification model on a CoNLL file.
+    parameters:
+    ----------------
+    test_conll_path: str
+    tokenizer: transformers.PreTrainedTokenizerFast
+    model: transformers.PreTrainedModel
+    device: str
+    batch_size: int, sentences per forward pass
+    max_length: int
+    cache_dir: str, if given the tokenized file is cached there as an AlignedConllDataset
+    return:
+    ----------------
+    results: dict, the truths and predictions of the evaluated words and the throughput
+    """
+    if cache_dir is not None:
+        dataset = AlignedConllDataset.get(test_conll_path, tokenizer, cache_dir, max_length=max_length)
+        truth_list = dataset.truths()
+        start = time.perf_counter()
+        preds_list, word_idxs_list = NerDatasetPredictions(dataset, model, device, batch_size=batch_size)
+    else:
+        sents_tokens_list, truth_list = ConllSentences(ReadConll(test_conll_path))
+        start = time.perf_counter()
+        preds_list, word_idxs_list = NerModelPredictions(sents_tokens_list, tokenizer, model, device,
+                                                         batch_size=batch_size, max_length=max_length)
+    seconds = time.perf_counter() - start
+    truths = AlignTruths(truth_list, word_idxs_list)
+    num_tokens = sum(len(preds) for preds in preds_list)
+    results = {"truths": truths, "preds": preds_list, "sentences": len(preds_list), "tokens": num_tokens,
+               "seconds": seconds, "sentences_per_second": len(preds_list) / seconds if seconds else 0.0,
+               "tokens_per_second": num_tokens / seconds if seconds else 0.0}
+
+    print(classification_report(truths, preds_list, digits = 4, mode = 'strict'))
+    print(token_classification_report([label for truth in truths for label in truth],
+                                      [label for preds in preds_list for label in preds], digits = 4))
+    print(f"{results['sentences']} sentences, {results['tokens']} tokens in {seconds:.2f}s: "
+          f"{results['sentences_per_second']:.1f} sentences/sec, {results['tokens_per_second']:.1f} tokens/sec")
+    return results
@@ -4,11 +4,11 @@
 
 from aimped.nlp.ner import NerModelResults
 from aimped.nlp.deid import maskText, fakedChunk, fakedText, deidentification
-from aimped.nlp.assertion import AssertionAnnotateSentence, AssertionModelResults
+from aimped.nlp.assertion import AssertionAnnotateSentence, AssertionModelResults, AssertionBatchResults
 from aimped.nlp.chunker import ChunkMerger
-from aimped.nlp.regex_parser import RegexNerParser, RegexModelNerMerger, RegexModelOutputMerger
-from aimped.nlp.relation import RelationResults, RelationAnnotateSentence
-import glob
+from aimped.nlp.regex_parser import RegexNerParser, RegexModelNerMerger, RegexModelOutputMerger, RegexRuleSet
+from aimped.nlp.relation import RelationResults, RelationAnnotateSentence, RelationBatchResults
+
 class Pipeline:
     """
     It returns the ner results of a text.
@@ -93,6 +93,31 @@ class Pipeline:
                                         )
         return results
 
+    def assertion_batch_result(self, ner_results_list, sentences_list, classifier, assertion_white_label_list,
+                               resolver=False, batch_size=32, cache=None):
+        """It returns the assertion results of a batch of texts, classifying their deduplicated sentences together.
+        parameters:
+        ----------------
+        ner_results_list: list of list of dict
+        sentences_list: list of list of str
+        classifier: transformers.Pipeline
+        assertion_white_label_list: list of str
+        resolver: bool
+        batch_size: int
+        cache: AssertionCache
+        return:
+        ----------------
+        results: list of list of dict
+        """
+        results = AssertionBatchResults(ner_results_list=ner_results_list,
+                                        sentences_list=sentences_list,
+                                        classifier=classifier,
+                                        assertion_white_label_list=assertion_white_label_list,
+                                        resolver=resolver,
+                                        batch_size=batch_size,
+                                        cache=cache)
+        return results
+
     def chunker_result(self, text, white_label_list, tokens, preds, probs, begins, ends,
                        assertion_relation=False, sent_begins=[], sent_ends=[], sent_idxs=[]):
         """It returns the merged chunks of a text.
@@ -126,29 +151,41 @@ class Pipeline:
                               sent_idxs=sent_idxs)
         return results
 
-    def regex_model_output_merger(self, regex_json_files_path, model_results, text, white_label_list):
+    def regex_model_output_merger(self, regex_json_files_path, model_results, text, white_label_list,
+                                  engine="individual", time_budget=None):
         """It returns the regex results of a text.
         parameters:
         ----------------
-        regex_json_files_path: str
+        regex_json_files_path: str or RegexRuleSet
         model_results: list of dict
         text: str
         white_label_list: list of str
+        engine: str, "individual" or "combined" (single scan of the text for all the compatible rules, usually
+            not faster, see CombinedRegexMatcher)
+        time_budget: float, seconds per rule scan, see RegexRuleSet.profile for the rule timings
         return:
         ----------------
         results: list of dict
         """
 
-        regex_json_files_path_list = glob.glob(f"{regex_json_files_path}/*.json")
+        rule_set = RegexRuleSet.get(regex_json_files_path)
+        if engine == "combined":
+            rules = rule_set.matcher(white_label_list)
+        else:
+            rules = rule_set.rules(white_label_list)
 
-        merged_results = RegexModelOutputMerger(regex_json_files_path_list=regex_json_files_path_list,
+        merged_results = RegexModelOutputMerger(regex_json_files_path_list=rules,
                                                 model_results=model_results,
                                                 text=text,
-                                                white_label_list=white_label_list)
+                                                white_label_list=white_label_list,
+                                                engine=engine,
+                                                context_matcher=rule_set.context_matcher(white_label_list),
+                                                time_budget=time_budget,
+                                                profile=rule_set.profile)
         return merged_results
 
     def relation_result(self, sentences, ner_chunk_results, relation_classifier,
-                        relation_white_label_list, relation_pairs, return_svg=False):
+                        relation_white_label_list, relation_pairs, return_svg=False, pruning=None):
         """It returns the relation results of a text.
         parameters:
         ----------------
@@ -160,6 +197,7 @@ class Pipeline:
         one_to_many: bool = True
         one_label: str = None
         return_svg: bool = False
+        pruning: RelationPruning = None
         return:
         ----------------
         results: list of dict
@@ -169,7 +207,36 @@ class Pipeline:
                                   relation_classifier=relation_classifier,
                                   relation_white_label_list=relation_white_label_list,
                                   relation_pairs =relation_pairs,
-                                  return_svg=return_svg)
+                                  return_svg=return_svg,
+                                  pruning=pruning)
+        return results
+
+    def relation_batch_result(self, sentences_list, ner_chunk_results_list, relation_classifier,
+                              relation_white_label_list, relation_pairs, return_svg=False, batch_size=32,
+                              pruning=None):
+        """It returns the relation results of a batch of texts, classifying their candidates together.
+        parameters:
+        ----------------
+        sentences_list: list of list of str
+        ner_chunk_results_list: list of list of dict
+        relation_classifier: transformers.Pipeline
+        relation_white_label_list: list of str
+        relation_pairs: list of tuple
+        return_svg: bool = False
+        batch_size: int = 32
+        pruning: RelationPruning = None
+        return:
+        ----------------
+        results: list of list of dict
+        """
+        results = RelationBatchResults(sentences_list=sentences_list,
+                                       ner_chunk_results_list=ner_chunk_results_list,
+                                       relation_classifier=relation_classifier,
+                                       relation_white_label_list=relation_white_label_list,
+                                       relation_pairs=relation_pairs,
+                                       return_svg=return_svg,
+                                       batch_size=batch_size,
+                                       pruning=pruning)
         return results
 
  
@@ -2,9 +2,921 @@
 # Date: 2023-March-12
 # Description: This file contains the regex parser for de-identification of clinical notes
 
+import bisect
+import glob
+import itertools
 import json
+import os
 import re
 import operator
+import threading
+import time
+import warnings
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
+
+# inline global flags at the start of a pattern, e.g. (?i)
+GLOBAL_FLAGS_PATTERN = re.compile(r"^\(\?([aiLmsux]+)\)")
+# separates the match texts that CombinedRegexMatcher searches for conflicts, a non-word character like the
+# ends of the text
+MATCH_TEXT_SEPARATOR = "\x00"
+
+
+class RegexRule:
+    """
+    A single regex rule of a json rule file, compiled once.
+    The prefix and suffix collocations are lowercased ahead of time, and the literal substrings that every
+    match contains are extracted from the pattern, so a text without them is skipped without running the regex.
+    The optional "requires" key of the rule file lists literals of which at least one (case-insensitive) must be
+    in the text for the rule to match.
+    parameters:
+    ----------------
+    label: str
+    regex: str
+    context_length: int
+    prefix: list of str
+    suffix: list of str
+    path: str
+    requires: str or list of str
+    """
+
+    def __init__(self, label, regex, context_length=0, prefix=None, suffix=None, path=None, requires=None):
+        self.label = label
+        self.regex = regex
+        self.pattern = re.compile(regex)
+        self.context_length = context_length
+        self.prefix = [pre.lower() for pre in prefix or []]
+        self.suffix = [sfx.lower() for sfx in suffix or []]
+        self.path = path
+        self.name = os.path.basename(path) if path else label
+        if isinstance(requires, str):
+            requires = [requires]
+        self.requires = [literal.lower() for literal in requires or []]
+        self.literals = _required_literals(sre_parse.parse(regex), bool(self.pattern.flags & re.IGNORECASE))
+
+    @property
+    def needs_lowered_text(self):
+        """Whether may_match uses the lowercased text."""
+        return bool(self.requires) or any(ignore_case for _, ignore_case in self.literals)
+
+    def may_match(self, text, lowered=None):
+        """
+        Cheap prefilter: returns False if the text misses a literal that any match of the rule requires.
+        parameters:
+        ----------------
+        text: str
+        lowered: str, text.lower(), computed if needed and not given
+        """
+        if lowered is None and self.needs_lowered_text:
+            lowered = text.lower()
+        for literal, ignore_case in self.literals:
+            if literal not in (lowered if ignore_case else text):
+                return False
+        if self.requires and not any(literal in lowered for literal in self.requires):
+            return False
+        return True
+
+    def spans(self, text):
+        """
+        Yields the (begin, end) offsets of the chunks matched in the text.
+        Like re.findall, the chunk is the first group of the pattern if it has exactly one group.
+        """
+        group = 1 if self.pattern.groups == 1 else 0
+        for match in self.pattern.finditer(text):
+            begin, end = match.span(group)
+            if begin < end:
+                yield begin, end
+
+    def scan(self, text, time_budget=None, chunk_size=1000, overlap=200):
+        """
+        Returns the (begin, end) offsets of the chunks matched in the text, like spans.
+        With a time budget the scan stops at the first chunk boundary after the budget is spent, see scan_matches.
+        parameters:
+        ----------------
+        text: str
+        time_budget: float, seconds, no limit if None
+        chunk_size: int
+        overlap: int
+        return:
+        ----------------
+        spans: list of (begin, end)
+        timed_out: bool
+        """
+        if time_budget is None:
+            return list(self.spans(text)), False
+        group = 1 if self.pattern.groups == 1 else 0
+        matches, timed_out = scan_matches(self.pattern, text, time_budget, chunk_size, overlap)
+        spans = [match.span(group) for match in matches]
+        return [(begin, end) for begin, end in spans if begin < end], timed_out
+
+    def context_match(self, text, begin, end):
+        """Checks the prefix and suffix collocations of a chunk in the scope of context length."""
+        if not self.prefix and not self.suffix:
+            return True
+        if self.prefix:
+            before = text[max(begin - self.context_length, 0):begin].lower()
+            if any(pre in before for pre in self.prefix):
+                return True
+        if self.suffix:
+            after = text[end:end + self.context_length].lower()
+            if any(sfx in after for sfx in self.suffix):
+                return True
+        return False
+
+    def result(self, text, begin, end):
+        """Returns the parser result of a chunk."""
+        return {'chunk': text[begin:end], 'confidence': 1, 'begin': begin, 'end': end, 'entity': self.label}
+
+    def combinable_regex(self):
+        """
+        Returns the regex of the rule in a form that can be joined into an alternation with other rules,
+        or None if the rule must be scanned on its own (group references, named groups, global flags
+        that can not be scoped).
+        """
+        if self.pattern.groupindex:
+            return None
+        for op in _walk_opcodes(sre_parse.parse(self.regex)):
+            if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+                return None
+        regex = self.regex
+        flags = GLOBAL_FLAGS_PATTERN.match(regex)
+        if flags:
+            if not set(flags.group(1)) <= set("imsx"):
+                return None
+            regex = f"(?{flags.group(1)}:{regex[flags.end():]})"
+        return regex
+
+    @classmethod
+    def from_file(cls, path):
+        """Loads and compiles the rule of a json rule file."""
+        with open(path, 'r', encoding="utf8") as f:
+            file = json.load(f)
+        return cls(label=file["label"],
+                   regex=file["regex"],
+                   context_length=file["contextLength"],
+                   prefix=file["prefix"],
+                   suffix=file["suffix"],
+                   path=path,
+                   requires=file.get("requires"))
+
+    def __repr__(self):
+        return f"RegexRule(label={self.label!r}, path={self.path!r})"
+
+
+class AhoCorasick:
+    """
+    Pure-Python Aho-Corasick automaton that finds all the occurrences of a list of keywords
+    in a single pass over the text.
+    parameters:
+    ----------------
+    keywords: list of str, non-empty
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.lengths = [len(keyword) for keyword in self.keywords]
+        goto, fail, output = [{}], [0], [[]]
+        for idx, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    fail.append(0)
+                    output.append([])
+                state = next_state
+            output[state].append(idx)
+        queue = list(goto[0].values())
+        for state in queue:
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                failure = fail[state]
+                while failure and char not in goto[failure]:
+                    failure = fail[failure]
+                failure = goto[failure].get(char, 0)
+                fail[next_state] = failure if failure != next_state else 0
+                output[next_state] = output[next_state] + output[fail[next_state]]
+        self._goto, self._fail, self._output = goto, fail, output
+
+    def iter(self, text, start=0, end=None):
+        """
+        Yields the (begin, keyword index) of the keyword occurrences in text[start:end].
+        """
+        goto, fail, output, lengths = self._goto, self._fail, self._output, self.lengths
+        state = 0
+        for pos in range(start, len(text) if end is None else end):
+            char = text[pos]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for idx in output[state]:
+                yield pos + 1 - lengths[idx], idx
+
+
+class _KeywordHits:
+    """Sorted keyword occurrences of a rule, answering "is there an occurrence inside [begin, end)" by bisection."""
+
+    def __init__(self, hits, keyword_ids, lengths):
+        occurrences = sorted((begin, begin + lengths[idx]) for idx in keyword_ids for begin in hits.get(idx, ()))
+        self.begins = [begin for begin, _ in occurrences]
+        # min_ends[i] is the smallest end of the occurrences beginning at or after begins[i]
+        self.min_ends = [end for _, end in occurrences]
+        for i in range(len(self.min_ends) - 2, -1, -1):
+            if self.min_ends[i + 1] < self.min_ends[i]:
+                self.min_ends[i] = self.min_ends[i + 1]
+
+    def within(self, begin, end):
+        i = bisect.bisect_left(self.begins, begin)
+        return i < len(self.begins) and self.min_ends[i] <= end
+
+
+class ContextKeywordMatcher:
+    """
+    Checks the prefix and suffix collocations of many chunks at once. The keywords of all the rules are
+    compiled into one AhoCorasick automaton that runs once over the lowercased context windows of the
+    chunks, and each chunk's check becomes a range query on the keyword occurrences.
+    With few keywords the substring checks of each chunk are cheaper than the pure-Python automaton,
+    so the automaton is only used from min_keywords keywords on.
+    parameters:
+    ----------------
+    rules: list of RegexRule
+    min_keywords: int
+    """
+
+    def __init__(self, rules, min_keywords=100):
+        keywords = sorted({keyword for rule in rules for keyword in rule.prefix + rule.suffix if keyword})
+        self.automaton = AhoCorasick(keywords)
+        self.min_keywords = min_keywords
+        ids = {keyword: idx for idx, keyword in enumerate(keywords)}
+        self._keyword_ids = {}
+        for rule in rules:
+            if "" in rule.prefix or "" in rule.suffix:
+                # an empty collocation is found in any context, like `"" in before`
+                self._keyword_ids[rule] = None
+                continue
+            self._keyword_ids[rule] = ([ids[keyword] for keyword in rule.prefix],
+                                       [ids[keyword] for keyword in rule.suffix])
+
+    def _windows(self, rule_spans, length):
+        windows = []
+        for rule, spans in rule_spans:
+            if self._keyword_ids.get(rule) is None:
+                continue
+            prefix_ids, suffix_ids = self._keyword_ids[rule]
+            for begin, end in spans:
+                if prefix_ids:
+                    windows.append((max(begin - rule.context_length, 0), begin))
+                if suffix_ids:
+                    windows.append((end, min(end + rule.context_length, length)))
+        windows.sort()
+        merged = []
+        for begin, end in windows:
+            if merged and begin <= merged[-1][1]:
+                if end > merged[-1][1]:
+                    merged[-1][1] = end
+            elif begin < end:
+                merged.append([begin, end])
+        return merged
+
+    def select(self, text, rule_spans):
+        """
+        Keeps the chunks whose prefix or suffix collocations are found in the scope of context length.
+        parameters:
+        ----------------
+        text: str
+        rule_spans: list of (RegexRule, list of (begin, end))
+        return:
+        ----------------
+        results: list of list of dict, the parser results of each rule
+        """
+        lowered = text.lower() if len(self.automaton.keywords) >= self.min_keywords else None
+        if lowered is None or len(lowered) != len(text) or any(rule not in self._keyword_ids for rule, _ in rule_spans):
+            # few keywords, lowercasing changed the offsets or unknown rules: check the context windows one by one
+            return [[rule.result(text, begin, end) for begin, end in spans if rule.context_match(text, begin, end)]
+                    for rule, spans in rule_spans]
+        hits = {}
+        for begin, end in self._windows(rule_spans, len(text)):
+            for start, idx in self.automaton.iter(lowered, begin, end):
+                hits.setdefault(idx, []).append(start)
+        results = []
+        for rule, spans in rule_spans:
+            keyword_ids = self._keyword_ids[rule]
+            if keyword_ids is None or not (rule.prefix or rule.suffix) or not spans:
+                results.append([rule.result(text, begin, end) for begin, end in spans])
+                continue
+            prefix_hits = _KeywordHits(hits, keyword_ids[0], self.automaton.lengths)
+            suffix_hits = _KeywordHits(hits, keyword_ids[1], self.automaton.lengths)
+            results.append([rule.result(text, begin, end) for begin, end in spans
+                            if prefix_hits.within(begin - rule.context_length, begin)
+                            or suffix_hits.within(end, end + rule.context_length)])
+        return results
+
+
+REPEAT_OPCODES = tuple(op for op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+                                     getattr(sre_parse, "POSSESSIVE_REPEAT", None)) if op is not None)
+
+
+def _required_literals(parsed, ignore_case, max_literals=3):
+    """
+    Returns the longest literal substrings that every match of a parsed pattern contains,
+    as a list of (literal, ignore_case), the literals being lowercased if ignore_case.
+    """
+    literals = []
+    run = []
+
+    def flush():
+        if run:
+            literal = "".join(run)
+            # case is irrelevant for literals without cased characters
+            cased = ignore_case and literal.lower() != literal.upper()
+            literals.append((literal.lower() if cased else literal, cased))
+            run.clear()
+
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        flush()
+        if op is sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, subpattern = av
+            sub_ignore_case = (ignore_case or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            literals.extend(_required_literals(subpattern, sub_ignore_case, max_literals=None))
+        elif op in REPEAT_OPCODES and av[0] >= 1:
+            literals.extend(_required_literals(av[2], ignore_case, max_literals=None))
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            literals.extend(_required_literals(av, ignore_case, max_literals=None))
+    flush()
+    literals = sorted(set(literals), key=lambda literal: (-len(literal[0]), literal))
+    return literals[:max_literals] if max_literals else literals
+
+
+CATEGORY_CLASSES = {sre_parse.CATEGORY_DIGIT: r"\d", sre_parse.CATEGORY_NOT_DIGIT: r"\D",
+                    sre_parse.CATEGORY_SPACE: r"\s", sre_parse.CATEGORY_NOT_SPACE: r"\S",
+                    sre_parse.CATEGORY_WORD: r"\w", sre_parse.CATEGORY_NOT_WORD: r"\W"}
+
+
+def _char_class(items):
+    """Returns the regex of a parsed character set, or None if it has items that can not be written back."""
+    negate = ""
+    members = []
+    for op, av in items:
+        if op is sre_parse.NEGATE:
+            negate = "^"
+        elif op is sre_parse.LITERAL:
+            members.append(re.escape(chr(av)))
+        elif op is sre_parse.RANGE:
+            members.append(f"{re.escape(chr(av[0]))}-{re.escape(chr(av[1]))}")
+        elif op is sre_parse.CATEGORY and av in CATEGORY_CLASSES:
+            members.append(CATEGORY_CLASSES[av])
+        else:
+            return None
+    return f"[{negate}{''.join(members)}]"
+
+
+def _single_char(op, av, ignore_case):
+    """Returns the regex of a parsed item that matches exactly one character, or None."""
+    if op is sre_parse.LITERAL:
+        char = re.escape(chr(av))
+    elif op is sre_parse.NOT_LITERAL:
+        char = f"[^{re.escape(chr(av))}]"
+    elif op is sre_parse.ANY:
+        char = "(?s:.)"
+    elif op is sre_parse.IN:
+        char = _char_class(av)
+    else:
+        return None
+    return f"(?i:{char})" if ignore_case and char is not None else char
+
+
+def _first_chars(parsed, ignore_case):
+    """
+    Returns the regexes of the characters that a match of a parsed pattern can start with, and whether the
+    pattern can match the empty string, or None if they can not be told. The zero-width assertions are skipped,
+    so the characters are a superset of the ones the pattern actually starts with.
+    """
+    alternatives = []
+    for op, av in parsed:
+        if op is sre_parse.AT or op is sre_parse.ASSERT or op is sre_parse.ASSERT_NOT:
+            continue
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+            char = _single_char(op, av, ignore_case)
+            if char is None:
+                return None
+            alternatives.append(char)
+            return alternatives, False
+        if op is sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, subpattern = av
+            if (add_flags | del_flags) & (re.ASCII | re.LOCALE):
+                return None
+            sub_ignore_case = (ignore_case or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            branches, optional = [subpattern], False
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            sub_ignore_case, branches, optional = ignore_case, [av], False
+        elif op in REPEAT_OPCODES:
+            sub_ignore_case, branches, optional = ignore_case, [av[2]], av[0] == 0
+        elif op is sre_parse.BRANCH:
+            sub_ignore_case, branches, optional = ignore_case, av[1], False
+        else:
+            return None
+        for branch in branches:
+            first = _first_chars(branch, sub_ignore_case)
+            if first is None:
+                return None
+            alternatives.extend(first[0])
+            optional = optional or first[1]
+        if not optional:
+            return alternatives, False
+    return alternatives, True
+
+
+def _start_regex(parsed, ignore_case, max_width=32):
+    """
+    Returns a regex that matches the start of every match of a parsed pattern, the number of characters it
+    consumes and whether it only matches the starts of the runs of a character, or None if the start can not
+    be told. The regex is the fixed width prefix of the pattern, its word boundaries included, or the characters
+    the pattern can start with if it has no such prefix. A pattern that starts with an unbounded repeat of a
+    character, like [a-z.]+@, matches one character earlier wherever it matches after that character, so only
+    the starts of the runs of the character followed by the next character of the pattern need to be tried.
+    """
+    if parsed and parsed[0][0] in REPEAT_OPCODES:
+        low, high, item = parsed[0][1]
+        char = _single_char(*item[0], ignore_case) if len(item) == 1 else None
+        if (char is not None and low >= 1 and high == sre_parse.MAXREPEAT and
+                not re.match(char, MATCH_TEXT_SEPARATOR)):
+            # the character after the run, unless the run reaches the end of the text searched
+            follow = _single_char(*parsed[1], ignore_case) if len(parsed) > 1 else None
+            run = f"{char}+(?:{follow}|{re.escape(MATCH_TEXT_SEPARATOR)})" if follow is not None else char
+            return f"(?<!{char})(?={run})", 1, True
+    parts, width = [], 0
+    for op, av in parsed:
+        if width >= max_width:
+            break
+        if op is sre_parse.AT and av in (sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY):
+            parts.append(r"\b" if av is sre_parse.AT_BOUNDARY else r"\B")
+            continue
+        char = _single_char(op, av, ignore_case)
+        if char is not None:
+            parts.append(char)
+            width += 1
+            continue
+        if op in REPEAT_OPCODES and av[0] >= 1 and len(av[2]) == 1:
+            char = _single_char(*av[2][0], ignore_case)
+            if char is not None:
+                count = min(av[0], max_width)
+                parts.append(f"{char}{{{count}}}")
+                width += count
+                if av[0] == av[1]:
+                    continue
+        break
+    if width == 0:
+        first = _first_chars(parsed, ignore_case)
+        if first is None or first[1]:
+            return None
+        parts.append(f"(?:{'|'.join(first[0])})")
+        width = 1
+    return "".join(parts), width, False
+
+
+def scan_matches(pattern, text, time_budget=None, chunk_size=1000, overlap=200):
+    """
+    Finds the matches of a pattern in the text. With a time budget the text is scanned chunk by chunk,
+    each search being limited to chunk_size + overlap characters, and the scan stops once the budget is spent,
+    so a pattern that backtracks catastrophically can not stall the whole text.
+    The budget is checked between the chunks only: the re module can not interrupt a search in progress, so a
+    single chunk can still overrun the budget, by a time that grows with chunk_size + overlap. Matches longer
+    than overlap characters can be cut.
+    parameters:
+    ----------------
+    pattern: re.Pattern
+    text: str
+    time_budget: float, seconds, no limit if None
+    chunk_size: int
+    overlap: int
+    return:
+    ----------------
+    matches: list of re.Match
+    timed_out: bool
+    """
+    if time_budget is None:
+        return list(pattern.finditer(text)), False
+    deadline = time.perf_counter() + time_budget
+    matches = []
+    pos, length = 0, len(text)
+    while pos < length:
+        chunk_end = min(pos + chunk_size, length)
+        next_pos = chunk_end
+        for match in pattern.finditer(text, pos, min(chunk_end + overlap, length)):
+            if match.start() >= chunk_end:
+                break
+            matches.append(match)
+            next_pos = max(next_pos, match.end())
+        pos = next_pos
+        if pos < length and time.perf_counter() > deadline:
+            return matches, True
+    return matches, False
+
+
+class RegexProfile:
+    """
+    Thread-safe per-rule timing and match counters of the regex parsing.
+    RegexRuleSet keeps one for all the texts parsed through the Pipeline, report ranks the rules by cost.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = {}
+
+    def record(self, name, seconds=0.0, matches=0, accepted=0, skipped=False, timed_out=False):
+        """
+        Records one parse of a text by a rule.
+        parameters:
+        ----------------
+        name: str, rule name
+        seconds: float, scan time
+        matches: int, regex matches
+        accepted: int, matches kept after the prefix and suffix checks
+        skipped: bool, the rule was skipped by its literal prefilter
+        timed_out: bool, the scan ran out of its time budget
+        """
+        with self._lock:
+            stats = self._rules.get(name)
+            if stats is None:
+                stats = self._rules[name] = {'rule': name, 'calls': 0, 'skipped': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                             'matches': 0, 'accepted': 0, 'timeouts': 0}
+            stats['calls'] += 1
+            stats['skipped'] += int(skipped)
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['matches'] += matches
+            stats['accepted'] += accepted
+            stats['timeouts'] += int(timed_out)
+
+    def report(self):
+        """
+        Returns the rule statistics, the most expensive rule first.
+        return:
+        ----------------
+        report: list of dict
+        """
+        with self._lock:
+            report = [dict(stats) for stats in self._rules.values()]
+        for stats in report:
+            scanned = stats['calls'] - stats['skipped']
+            stats['mean_seconds'] = stats['seconds'] / scanned if scanned else 0.0
+        report.sort(key=lambda stats: (stats['seconds'], stats['max_seconds']), reverse=True)
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._rules = {}
+
+
+def _walk_opcodes(parsed):
+    """Yields all the opcodes of a parsed pattern, including the ones of nested subpatterns."""
+    for op, av in parsed:
+        yield op
+        stack = [av]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, sre_parse.SubPattern):
+                yield from _walk_opcodes(value)
+            elif isinstance(value, (list, tuple)):
+                stack.extend(value)
+
+
+class CombinedRegexMatcher:
+    """
+    Scans the text once for all the compatible rules, joined into one alternation with a named group
+    per rule, and dispatches the matches to their rules. The alternation keeps the rule order, so the
+    higher priority rule wins when several rules match at the same position. Since the text is consumed
+    once for all the combined rules, a rule is not tried inside the match of another rule, so the positions
+    that the scan skipped are checked afterwards and the rules matching there are rescanned one by one.
+    The results are then those of the individual scans.
+    Rules that can not be combined (group references, named groups, global flags) fall back to
+    individual scans.
+    With the re module, the alternation is tried rule by rule at every position of the text and loses the
+    literal prefix search of the single rules, so the single scan is not faster than the individual scans
+    for most rule sets, and the rules whose matches overlap are scanned twice. Use it only when
+    benchmark_regex_engines or profile_rules on the actual rules and texts shows a gain, "individual" stays the
+    default engine.
+    parameters:
+    ----------------
+    rules: list of RegexRule, in priority order
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.context = ContextKeywordMatcher(self.rules)
+        self.modes = {}
+        self._alternatives = {}
+        for idx, rule in enumerate(self.rules):
+            regex = rule.combinable_regex()
+            self.modes[rule.name] = "individual" if regex is None else "combined"
+            if regex is not None:
+                self._alternatives[idx] = regex
+        self._needs_lowered_text = any(rule.needs_lowered_text for rule in self.rules)
+        # the characters each combined rule can start with, None if the rule must be tried at every position
+        self._starts = {idx: self._start_finder(self.rules[idx]) for idx in self._alternatives}
+        self._start_width = max((finder[1] for finder in self._starts.values() if finder is not None), default=1)
+        self._patterns = {}
+        self._lock = threading.Lock()
+
+    def _pattern(self, active):
+        """Returns the compiled alternation of the active combined rules and its group to (rule, chunk group) map."""
+        compiled = self._patterns.get(active)
+        if compiled is None:
+            pattern = re.compile("|".join(f"(?P<_r{idx}>{self._alternatives[idx]})" for idx in active))
+            groups = {}
+            for idx in active:
+                group = pattern.groupindex[f"_r{idx}"]
+                # like re.findall, the chunk is the only group of the rule if it has one
+                chunk_group = group + 1 if self.rules[idx].pattern.groups == 1 else group
+                groups[group] = (idx, chunk_group)
+            compiled = (pattern, groups)
+            with self._lock:
+                if len(self._patterns) >= 64:
+                    self._patterns.clear()
+                self._patterns[active] = compiled
+        return compiled
+
+    @staticmethod
+    def _start_finder(rule):
+        """Returns the compiled lookahead of the start of the matches of a rule, its width and runs, or None."""
+        if rule.pattern.flags & (re.ASCII | re.LOCALE):
+            return None
+        start = _start_regex(sre_parse.parse(rule.regex), bool(rule.pattern.flags & re.IGNORECASE))
+        if start is None:
+            return None
+        regex, width, runs = start
+        return re.compile(regex if runs else f"(?={regex})"), width, runs
+
+    def _conflicts(self, text, matches, groups, active):
+        """
+        Returns the combined rules that match where the combined scan did not try them: inside the match of
+        another rule, or at its start for the rules of lower priority. The other rules have the same matches
+        as when they are scanned one by one.
+        A rule is only tried where the start of its pattern (fixed width prefix, or first characters) is found by
+        one search over the match texts of another rule, joined with the characters around them.
+        """
+        if not matches:
+            return set()
+        spans = {idx: [] for idx in active}
+        for match in matches:
+            start, end = match.span()
+            if start < end:
+                spans[groups[match.lastindex][0]].append((start, end))
+        width = self._start_width
+        regions = {}
+        for winner, winner_spans in spans.items():
+            if winner_spans:
+                # the character before each match and the width characters after it keep the boundaries and
+                # the prefixes that run past the match, the separators stand for the ends of the text
+                pieces = [(text[start - 1] if start else MATCH_TEXT_SEPARATOR) + text[start:end + width] +
+                          MATCH_TEXT_SEPARATOR
+                          for start, end in winner_spans]
+                offsets = list(itertools.accumulate((len(piece) for piece in pieces), initial=0))
+                regions[winner] = (winner_spans, offsets, "".join(pieces))
+        rank = {idx: position for position, idx in enumerate(active)}
+        conflicts = set()
+        for idx in active:
+            pattern = self.rules[idx].pattern
+            finder = self._starts[idx]
+            for winner, (winner_spans, offsets, joined) in regions.items():
+                if winner == idx:
+                    continue
+                skip = 0 if rank[idx] > rank[winner] else 1
+                if finder is None:
+                    positions = (pos for start, end in winner_spans for pos in range(start + skip, end))
+                else:
+                    positions = self._positions(finder[0], winner_spans, offsets, joined, skip, finder[2])
+                if any(pattern.match(text, pos) for pos in positions):
+                    conflicts.add(idx)
+                    break
+        return conflicts
+
+    @staticmethod
+    def _positions(finder, spans, offsets, joined, skip, runs=False):
+        """
+        Yields the text positions inside the spans, past their first skip characters, where finder matches.
+        With runs, a run that starts before the first of these positions is tried at that position.
+        """
+        search = finder.search
+        found = search(joined)
+        while found is not None:
+            offset = found.start()
+            piece = bisect.bisect_right(offsets, offset) - 1
+            start, end = spans[piece]
+            position = start + offset - offsets[piece] - 1
+            if runs:
+                position = max(position, start + skip)
+            if position < end:
+                if position >= start + skip:
+                    yield position
+                found = search(joined, offset + 1)
+            else:
+                # past the match, in the characters that follow it
+                found = search(joined, offsets[piece + 1])
+
+    def parse(self, text, white_label_list=None, time_budget=None, profile=None):
+        """
+        Finds the chunks of all the rules. The rules whose required literals are not in the text are skipped,
+        and the alternation is built from the remaining combined rules.
+        parameters:
+        ----------------
+        text: str
+        white_label_list: list of str, all the rules are applied if None
+        time_budget: float, seconds, budget of the combined scan and of each individual scan
+        profile: RegexProfile, the combined scan is recorded as "<combined>"
+        return:
+        ----------------
+        results: list of list of dict, the parser results of each rule in rule order
+        """
+        lowered = text.lower() if self._needs_lowered_text else None
+        labelled = [idx for idx, rule in enumerate(self.rules)
+                    if white_label_list is None or rule.label in white_label_list]
+        candidates = [idx for idx in labelled if self.rules[idx].may_match(text, lowered)]
+        spans = [[] for _ in self.rules]
+        seconds = [0.0 for _ in self.rules]
+        timed_out = [False for _ in self.rules]
+        active = tuple(idx for idx in candidates if idx in self._alternatives)
+        if active:
+            pattern, groups = self._pattern(active)
+            start = time.perf_counter()
+            matches, combined_timed_out = scan_matches(pattern, text, time_budget)
+            for match in matches:
+                idx, chunk_group = groups[match.lastindex]
+                begin, end = match.span(chunk_group)
+                if begin < end:
+                    spans[idx].append((begin, end))
+            # a rule whose chunks may differ from its own scan falls back to it
+            for idx in self._conflicts(text, matches, groups, active):
+                spans[idx] = None
+            if combined_timed_out:
+                warnings.warn(f"Combined regex scan ran out of its {time_budget}s time budget")
+            if profile is not None:
+                profile.record("<combined>", seconds=time.perf_counter() - start, matches=len(matches),
+                               timed_out=combined_timed_out)
+        for idx in candidates:
+            if idx not in self._alternatives or spans[idx] is None:
+                start = time.perf_counter()
+                spans[idx], timed_out[idx] = self.rules[idx].scan(text, time_budget)
+                seconds[idx] = time.perf_counter() - start
+                if timed_out[idx]:
+                    warnings.warn(f"Regex rule {self.rules[idx].name} ran out of its {time_budget}s time budget")
+        results = self.context.select(text, list(zip(self.rules, spans)))
+        if profile is not None:
+            candidate_set = set(candidates)
+            for idx in labelled:
+                profile.record(self.rules[idx].name, seconds=seconds[idx], matches=len(spans[idx]),
+                               accepted=len(results[idx]), skipped=idx not in candidate_set,
+                               timed_out=timed_out[idx])
+        return results
+
+    def __repr__(self):
+        combined = sum(mode == "combined" for mode in self.modes.values())
+        return f"CombinedRegexMatcher(combined={combined}, individual={len(self.modes) - combined})"
+
+
+class RegexRuleSet:
+    """
+    Loads and compiles all the json regex rules of a directory once.
+    The rules are reloaded only when the mtime of the directory or of one of its rule files changes, the rule
+    files themselves are checked at most every check_interval seconds.
+    A rule set is safe to share across Pipeline calls and threads, use RegexRuleSet.get to reuse
+    the same instance for a directory. Its profile collects the timing and match counters of the rules.
+    parameters:
+    ----------------
+    path: str
+    check_interval: float, seconds between two checks of the rule file mtimes
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._directory_mtime = None
+        self._checked = float("-inf")
+        # (rules, filtered rules, matchers, context matchers), replaced as a whole by refresh so that the caches
+        # are always built from and stored against the rules of the same load
+        self._state = ((), {}, {}, {})
+        self.profile = RegexProfile()
+        self.refresh()
+
+    @classmethod
+    def get(cls, path):
+        """Returns the shared, up-to-date rule set of a directory."""
+        if isinstance(path, cls):
+            path.refresh()
+            return path
+        key = os.path.abspath(path)
+        with cls._instances_lock:
+            rule_set = cls._instances.get(key)
+            if rule_set is None:
+                rule_set = cls._instances[key] = cls(path)
+                return rule_set
+        rule_set.refresh()
+        return rule_set
+
+    def _files_signature(self):
+        files = sorted(glob.glob(os.path.join(self.path, "*.json")))
+        return files, tuple((file, os.stat(file).st_mtime_ns) for file in files)
+
+    def refresh(self, force=False):
+        """
+        Reloads the rules if the rule files changed since the last load. The directory mtime, which changes when
+        a rule file is added, removed or renamed, is checked on every call. The rule files, whose mtimes change
+        when they are edited in place, are listed and checked at most every check_interval seconds unless force.
+        """
+        directory_mtime = os.stat(self.path).st_mtime_ns
+        now = time.monotonic()
+        if not force and directory_mtime == self._directory_mtime and now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        files, files_signature = self._files_signature()
+        signature = (directory_mtime, files_signature)
+        self._directory_mtime = directory_mtime
+        if signature == self._signature:
+            return False
+        with self._lock:
+            if signature == self._signature:
+                return False
+            self._state = (tuple(RegexRule.from_file(file) for file in files), {}, {}, {})
+            self._signature = signature
+        return True
+
+    def rules(self, white_label_list=None):
+        """
+        Returns the rules whose label is in white_label_list, in file name order.
+        parameters:
+        ----------------
+        white_label_list: list of str, all the rules are returned if None
+        return:
+        ----------------
+        rules: tuple of RegexRule
+        """
+        return self._filter(self._state, white_label_list)
+
+    @staticmethod
+    def _filter(state, white_label_list):
+        all_rules, filtered = state[0], state[1]
+        if white_label_list is None:
+            return all_rules
+        key = frozenset(white_label_list)
+        rules = filtered.get(key)
+        if rules is None:
+            rules = filtered[key] = tuple(rule for rule in all_rules if rule.label in key)
+        return rules
+
+    def matcher(self, white_label_list=None):
+        """
+        Returns the single-scan CombinedRegexMatcher of the rules whose label is in white_label_list.
+        parameters:
+        ----------------
+        white_label_list: list of str, all the rules are combined if None
+        return:
+        ----------------
+        matcher: CombinedRegexMatcher
+        """
+        state = self._state
+        rules = self._filter(state, white_label_list)
+        matchers = state[2]
+        matcher = matchers.get(rules)
+        if matcher is None:
+            matcher = matchers[rules] = CombinedRegexMatcher(rules)
+        return matcher
+
+    def context_matcher(self, white_label_list=None):
+        """
+        Returns the ContextKeywordMatcher of the rules whose label is in white_label_list.
+        parameters:
+        ----------------
+        white_label_list: list of str, all the rules are included if None
+        return:
+        ----------------
+        context_matcher: ContextKeywordMatcher
+        """
+        state = self._state
+        rules = self._filter(state, white_label_list)
+        context_matchers = state[3]
+        context_matcher = context_matchers.get(rules)
+        if context_matcher is None:
+            context_matcher = context_matchers[rules] = ContextKeywordMatcher(rules)
+        return context_matcher
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def __repr__(self):
+        return f"RegexRuleSet(path={self.path!r}, rules={len(self)})"
 
 
 def RegexNerParser(path, text, white_label_list):
@@ -12,52 +924,58 @@ def RegexNerParser(path, text, white_label_list):
     Finds all the chunks that correspond to the regex pattern, 
     and checks their prefix and suffix collocations in the scope of context length.
     parameters:
-    path: str
+    path: str or RegexRule
     text: str
     return:
     parser_results: list of dict
     """
 
-
-    with open(path, 'r', encoding="utf8") as f:
-        file = json.load(f)
-    label = file["label"]
+    rule = path if isinstance(path, RegexRule) else RegexRule.from_file(path)
     parser_results = []
-    if label in white_label_list:
-        chunks = re.findall(file["regex"], text)
-
-        for chunk in set(chunks):
-            seek = 0
-            for i in range(chunks.count(chunk)):
-                strt = text.find(chunk, seek) - file["contextLength"]
-                if strt < 0:
-                    strt = 0
-                before = text[strt:text.find(chunk, seek)]
-                after = text[
-                        text.find(chunk, seek) + len(chunk):text.find(chunk, seek) + len(chunk) + file["contextLength"]]
-                begin = text.find(chunk, seek)
-                end = text.find(chunk, seek) + len(chunk)
-                seek = end
-                left_context, right_context = [], []
-                if file["prefix"]:
-                    left_context = [True if pre.lower() in before.lower() else False for pre in file["prefix"]]
-
-                if file["suffix"]:
-                    right_context = [True if sfx.lower() in after.lower() else False for sfx in file["suffix"]]
-                if any(left_context) or any(right_context):
-                    parser_results.append(
-                        {'chunk': chunk, 'confidence': 1, 'begin': begin, 'end': end, 'entity': file["label"]})
-                elif (not bool(file["prefix"])) and (not bool(file["suffix"])):
-                    parser_results.append(
-                        {'chunk': chunk, 'confidence': 1, 'begin': begin, 'end': end, 'entity': file["label"]})
-                else:
-                    # parser_results.append({'chunk': chunk, 'confidence':0.67, 'begin': begin, 'end':end, 'entity':file["label"]})
-                    left_context, right_context = [], []
-                    continue
+    if rule.label in white_label_list and rule.may_match(text):
+        for begin, end in rule.spans(text):
+            if rule.context_match(text, begin, end):
+                parser_results.append(rule.result(text, begin, end))
 
     return parser_results
 
 
+def PriorityNerMerger(results_by_priority):
+    """
+    Merges lists of results in one pass. A result is dropped if it overlaps a kept result of a list with
+    a higher priority, the results of the same list never drop each other.
+    The kept results are tracked as a sorted union of disjoint intervals, so each overlap check and insertion
+    is a bisection instead of a scan of all the other results.
+    parameters:
+    results_by_priority: list of list of dict, the highest priority first
+    return:
+    merged: list of dict
+    """
+    begins, ends = [], []
+    kept_by_priority = []
+    for results in results_by_priority:
+        kept = []
+        for result in results:
+            i = bisect.bisect_right(begins, result['begin']) - 1
+            if i >= 0 and ends[i] > result['begin']:
+                continue
+            if i + 1 < len(begins) and begins[i + 1] < result['end']:
+                continue
+            kept.append(result)
+        for result in kept:
+            lo = bisect.bisect_left(ends, result['begin'])
+            hi = bisect.bisect_right(begins, result['end'])
+            begin, end = result['begin'], result['end']
+            if lo < hi:
+                begin, end = min(begin, begins[lo]), max(end, ends[hi - 1])
+            begins[lo:hi] = [begin]
+            ends[lo:hi] = [end]
+        kept_by_priority.append(kept)
+    merged = [result for kept in reversed(kept_by_priority) for result in kept]
+    merged.sort(key=operator.itemgetter('begin'))
+    return merged
+
+
 def RegexModelNerMerger(rule, results_from_model):
     """
     Merges the results from regex and model.
@@ -67,36 +985,117 @@ def RegexModelNerMerger(rule, results_from_model):
     return:
     merged: list of dict
     """
-    merged = []
-    out = []
-    if results_from_model and rule:
-        out = [j for j in results_from_model for z in rule if
-               j['begin'] <= z['begin'] < j['end'] or j['begin'] < z['end'] <= j['end'] or z['begin'] <= j['begin'] < z[
-                   'end'] or z['begin'] < j['end'] <= z['end']]
-        for removed in out:
-            if removed in results_from_model:
-                results_from_model.remove(removed)
-        merged += results_from_model + rule
+    return PriorityNerMerger([rule, results_from_model])
+
+
+def RegexRulesParser(rules, text, white_label_list, context_matcher=None, time_budget=None, profile=None):
+    """
+    Parses the text with each rule on its own.
+    parameters:
+    ----------------
+    rules: list of str or list of RegexRule
+    text: str
+    white_label_list: list of str
+    context_matcher: ContextKeywordMatcher, checks the prefix and suffix collocations of all the rules in one pass
+    time_budget: float, seconds per rule, no limit if None
+    profile: RegexProfile, records the timing and match counters of each rule
+    return:
+    ----------------
+    results: list of list of dict, the parser results of each rule in rule order
+    """
+    rules = [rule if isinstance(rule, RegexRule) else RegexRule.from_file(rule) for rule in rules]
+    lowered = text.lower() if any(rule.needs_lowered_text for rule in rules) else None
+    rule_spans, stats = [], []
+    for rule in rules:
+        if rule.label not in white_label_list:
+            rule_spans.append((rule, []))
+            stats.append(None)
+            continue
+        if not rule.may_match(text, lowered):
+            rule_spans.append((rule, []))
+            stats.append((0.0, True, False))
+            continue
+        start = time.perf_counter()
+        spans, timed_out = rule.scan(text, time_budget)
+        rule_spans.append((rule, spans))
+        stats.append((time.perf_counter() - start, False, timed_out))
+        if timed_out:
+            warnings.warn(f"Regex rule {rule.name} ran out of its {time_budget}s time budget")
+    if context_matcher is not None:
+        results = context_matcher.select(text, rule_spans)
     else:
-        merged += results_from_model + rule
-    merged.sort(key=operator.itemgetter('begin'))
-    return merged
+        results = [[rule.result(text, begin, end) for begin, end in spans if rule.context_match(text, begin, end)]
+                   for rule, spans in rule_spans]
+    if profile is not None:
+        for (rule, spans), rule_results, rule_stats in zip(rule_spans, results, stats):
+            if rule_stats is not None:
+                seconds, skipped, timed_out = rule_stats
+                profile.record(rule.name, seconds=seconds, matches=len(spans), accepted=len(rule_results),
+                               skipped=skipped, timed_out=timed_out)
+    return results
 
 
-def RegexModelOutputMerger(regex_json_files_path_list, model_results, text, white_label_list):
+def RegexModelOutputMerger(regex_json_files_path_list, model_results, text, white_label_list, engine="individual",
+                           context_matcher=None, time_budget=None, profile=None):
     """Parses the text with regex and merges the results.
+    The earlier rules have priority over the later ones and the regex results have priority over the model results.
     parameters:
     ----------------
-    regex_json_files_path_list: list of str
+    regex_json_files_path_list: list of str, list of RegexRule or CombinedRegexMatcher
     model_results: list of dict
     text: str
     white_label_list: list of str
+    engine: str, "individual" scans the text once per rule,
+            "combined" scans it once for all the compatible rules with a CombinedRegexMatcher, which is
+            usually not faster with the re module, see CombinedRegexMatcher
+    context_matcher: ContextKeywordMatcher, checks the prefix and suffix collocations of the "individual"
+            engine in one pass instead of chunk by chunk
+    time_budget: float, seconds per rule scan, the scan of a rule stops at the first chunk boundary after its
+        budget is spent, see scan_matches
+    profile: RegexProfile, records the timing and match counters of each rule
     return:
     ----------------
     merged_results: list of dict
     """
-    merged = RegexNerParser(regex_json_files_path_list[0], text, white_label_list)
-    for i in range(1, len(regex_json_files_path_list)):
-        merged = RegexModelNerMerger(merged, RegexNerParser(regex_json_files_path_list[i], text, white_label_list))
-    merged_results = RegexModelNerMerger(merged, model_results)
+    if engine == "combined":
+        matcher = regex_json_files_path_list
+        if not isinstance(matcher, CombinedRegexMatcher):
+            matcher = CombinedRegexMatcher(
+                path if isinstance(path, RegexRule) else RegexRule.from_file(path) for path in matcher)
+        rule_results = matcher.parse(text, white_label_list, time_budget=time_budget, profile=profile)
+    elif engine == "individual":
+        rule_results = RegexRulesParser(regex_json_files_path_list, text, white_label_list,
+                                        context_matcher=context_matcher, time_budget=time_budget, profile=profile)
+    else:
+        raise ValueError(f"Unknown regex engine: {engine}, use 'individual' or 'combined'")
+    merged_results = PriorityNerMerger(list(rule_results) + [model_results])
     return merged_results
+
+
+def profile_rules(path, corpus, white_label_list=None, engine="individual", time_budget=None):
+    """
+    Parses a sample corpus with the rules of a directory and ranks the rules by cost.
+    parameters:
+    ----------------
+    path: str, directory of the json rule files
+    corpus: list of str
+    white_label_list: list of str, all the rules are profiled if None
+    engine: str, "individual" or "combined"
+    time_budget: float, seconds per rule scan
+    return:
+    ----------------
+    report: list of dict, the most expensive rule first
+    """
+    rule_set = RegexRuleSet(path)
+    if white_label_list is None:
+        white_label_list = sorted({rule.label for rule in rule_set.rules()})
+    if engine == "combined":
+        rules = rule_set.matcher(white_label_list)
+    else:
+        rules = rule_set.rules(white_label_list)
+    profile = RegexProfile()
+    for text in corpus:
+        RegexModelOutputMerger(rules, [], text, white_label_list, engine=engine,
+                               context_matcher=rule_set.context_matcher(white_label_list),
+                               time_budget=time_budget, profile=profile)
+    return profile.report()
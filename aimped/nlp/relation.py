@@ -2,43 +2,292 @@
 # Date 2023-March-14
 # Description This file contains the pipeline for relation extraction.
 
-import itertools
-import pandas as pd
-import numpy as np
+import bisect
+import heapq
+import re
 
-def RelationAnnotateSentence(df):
-    """It annotates the sentence with [Entity] tags.
+
+def RelationMarkSentence(sentence, sent_begin1, sent_end1, sent_begin2, sent_end2):
+    """It marks the two entities in the sentence with e1b/e1e and e2b/e2e tags.
     parameters:
     ----------------
-    df: pandas dataframe
+    sentence: str
+    sent_begin1: int
+    sent_end1: int
+    sent_begin2: int
+    sent_end2: int
     return:
     ----------------
-    df['new_sentence']: str
+    new_sentence: str
     """
 
-    a1_start = min(df['sent_begin1'] - 1, df['sent_begin2'])
-    a1_end = min(df['sent_end1'] + 1, df['sent_end2'] + 1)
+    a1_start = min(sent_begin1 - 1, sent_begin2)
+    a1_end = min(sent_end1 + 1, sent_end2 + 1)
 
-    a2_start = max(df['sent_begin1'] - 1, df['sent_begin2'])
-    a2_end = max(df['sent_end1'] + 1, df['sent_end2'] + 1)
+    a2_start = max(sent_begin1 - 1, sent_begin2)
+    a2_end = max(sent_end1 + 1, sent_end2 + 1)
 
-    df['new_sentence'] = " ".join([
-        df['sentence'][:a1_start],
+    return " ".join([
+        sentence[:a1_start],
         'e1b',
-        df['sentence'][a1_start:a1_end],
+        sentence[a1_start:a1_end],
         'e1e',
-        df['sentence'][a1_end:a2_start],
+        sentence[a1_end:a2_start],
         'e2b',
-        df['sentence'][a2_start:a2_end],
+        sentence[a2_start:a2_end],
         'e2e',
-        df['sentence'][a2_end:]
+        sentence[a2_end:]
     ])
 
+
+def RelationAnnotateSentence(df):
+    """It annotates the sentence with [Entity] tags.
+    parameters:
+    ----------------
+    df: pandas dataframe row or dict
+    return:
+    ----------------
+    df['new_sentence']: str
+    """
+
+    df['new_sentence'] = RelationMarkSentence(df['sentence'], df['sent_begin1'], df['sent_end1'],
+                                              df['sent_begin2'], df['sent_end2'])
     return df['new_sentence']
 
 
+def RelationCandidates(entities, relation_pairs):
+    """It returns the entity pairs of a sentence allowed by relation_pairs, in itertools.combinations order.
+    Only the pairs whose labels are allowed are produced, from an index of the entities by label.
+    parameters:
+    ----------------
+    entities: list of list, entity values of a sentence, the label first
+    relation_pairs: set of tuple
+    return:
+    ----------------
+    candidates: list of (int, int), positions of the first and second entity
+    """
+
+    positions_by_label = {}
+    for position, entity in enumerate(entities):
+        positions_by_label.setdefault(entity[0], []).append(position)
+    second_labels = {}
+    for label1, label2 in relation_pairs:
+        if label1 in positions_by_label and label2 in positions_by_label:
+            second_labels.setdefault(label1, []).append(label2)
+    candidates = []
+    for position1, entity in enumerate(entities):
+        labels = second_labels.get(entity[0])
+        if not labels:
+            continue
+        positions = [positions_by_label[label2] for label2 in labels]
+        positions = [label_positions[bisect.bisect_right(label_positions, position1):] for label_positions in positions]
+        candidates.extend((position1, position2) for position2 in heapq.merge(*positions))
+    return candidates
+
+
+class RelationPruning:
+    """
+    Bounds the number of relation candidates of a sentence and counts the pruned candidates.
+    The distances are measured between the closest ends of the two entities, so adjacent or
+    overlapping entities are at distance 0; tokens are whitespace separated.
+    parameters:
+    ----------------
+    max_char_distance: int, the maximum number of characters between the two entities
+    max_token_distance: int, the maximum number of tokens between the two entities
+    max_candidates_per_entity: int, the maximum number of candidates an entity takes part in, nearest first
+    nearest_k: int, a candidate is kept only if one of its entities is among the k nearest partners of the other
+    """
+
+    def __init__(self, max_char_distance=None, max_token_distance=None, max_candidates_per_entity=None,
+                 nearest_k=None):
+        self.max_char_distance = max_char_distance
+        self.max_token_distance = max_token_distance
+        self.max_candidates_per_entity = max_candidates_per_entity
+        self.nearest_k = nearest_k
+        self.reset()
+
+    def reset(self):
+        """Clears the counters."""
+        self.sentences = 0
+        self.candidates = 0
+        self.kept = 0
+        self.pruned = {"distance": 0, "nearest_k": 0, "max_candidates_per_entity": 0}
+
+    def prune(self, entities, candidates, sentence):
+        """It returns the candidates that are kept, in their original order.
+        parameters:
+        ----------------
+        entities: list of list, entity values of a sentence, the sent_begin and sent_end last
+        candidates: list of (int, int)
+        sentence: str
+        return:
+        ----------------
+        candidates: list of (int, int)
+        """
+
+        self.sentences += 1
+        self.candidates += len(candidates)
+        distances = {candidate: self._char_distance(entities, candidate) for candidate in candidates}
+        kept = candidates
+        if self.max_char_distance is not None:
+            kept = [candidate for candidate in kept if distances[candidate] <= self.max_char_distance]
+        if self.max_token_distance is not None:
+            token_starts = [match.start() for match in re.finditer(r"\S+", sentence)]
+            kept = [candidate for candidate in kept
+                    if self._token_distance(entities, candidate, token_starts) <= self.max_token_distance]
+        self.pruned["distance"] += len(candidates) - len(kept)
+
+        if self.nearest_k is not None:
+            by_entity = {}
+            for candidate in kept:
+                for position, partner in (candidate, candidate[::-1]):
+                    by_entity.setdefault(position, []).append((distances[candidate], partner))
+            nearest = {position: {partner for _, partner in sorted(partners)[:self.nearest_k]}
+                       for position, partners in by_entity.items()}
+            count = len(kept)
+            kept = [(position1, position2) for position1, position2 in kept
+                    if position2 in nearest[position1] or position1 in nearest[position2]]
+            self.pruned["nearest_k"] += count - len(kept)
+
+        if self.max_candidates_per_entity is not None:
+            counts = {}
+            selected = set()
+            for candidate in sorted(kept, key=lambda candidate: (distances[candidate], candidate)):
+                position1, position2 = candidate
+                if (counts.get(position1, 0) < self.max_candidates_per_entity
+                        and counts.get(position2, 0) < self.max_candidates_per_entity):
+                    counts[position1] = counts.get(position1, 0) + 1
+                    counts[position2] = counts.get(position2, 0) + 1
+                    selected.add(candidate)
+            self.pruned["max_candidates_per_entity"] += len(kept) - len(selected)
+            kept = [candidate for candidate in kept if candidate in selected]
+
+        self.kept += len(kept)
+        return kept
+
+    @staticmethod
+    def _char_distance(entities, candidate):
+        entity1, entity2 = entities[candidate[0]], entities[candidate[1]]
+        return max(0, max(entity1[-2], entity2[-2]) - min(entity1[-1], entity2[-1]))
+
+    @staticmethod
+    def _token_distance(entities, candidate, token_starts):
+        entity1, entity2 = entities[candidate[0]], entities[candidate[1]]
+        first_end = min(entity1[-1], entity2[-1])
+        second_begin = max(entity1[-2], entity2[-2])
+        if second_begin <= first_end:
+            return 0
+        # the tokens starting between the end of the first entity and the beginning of the second one
+        return bisect.bisect_left(token_starts, second_begin) - bisect.bisect_left(token_starts, first_end)
+
+    def report(self):
+        """It returns the candidate counts.
+        return:
+        ----------------
+        report: dict
+        """
+
+        return {"sentences": self.sentences, "candidates": self.candidates, "kept": self.kept,
+                "pruned": sum(self.pruned.values()), "pruned_by": dict(self.pruned)}
+
+    def __str__(self):
+        return (f"RelationPruning(candidates={self.candidates}, kept={self.kept}, "
+                f"pruned={sum(self.pruned.values())})")
+
+
+def RelationClassify(new_sentences, relation_classifier, batch_size=None):
+    """
+    It classifies the marked sentences sorted by length in batches of batch_size and scatters the outputs back.
+    parameters:
+    ----------------
+    new_sentences: list of str
+    relation_classifier: transformers.Pipeline
+    batch_size: int, all the sentences are sent in one call if None
+    return:
+    ----------------
+    rel_results: list of dict, aligned with new_sentences
+    """
+
+    if not new_sentences:
+        return []
+    if batch_size is None:
+        return list(relation_classifier(new_sentences))
+    rel_results = [None] * len(new_sentences)
+    order = sorted(range(len(new_sentences)), key=lambda idx: len(new_sentences[idx]))
+    for i in range(0, len(order), batch_size):
+        batch = order[i:i + batch_size]
+        outputs = relation_classifier([new_sentences[idx] for idx in batch], batch_size=batch_size)
+        for idx, rel_result in zip(batch, outputs):
+            rel_results[idx] = rel_result
+    return rel_results
+
+
+def RelationBatchResults(sentences_list, ner_chunk_results_list, relation_classifier, relation_white_label_list,
+                         relation_pairs, return_svg, batch_size=32, pruning=None):
+    """
+    It returns the relation results of a batch of texts. The candidates of all the sentences of all the texts
+    are classified together with RelationClassify, then scattered back to their texts.
+    parameters:
+    ----------------
+    sentences_list: list of list of str
+    ner_chunk_results_list: list of list of dict
+    relation_classifier: transformers.Pipeline
+    relation_white_label_list: list of str
+    relation_pairs: list of tuple
+    return_svg: bool
+    batch_size: int
+    pruning: RelationPruning, bounds the candidates of each sentence
+    return:
+    ----------------
+    results: list of list of dict, the results of each text
+    """
+
+    relation_pairs = {tuple(relation_pair) for relation_pair in relation_pairs}
+    # (text, sentence index, entities of the sentence, positions of the two entities)
+    candidates = []
+    new_sentences = []
+    for text_idx, (sentences, ner_chunk_results) in enumerate(zip(sentences_list, ner_chunk_results_list)):
+        entities_by_sentence = {}
+        for ner_chunk_result in ner_chunk_results:
+            entities_by_sentence.setdefault(ner_chunk_result['sent_idx'], []).append(list(ner_chunk_result.values()))
+        for i, entities in entities_by_sentence.items():
+            if len(entities) < 2:
+                continue
+            sentence = sentences[i]
+            sentence_candidates = RelationCandidates(entities, relation_pairs)
+            if sentence_candidates and pruning is not None:
+                sentence_candidates = pruning.prune(entities, sentence_candidates, sentence)
+            # the values are read by position: entity, chunk, begin, end, ..., sent_begin, sent_end
+            for position1, position2 in sentence_candidates:
+                candidates.append((text_idx, i, entities, position1, position2))
+                new_sentences.append(RelationMarkSentence(sentence, entities[position1][-2], entities[position1][-1],
+                                                          entities[position2][-2], entities[position2][-1]))
+    rel_results = RelationClassify(new_sentences, relation_classifier, batch_size=batch_size)
+    results_list = [[] for _ in sentences_list]
+    for (text_idx, i, entities, position1, position2), rel_result in zip(candidates, rel_results):
+        if rel_result['label'] not in relation_white_label_list:
+            continue
+        entity1, entity2 = entities[position1], entities[position2]
+        if return_svg:
+            results_list[text_idx].append({'sentID': i, 'sentence': sentences_list[text_idx][i],
+                                           'firstCharEnt1': entity1[2], 'sent_begin1': entity1[-2],
+                                           'lastCharEnt1': entity1[3], 'sent_end1': entity1[-1],
+                                           'entity1': entity1[0], 'chunk1': entity1[1],
+                                           'firstCharEnt2': entity2[2], 'sent_begin2': entity2[-2],
+                                           'lastCharEnt2': entity2[3], 'sent_end2': entity2[-1],
+                                           'entity2': entity2[0], 'chunk2': entity2[1],
+                                           'label': rel_result['label'], 'score': rel_result['score']})
+        else:
+            results_list[text_idx].append({'firstCharEnt1': entity1[2], 'lastCharEnt1': entity1[3],
+                                           'entity1': entity1[0], 'chunk1': entity1[1],
+                                           'firstCharEnt2': entity2[2], 'lastCharEnt2': entity2[3],
+                                           'entity2': entity2[0], 'chunk2': entity2[1],
+                                           'label': rel_result['label'], 'score': rel_result['score']})
+    return results_list
+
+
 def RelationResults(sentences, ner_chunk_results, relation_classifier,
-                    relation_white_label_list, relation_pairs, return_svg):
+                    relation_white_label_list, relation_pairs, return_svg, pruning=None, batch_size=None):
     """It returns the relation results of a text.
     parameters:
     ----------------
@@ -49,76 +298,81 @@ def RelationResults(sentences, ner_chunk_results, relation_classifier,
     relation_white_label_list: list of str
     relation_pairs: list of tuple
     return_svg: bool
+    pruning: RelationPruning, bounds the candidates of each sentence
+    batch_size: int, the candidates of all the sentences are sent in one classifier call if None
     return:
     ----------------
     results: list of dict
     """
 
-    end_df = pd.DataFrame()
     if len(ner_chunk_results) == 0:
-        return end_df.to_dict(orient='records')
-    else:
-        df_ner_chunk_results = pd.DataFrame(ner_chunk_results)
-        for i in df_ner_chunk_results.sent_idx.unique():
-            sentence_bazli_ner_results = df_ner_chunk_results[df_ner_chunk_results.sent_idx == i]
-            sentence_bazli_ner_results = sentence_bazli_ner_results.values.tolist()
-            if len(sentence_bazli_ner_results) >= 2:
-                df = pd.DataFrame(itertools.combinations(sentence_bazli_ner_results, 2))
-                df['firstCharEnt1'] = df[0].apply(lambda x: x[2])
-                df['lastCharEnt1'] = df[0].apply(lambda x: x[3])
-                df['entity1'] = df[0].apply(lambda x: x[0])
-                df['chunk1'] = df[0].apply(lambda x: x[1])
-                df['sent_begin1'] = df[0].apply(lambda x: x[-2])
-                df['sent_end1'] = df[0].apply(lambda x: x[-1])
-                df['firstCharEnt2'] = df[1].apply(lambda x: x[2])
-                df['lastCharEnt2'] = df[1].apply(lambda x: x[3])
-                df['entity2'] = df[1].apply(lambda x: x[0])
-                df['chunk2'] = df[1].apply(lambda x: x[1])
-                df['sent_begin2'] = df[1].apply(lambda x: x[-2])
-                df['sent_end2'] = df[1].apply(lambda x: x[-1])
-
-                df = df[df.apply(lambda row: any((row['entity1'], row['entity2']) == item for item in relation_pairs), axis=1)]
-
-
-                if len(df) != 0:
-                    df['sentID'] = i
-                    df['sentence'] = sentences[i]
-                    df = df.drop([0, 1], axis=1)
-                    df['new_sentence'] = np.nan
-                    df['new_sentence'] = df.apply(RelationAnnotateSentence, axis=1)
-                    df.reset_index(drop=True, inplace=True)
-                    rel_results = relation_classifier(list(df['new_sentence']))
-                    df = pd.concat([df, pd.DataFrame(rel_results)], axis=1)
-                    df = df[['sentID', 'sentence', 'firstCharEnt1', 'sent_begin1', 'lastCharEnt1', 'sent_end1', 'entity1',
-                             'chunk1',
-                             'firstCharEnt2', 'sent_begin2', 'lastCharEnt2', 'sent_end2', 'entity2', 'chunk2', 'label',
-                             'score'
-                             ]]
-                    df = df[df['label'].isin(relation_white_label_list)]
-                    end_df = pd.concat([end_df, df], ignore_index=True)
-
-        if end_df.empty or return_svg:
-            return end_df.to_dict(orient='records')
-
-        else:
-            return end_df[['firstCharEnt1', 'lastCharEnt1', 'entity1', 'chunk1',
-                           'firstCharEnt2', 'lastCharEnt2', 'entity2', 'chunk2', 'label', 'score']].to_dict(
-                orient='records')
+        return []
+    return RelationBatchResults([sentences], [ner_chunk_results], relation_classifier, relation_white_label_list,
+                                relation_pairs, return_svg, batch_size=batch_size, pruning=pruning)[0]
 
 ########################## neo4j knowledge graph ##########################
 import json
+import queue
+import threading
+import time
 from neo4j import GraphDatabase
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+
+
+def _iter_relation_records(json_output=None, json_file=None, relations=None, raw_chunks=False):
+    """It yields the relations of a data_json result or of RelationResults outputs, with the entity and relation
+    labels normalized like Neo4j.create_neo4j_query.
+    parameters:
+    ----------------
+    json_output: dict
+    json_file: str
+    relations: list of dict, or list of list of dict
+    raw_chunks: bool, True to keep the chunks as they are, for the writers that pass them as parameters. Otherwise
+        they are normalized like the Cypher strings of create_neo4j_query, not the same way for chunk1 and chunk2
+    return:
+    ----------------
+    records: generator of (entity1, chunk1, label, entity2, chunk2)
+    """
+
+    if json_output:
+        data = json_output["output"]["data_json"]["result"]
+    elif json_file:
+        with open(json_file) as f:
+            data = json.load(f)
+        data = data["output"]["data_json"]["result"]
+    else:
+        data = relations or []
+    for i in data:
+        for item in ([i] if isinstance(i, dict) else i):
+            if raw_chunks:
+                yield (item["entity1"].replace("-", "_"), item["chunk1"], item["label"].replace("-", "_"),
+                       item["entity2"].replace("-", "_"), item["chunk2"])
+                continue
+            yield (item["entity1"].replace("-", "_"), item["chunk1"].replace("'", ""),
+                   item["label"].replace("-", "_"),
+                   item["entity2"].replace("-", "_"), item["chunk2"].replace("-", "_"))
+
+
+def _neo4j_identifier(name):
+    """It returns a label or relationship type quoted for Cypher, they cannot be query parameters.
+    Any non-empty name is valid between backticks, the backticks of the name are escaped by doubling them."""
+    if not name:
+        raise ValueError(f"Invalid Neo4j label or relationship type: {name!r}")
+    return "`" + name.replace("`", "``") + "`"
+
 
 ## Creating a Connection Class
 class Neo4j:
 
-    def __init__(self, uri, user, pwd, db=None):
+    def __init__(self, uri, user, pwd, db=None, driver=None):
 
         self.__url = uri
         self.__user = user
         self.__pwd = pwd
-        self.__driver = None
+        self.__driver = driver
         self.db = db
+        if self.__driver is not None:
+            return
         try:
             self.__driver = GraphDatabase.driver(self.__url, auth=(self.__user, self.__pwd))
             print("Connection Successful!")
@@ -134,28 +388,15 @@ class Neo4j:
 
     def create_neo4j_query(self, json_output=None, json_file=None):
         
-        if json_output:
-            data = json_output["output"]["data_json"]["result"]
-        elif json_file:
-            with open(json_file) as f:
-                data = json.load(f)
-            data = data["output"]["data_json"]["result"]
-            
         queries = []
-        for i in data:
-            for item in i:
-                entity1 = item["entity1"].replace("-","_")
-                chunk1 = item["chunk1"].replace("'","")
-                entity2 = item["entity2"].replace("-","_")
-                chunk2 = item["chunk2"].replace("-","_")
-                label = item["label"].replace("-","_")
-                
-                query = f"""
-                MERGE (e1:{entity1} {{name: '{chunk1}'}})
-                MERGE (e2:{entity2} {{name: '{chunk2}'}})
-                MERGE (e1)-[:{label}]->(e2)
-                """
-                queries.append(query)
+        for entity1, chunk1, label, entity2, chunk2 in _iter_relation_records(json_output=json_output,
+                                                                               json_file=json_file):
+            query = f"""
+            MERGE (e1:{entity1} {{name: '{chunk1}'}})
+            MERGE (e2:{entity2} {{name: '{chunk2}'}})
+            MERGE (e1)-[:{label}]->(e2)
+            """
+            queries.append(query)
         print("Queries Created!")
         return queries            
 
@@ -199,12 +440,227 @@ class Neo4j:
         except Exception as e:
             print("Failed to write data:", e)
 
-    
-    
+    def create_constraints(self, labels, db=None):
+        """It creates a uniqueness constraint on the name of the nodes of each label, which also indexes it.
+        parameters:
+        ----------------
+        labels: iterable of str
+        db: str
+        """
+        if db is None:
+            db = self.db
+        assert self.__driver is not None, "Driver not initialized!"
+        with (self.__driver.session(database=db) if db is not None else self.__driver.session()) as session:
+            for label in sorted(set(labels)):
+                session.run(f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:{_neo4j_identifier(label)}) "
+                            f"REQUIRE n.name IS UNIQUE")
+
+    @staticmethod
+    def create_unwind_queries(records):
+        """It groups the relations by (entity1, label, entity2) and returns one parameterized query per group.
+        parameters:
+        ----------------
+        records: iterable of (entity1, chunk1, label, entity2, chunk2)
+        return:
+        ----------------
+        queries: dict of query to list of dict, the deduplicated rows of each query
+        """
+        groups = {}
+        for entity1, chunk1, label, entity2, chunk2 in records:
+            groups.setdefault((entity1, label, entity2), {})[(chunk1, chunk2)] = None
+        queries = {}
+        for (entity1, label, entity2), chunks in groups.items():
+            query = (f"UNWIND $rows AS row\n"
+                     f"MERGE (e1:{_neo4j_identifier(entity1)} {{name: row.chunk1}})\n"
+                     f"MERGE (e2:{_neo4j_identifier(entity2)} {{name: row.chunk2}})\n"
+                     f"MERGE (e1)-[:{_neo4j_identifier(label)}]->(e2)")
+            queries[query] = [{"chunk1": chunk1, "chunk2": chunk2} for chunk1, chunk2 in chunks]
+        return queries
+
+    def write_batch(self, query, rows, db=None):
+        """It writes the rows of a query in one explicit transaction."""
+        if db is None:
+            db = self.db
+        with (self.__driver.session(database=db) if db is not None else self.__driver.session()) as session:
+            with session.begin_transaction() as tx:
+                tx.run(query, rows=rows)
+                tx.commit()
+
+    def write_relations(self, json_output=None, json_file=None, relations=None, batch_size=1000, db=None,
+                        create_constraints=True):
+        """It writes the relations with parameterized UNWIND queries, batch_size rows per transaction.
+        parameters:
+        ----------------
+        json_output: dict, the format read by create_neo4j_query
+        json_file: str
+        relations: list of dict, or list of list of dict, RelationResults outputs
+        batch_size: int
+        db: str
+        create_constraints: bool, creates the uniqueness constraints of the node labels first
+        return:
+        ----------------
+        summary: dict, the number of relations, queries and transactions
+        """
+        assert self.__driver is not None, "Driver not initialized!"
+        records = list(_iter_relation_records(json_output=json_output, json_file=json_file, relations=relations,
+                                              raw_chunks=True))
+        queries = self.create_unwind_queries(records)
+        if create_constraints:
+            self.create_constraints([label for entity1, _, _, entity2, _ in records for label in (entity1, entity2)],
+                                    db=db)
+        transactions = 0
+        for query, rows in queries.items():
+            for i in range(0, len(rows), batch_size):
+                self.write_batch(query, rows[i:i + batch_size], db=db)
+                transactions += 1
+        return {"relations": len(records), "queries": len(queries), "transactions": transactions}
 
 
+class Neo4jWriter:
+    """
+    Writes relations to Neo4j in background threads, so the extraction does not wait for the database.
+    The relations are grouped into UNWIND batches like Neo4j.write_relations and pushed on a bounded queue;
+    put blocks while the queue is full. The batches failing with a transient error, such as a deadlock of two
+    workers merging the same nodes, are retried with an exponential backoff. The uniqueness constraints of the
+    new node labels are created by a worker under the same retry policy, and the batches of these labels wait
+    for them.
+    parameters:
+    ----------------
+    neo4j: Neo4j
+    batch_size: int, rows per transaction
+    workers: int
+    max_queue_size: int, batches waiting to be written
+    max_retries: int
+    retry_delay: float, seconds before the first retry
+    db: str
+    create_constraints: bool, creates the uniqueness constraints of the new node labels before their batches
+    """
 
+    RETRYABLE_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
 
+    def __init__(self, neo4j, batch_size=1000, workers=2, max_queue_size=8, max_retries=3, retry_delay=0.5,
+                 db=None, create_constraints=True):
+        self.neo4j = neo4j
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.db = db
+        self.create_constraints = create_constraints
+        self.labels = set()
+        self.errors = []
+        self._constraints = {}
+        self.written = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
 
+    def put(self, json_output=None, json_file=None, relations=None):
+        """It queues the relations, blocking while the queue is full.
+        parameters:
+        ----------------
+        json_output: dict, the format read by Neo4j.create_neo4j_query
+        json_file: str
+        relations: list of dict, or list of list of dict, RelationResults outputs
+        """
+        if self._closed:
+            raise RuntimeError("Neo4jWriter is closed")
+        records = list(_iter_relation_records(json_output=json_output, json_file=json_file, relations=relations,
+                                              raw_chunks=True))
+        created = ()
+        if self.create_constraints:
+            labels = {label for entity1, _, _, entity2, _ in records for label in (entity1, entity2)}
+            with self._lock:
+                new_labels = labels - self.labels
+                if new_labels:
+                    event = threading.Event()
+                    self._constraints.update(dict.fromkeys(new_labels, event))
+                    self.labels |= new_labels
+                created = {self._constraints[label] for label in labels}
+            if new_labels:
+                self._queue.put((self._create_constraints, (new_labels, event)))
+        for query, rows in self.neo4j.create_unwind_queries(records).items():
+            for i in range(0, len(rows), self.batch_size):
+                self._queue.put((self._write, (query, rows[i:i + self.batch_size], created)))
 
-    
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                function, args = task
+                function(*args)
+            finally:
+                self._queue.task_done()
+
+    def _create_constraints(self, labels, event):
+        try:
+            if not self._retry(self.neo4j.create_constraints, labels, db=self.db):
+                # the next put of these labels tries again
+                with self._lock:
+                    self.labels -= labels
+                    for label in labels:
+                        self._constraints.pop(label, None)
+        finally:
+            event.set()
+
+    def _write(self, query, rows, created):
+        # the constraints were queued before the batch, so a worker is already creating them
+        for event in created:
+            event.wait()
+        if self._retry(self.neo4j.write_batch, query, rows, db=self.db):
+            with self._lock:
+                self.written += len(rows)
+
+    def _retry(self, function, *args, **kwargs):
+        """It calls function, retrying the transient errors with an exponential backoff.
+        It returns False and keeps the error if the call still fails."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                function(*args, **kwargs)
+                return True
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    with self._lock:
+                        self.errors.append(e)
+                    return False
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.retry_delay * 2 ** attempt)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append(e)
+                return False
+
+    def flush(self):
+        """It waits until the queued batches are written and raises if any of them, or of the constraints, failed."""
+        self._queue.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise RuntimeError(f"{len(errors)} Neo4j batches or constraints failed to be written") from errors[0]
+
+    def close(self):
+        """It flushes the queue and stops the workers."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __str__(self):
+        return f"Neo4jWriter(workers={len(self._threads)}, written={self.written}, retries={self.retries})"
@@ -0,0 +1,397 @@
+# Author AIMPED
+# Date 2026-October-19
+# Description This file contains the offline exports and the in-memory index of relation graphs.
+
+import collections
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from aimped.nlp.relation import _iter_relation_records
+
+
+def RelationNodeId(label, name, digest_size=8):
+    """It returns the stable ID of a node, the same in every export of the node.
+    parameters:
+    ----------------
+    label: str
+    name: str
+    digest_size: int, bytes of the hash
+    return:
+    ----------------
+    node_id: str, hex digest
+    """
+
+    return hashlib.blake2b(f"{label}\x1f{name}".encode("utf8"), digest_size=digest_size).hexdigest()
+
+
+class _ChunkedCsvWriter:
+    """Writes rows to numbered csv files of at most chunk_rows rows, after a separate header file."""
+
+    def __init__(self, output_dir, name, header, chunk_rows):
+        self.output_dir = output_dir
+        self.name = name
+        self.chunk_rows = chunk_rows
+        self.header_path = os.path.join(output_dir, f"{name}_header.csv")
+        with open(self.header_path, "w", newline="", encoding="utf8") as f:
+            csv.writer(f).writerow(header)
+        self.paths = []
+        self.rows = 0
+        self._file = None
+        self._writer = None
+
+    def writerow(self, row):
+        if self.rows % self.chunk_rows == 0:
+            self._next_file()
+        self._writer.writerow(row)
+        self.rows += 1
+
+    def _next_file(self):
+        self.close()
+        path = os.path.join(self.output_dir, f"{self.name}-{len(self.paths):05d}.csv")
+        self._file = open(path, "w", newline="", encoding="utf8")
+        self._writer = csv.writer(self._file)
+        self.paths.append(path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def files(self):
+        """It returns the header file followed by the data files, as neo4j-admin reads them."""
+        return [self.header_path] + self.paths
+
+
+class RelationCsvExporter:
+    """
+    Streams relations to the node and relationship csv files of `neo4j-admin database import`.
+    The nodes and the relationships are deduplicated, with IDs hashed from the label and the name so that
+    separate exports of a corpus agree. Only the hashes of the written nodes and relationships are kept in
+    memory, the rows themselves are written as they come, in files of at most chunk_rows rows.
+    parameters:
+    ----------------
+    output_dir: str
+    chunk_rows: int
+    digest_size: int, bytes of the node IDs
+    """
+
+    NODE_HEADER = ["id:ID", "name", ":LABEL"]
+    RELATIONSHIP_HEADER = [":START_ID", ":END_ID", ":TYPE"]
+
+    def __init__(self, output_dir, chunk_rows=1000000, digest_size=8):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.digest_size = digest_size
+        self.nodes = _ChunkedCsvWriter(output_dir, "nodes", self.NODE_HEADER, chunk_rows)
+        self.relationships = _ChunkedCsvWriter(output_dir, "relationships", self.RELATIONSHIP_HEADER, chunk_rows)
+        self._node_ids = set()
+        self._relationship_ids = set()
+        self.duplicates = 0
+
+    def _node(self, label, name):
+        node_id = RelationNodeId(label, name, digest_size=self.digest_size)
+        key = int(node_id, 16)
+        if key not in self._node_ids:
+            self._node_ids.add(key)
+            self.nodes.writerow([node_id, name, label])
+        return node_id
+
+    def add(self, json_output=None, json_file=None, relations=None):
+        """It writes the relations, in the data_json format read by Neo4j.create_neo4j_query or
+        RelationResults outputs.
+        parameters:
+        ----------------
+        json_output: dict
+        json_file: str
+        relations: list of dict, or list of list of dict
+        """
+
+        for entity1, chunk1, label, entity2, chunk2 in _iter_relation_records(json_output=json_output,
+                                                                               json_file=json_file,
+                                                                               relations=relations,
+                                                                               raw_chunks=True):
+            start_id = self._node(entity1, chunk1)
+            end_id = self._node(entity2, chunk2)
+            key = hashlib.blake2b(f"{start_id}\x1f{end_id}\x1f{label}".encode("utf8"), digest_size=8).digest()
+            if key in self._relationship_ids:
+                self.duplicates += 1
+                continue
+            self._relationship_ids.add(key)
+            self.relationships.writerow([start_id, end_id, label])
+
+    def close(self):
+        """It closes the open csv files."""
+        self.nodes.close()
+        self.relationships.close()
+
+    def import_command(self, database="neo4j"):
+        """It returns the neo4j-admin command importing the exported files.
+        parameters:
+        ----------------
+        database: str
+        return:
+        ----------------
+        command: str
+        """
+
+        return (f"neo4j-admin database import full --nodes={','.join(self.nodes.files())} "
+                f"--relationships={','.join(self.relationships.files())} {database}")
+
+    def summary(self):
+        """It returns the number of written nodes, relationships and skipped duplicate relationships."""
+        return {"nodes": self.nodes.rows, "relationships": self.relationships.rows, "duplicates": self.duplicates,
+                "node_files": len(self.nodes.paths), "relationship_files": len(self.relationships.paths)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __str__(self):
+        return f"RelationCsvExporter({self.output_dir}, nodes={self.nodes.rows}, relationships={self.relationships.rows})"
+
+
+class RelationGraph:
+    """
+    In-memory graph of relation results. The nodes are interned as integer IDs and the edges of each relation
+    label are kept as CSR arrays in both directions, with the number of times each edge was seen as its weight.
+    The graph can be saved as NumPy files and loaded memory-mapped. The chunks are kept as they are, so an
+    entity is the same node on both sides of its relations, the labels have their '-' replaced by '_' like in
+    Neo4j, in add and in the lookups.
+    """
+
+    ARRAYS = ["indptr", "indices", "weights", "in_indptr", "in_indices", "in_weights"]
+
+    def __init__(self):
+        self.labels = []
+        self.relations = []
+        self._label_ids = {}
+        self._node_labels = []
+        self._names = []
+        self._name_data = None
+        self._name_offsets = None
+        self._nodes = {}
+        self._pending = {}
+        self._csr = {}
+
+    def __len__(self):
+        return len(self._node_labels)
+
+    def _intern(self, label, name):
+        key = (label, name)
+        node_id = self._nodes.get(key)
+        if node_id is None:
+            if label not in self._label_ids:
+                self._label_ids[label] = len(self.labels)
+                self.labels.append(label)
+            node_id = len(self._node_labels)
+            self._nodes[key] = node_id
+            self._node_labels.append(self._label_ids[label])
+            self._names.append(name)
+        return node_id
+
+    def _materialize(self):
+        """It turns the memory-mapped nodes of a loaded graph back into lists before adding to it."""
+        if self._name_data is not None:
+            self._names = [self._name(node_id) for node_id in range(len(self))]
+            self._node_labels = list(self._node_labels)
+            self._nodes = self._node_index()
+            self._name_data = self._name_offsets = None
+
+    def add(self, json_output=None, json_file=None, relations=None):
+        """It adds the relations, in the data_json format read by Neo4j.create_neo4j_query or
+        RelationResults outputs.
+        parameters:
+        ----------------
+        json_output: dict
+        json_file: str
+        relations: list of dict, or list of list of dict
+        """
+
+        self._materialize()
+        for entity1, chunk1, label, entity2, chunk2 in _iter_relation_records(json_output=json_output,
+                                                                               json_file=json_file,
+                                                                               relations=relations,
+                                                                               raw_chunks=True):
+            if label not in self._pending:
+                self._pending[label] = ([], [])
+                if label not in self.relations:
+                    self.relations.append(label)
+            sources, targets = self._pending[label]
+            sources.append(self._intern(entity1, chunk1))
+            targets.append(self._intern(entity2, chunk2))
+
+    def _compile(self):
+        """It merges the pending edges into the CSR arrays."""
+        n = len(self)
+        if not self._pending and all(len(csr["indptr"]) == n + 1 for csr in self._csr.values()):
+            return
+        for relation in self.relations:
+            sources, targets = self._pending.pop(relation, ([], []))
+            sources = np.asarray(sources, dtype=np.int64)
+            targets = np.asarray(targets, dtype=np.int64)
+            weights = np.ones(len(sources), dtype=np.int64)
+            csr = self._csr.get(relation)
+            if csr is not None:
+                indptr = np.asarray(csr["indptr"])
+                sources = np.concatenate([np.repeat(np.arange(len(indptr) - 1), np.diff(indptr)), sources])
+                targets = np.concatenate([csr["indices"], targets])
+                weights = np.concatenate([csr["weights"], weights])
+            # unique (source, target) pairs sorted by source then target, with the summed weights
+            keys, inverse = np.unique(sources * n + targets, return_inverse=True)
+            weights = np.bincount(inverse, weights=weights, minlength=len(keys)).astype(np.int64)
+            sources, targets = keys // n, keys % n
+            in_order = np.lexsort((sources, targets))
+            self._csr[relation] = {
+                "indptr": np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=n))]).astype(np.int64),
+                "indices": targets,
+                "weights": weights,
+                "in_indptr": np.concatenate([[0], np.cumsum(np.bincount(targets, minlength=n))]).astype(np.int64),
+                "in_indices": sources[in_order],
+                "in_weights": weights[in_order],
+            }
+
+    def _node_index(self):
+        return {(self.labels[self._node_labels[node_id]], self._name(node_id)): node_id for node_id in range(len(self))}
+
+    def _name(self, node_id):
+        if self._name_data is None:
+            return self._names[node_id]
+        return bytes(self._name_data[self._name_offsets[node_id]:self._name_offsets[node_id + 1]]).decode("utf8")
+
+    def node_id(self, label, name):
+        """It returns the ID of a node, None if the graph does not have it. The name is the chunk as it is,
+        the label is normalized like in add."""
+        if not self._nodes and len(self):
+            self._nodes = self._node_index()
+        return self._nodes.get((label.replace("-", "_"), name))
+
+    def node(self, node_id):
+        """It returns the (label, name) of a node."""
+        return self.labels[self._node_labels[node_id]], self._name(node_id)
+
+    def _slices(self, node_id, relation, direction):
+        self._compile()
+        if relation is not None:
+            relation = relation.replace("-", "_")
+        relations = self.relations if relation is None else [relation] if relation in self._csr else []
+        prefix = "" if direction == "out" else "in_"
+        for relation in relations:
+            csr = self._csr[relation]
+            begin, end = csr[prefix + "indptr"][node_id], csr[prefix + "indptr"][node_id + 1]
+            yield csr[prefix + "indices"][begin:end], csr[prefix + "weights"][begin:end]
+
+    def degree(self, node_id, relation=None, direction="out"):
+        """It returns the number of distinct edges of a node.
+        parameters:
+        ----------------
+        node_id: int
+        relation: str, all the relation labels if None
+        direction: str, "out" or "in"
+        return:
+        ----------------
+        degree: int
+        """
+
+        return int(sum(len(indices) for indices, _ in self._slices(node_id, relation, direction)))
+
+    def neighbours(self, node_id, relation=None, direction="out"):
+        """It returns the IDs of the neighbours of a node, sorted.
+        parameters:
+        ----------------
+        node_id: int
+        relation: str, all the relation labels if None
+        direction: str, "out", "in" or "both"
+        return:
+        ----------------
+        neighbours: numpy.ndarray
+        """
+
+        directions = ["out", "in"] if direction == "both" else [direction]
+        slices = [indices for direction in directions for indices, _ in self._slices(node_id, relation, direction)]
+        if len(slices) == 1:
+            return np.asarray(slices[0])
+        return np.unique(np.concatenate(slices)) if slices else np.empty(0, dtype=np.int64)
+
+    def weight(self, source_id, target_id, relation):
+        """It returns how many times the edge was added, 0 if the graph does not have it."""
+        for indices, weights in self._slices(source_id, relation, "out"):
+            position = np.searchsorted(indices, target_id)
+            if position < len(indices) and indices[position] == target_id:
+                return int(weights[position])
+        return 0
+
+    def path(self, source_id, target_id, relation=None, direction="out", max_depth=None):
+        """It returns a shortest path between two nodes with a breadth-first search.
+        parameters:
+        ----------------
+        source_id: int
+        target_id: int
+        relation: str, all the relation labels if None
+        direction: str, "out", "in" or "both"
+        max_depth: int, the maximum number of edges
+        return:
+        ----------------
+        path: list of int, the node IDs from source_id to target_id, None if there is no path
+        """
+
+        parents = {source_id: None}
+        frontier = collections.deque([(source_id, 0)])
+        while frontier:
+            node_id, depth = frontier.popleft()
+            if node_id == target_id:
+                path = []
+                while node_id is not None:
+                    path.append(node_id)
+                    node_id = parents[node_id]
+                return path[::-1]
+            if max_depth is not None and depth == max_depth:
+                continue
+            for neighbour in self.neighbours(node_id, relation, direction).tolist():
+                if neighbour not in parents:
+                    parents[neighbour] = node_id
+                    frontier.append((neighbour, depth + 1))
+        return None
+
+    def save(self, path):
+        """It saves the graph as .npy files and a graph.json file in the path directory."""
+        self._compile()
+        os.makedirs(path, exist_ok=True)
+        names = [self._name(node_id).encode("utf8") for node_id in range(len(self))]
+        np.save(os.path.join(path, "node_labels.npy"), np.asarray(self._node_labels, dtype=np.int32))
+        np.save(os.path.join(path, "name_data.npy"), np.frombuffer(b"".join(names), dtype=np.uint8))
+        np.save(os.path.join(path, "name_offsets.npy"),
+                np.concatenate([[0], np.cumsum([len(name) for name in names])]).astype(np.int64))
+        for idx, relation in enumerate(self.relations):
+            for array in self.ARRAYS:
+                np.save(os.path.join(path, f"relation_{idx}_{array}.npy"), self._csr[relation][array])
+        with open(os.path.join(path, "graph.json"), "w", encoding="utf8") as f:
+            json.dump({"labels": self.labels, "relations": self.relations, "nodes": len(self)}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """It loads a graph saved with save, memory-mapping its arrays unless mmap_mode is None."""
+        with open(os.path.join(path, "graph.json"), encoding="utf8") as f:
+            meta = json.load(f)
+        graph = cls()
+        graph.labels = meta["labels"]
+        graph.relations = meta["relations"]
+        graph._label_ids = {label: idx for idx, label in enumerate(graph.labels)}
+        graph._node_labels = np.load(os.path.join(path, "node_labels.npy"), mmap_mode=mmap_mode)
+        graph._name_data = np.load(os.path.join(path, "name_data.npy"), mmap_mode=mmap_mode)
+        graph._name_offsets = np.load(os.path.join(path, "name_offsets.npy"), mmap_mode=mmap_mode)
+        for idx, relation in enumerate(graph.relations):
+            graph._csr[relation] = {array: np.load(os.path.join(path, f"relation_{idx}_{array}.npy"),
+                                                   mmap_mode=mmap_mode)
+                                    for array in cls.ARRAYS}
+        return graph
+
+    def __str__(self):
+        self._compile()
+        edges = sum(len(csr["indices"]) for csr in self._csr.values())
+        return f"RelationGraph(nodes={len(self)}, edges={edges}, relations={self.relations})"
@@ -1,5 +1,10 @@
+import queue
 import re
+import sqlite3
+import threading
+from collections import OrderedDict
 from nltk.tokenize import sent_tokenize, word_tokenize
+from aimped.io_tasks import TranslationOutput
 
 def split_text_into_paragraphs(text):
     return text.split('\n')
@@ -11,14 +16,50 @@ def split_paragraphs_into_sentences(paragraphs, language):
         paragraphs_sentences.append(sentences)
     return paragraphs_sentences
 
-def concat_sentences(sentences, max_words=80):
+def token_lengths(texts, tokenizer):
+    """Returns the number of tokens of each text, without the special tokens, with one tokenizer call."""
+    if not texts:
+        return []
+    return [len(input_ids) for input_ids in tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+def token_budget(tokenizer, max_tokens=None):
+    """Returns the number of tokens a segment can have, the model input length without the special tokens."""
+    if max_tokens is None:
+        max_tokens = min(tokenizer.model_max_length, 512)
+        max_tokens -= tokenizer.num_special_tokens_to_add()
+    return max_tokens
+
+def split_long_sentence(sentence, tokenizer, max_tokens):
+    """Splits a sentence longer than max_tokens on whitespace into pieces of at most max_tokens tokens,
+    a single word longer than max_tokens is kept whole."""
+    words = sentence.split()
+    return concat_sentences(words, lengths=token_lengths(words, tokenizer), max_tokens=max_tokens)
+
+def concat_sentences(sentences, max_words=80, tokenizer=None, max_tokens=None, lengths=None):
+    """Packs consecutive sentences greedily into segments of at most max_words words, or of at most
+    max_tokens tokens of the translation model tokenizer when a tokenizer or the token lengths are given.
+    In the token mode the sentences longer than max_tokens are split so that no segment is truncated."""
+    if tokenizer is None and lengths is None:
+        lengths = [len(word_tokenize(sentence)) for sentence in sentences]
+        max_length = max_words
+    else:
+        if lengths is None:
+            lengths = token_lengths(sentences, tokenizer)
+        max_length = token_budget(tokenizer, max_tokens) if tokenizer is not None else max_tokens
+        if tokenizer is not None and any(length > max_length for length in lengths):
+            pieces = []
+            for sentence, length in zip(sentences, lengths):
+                pieces.extend(split_long_sentence(sentence, tokenizer, max_length) if length > max_length
+                              else [sentence])
+            sentences = pieces
+            lengths = token_lengths(sentences, tokenizer)
+
     concatenated_sentences = []
     current_concat = []
     current_word_count = 0
 
-    for sentence in sentences:
-        sentence_word_count = len(word_tokenize(sentence))
-        if current_word_count + sentence_word_count <= max_words:
+    for sentence, sentence_word_count in zip(sentences, lengths):
+        if current_word_count + sentence_word_count <= max_length:
             current_concat.append(sentence)
             current_word_count += sentence_word_count
         else:
@@ -31,11 +72,21 @@ def concat_sentences(sentences, max_words=80):
     concatenated_sentences = [sentence for sentence in concatenated_sentences if sentence]
     return concatenated_sentences
 
-def process_text(text, language):
+def process_text(text, language, tokenizer=None, max_tokens=None):
     paragraphs = split_text_into_paragraphs(text)
     paragraphs_sentences = split_paragraphs_into_sentences(paragraphs, language=language)
     all_concatenated_sentences = []
 
+    if tokenizer is not None:
+        # the token lengths of all the sentences of the text in one tokenizer call
+        lengths = iter(token_lengths([sentence for sentences in paragraphs_sentences for sentence in sentences],
+                                     tokenizer))
+        for sentences in paragraphs_sentences:
+            concatenated_sentences = concat_sentences(sentences, tokenizer=tokenizer, max_tokens=max_tokens,
+                                                      lengths=[next(lengths) for _ in sentences])
+            all_concatenated_sentences.append(concatenated_sentences)
+        return all_concatenated_sentences
+
     for sentences in paragraphs_sentences:
         concatenated_sentences = concat_sentences(sentences)
         all_concatenated_sentences.append(concatenated_sentences)
@@ -44,69 +95,451 @@ def process_text(text, language):
 
 
 
-def text_translate(input_texts, source_lang, pipeline=None):
+LANGUAGE_CODES = {
+    "en": "english",
+    "de": "german",
+    "fr": "french",
+    "es": "spanish",
+    "it": "italian",
+    "nl": "dutch",
+    "pl": "polish",
+    "pt": "portuguese",
+    "tr": "turkish",
+    "ru": "russian",
+    "ar": "arabic",
+    "zh": "chinese",
+    "ja": "japanese",
+    "ko": "korean",
+    "vi": "vietnamese",
+    "th": "thai",
+    "hi": "hindi",
+    "bn": "bengali",
+    "ro": "english",
+}
+
+URL_PATTERN = r"\b(?:https?://|ftp://|www\.)\S+(?:/\S+)?\b"
+EMAIL_PATTERN = r"\b[\w.-]+@[\w.-]+\.\w{2,4}\b"
+DOSAGE_PATTERN = (r"\b\d+(?:[.,]\d+)?\s?(?:mg|mcg|µg|g|kg|ml|mL|l|L|IU|units?|%)"
+                  r"(?:/(?:kg|m2|day|d|h|ml|mL|dose))?(?!\w)")
+ICD_PATTERN = r"\b[A-TV-Z]\d[0-9AB](?:\.[0-9A-TV-Z]{1,4})?\b"
+NUMBER_PATTERN = r"(?<![\w.,])[-+]?\d+(?:[.,]\d+)*(?![\w])"
+
+
+class PlaceholderProtector:
+    """
+    Replaces the parts of a text that must not be translated with indexed sentinels such as <URL_0>, and puts
+    them back in one pass after the translation. A sentinel dropped by the model is appended to its paragraph.
+
+    Args:
+        categories (tuple): The protected categories, among url, email, dosage, icd and number; the earlier
+            categories win when matches overlap.
+    """
+
+    PATTERNS = {"url": URL_PATTERN, "email": EMAIL_PATTERN, "dosage": DOSAGE_PATTERN, "icd": ICD_PATTERN,
+                "number": NUMBER_PATTERN}
+    SENTINEL_PATTERN = re.compile(r"<\s*(?:URL|EMAIL|DOSAGE|ICD|NUMBER)\s*_\s*(\d+)\s*>", re.IGNORECASE)
+    LETTER_PATTERN = re.compile(r"[^\W\d_]")
+
+    def __init__(self, categories=("url", "email")):
+        order = [category for category in self.PATTERNS if category in categories]
+        unknown = set(categories) - set(order)
+        if unknown:
+            raise ValueError(f"Unknown placeholder categories: {sorted(unknown)}")
+        self.categories = tuple(order)
+        self.pattern = re.compile("|".join(f"(?P<{category}>{self.PATTERNS[category]})" for category in order)) \
+            if order else None
+
+    def protect(self, text):
+        """
+        Returns the text with the sentinels and the list of the protected values, the value of <URL_i> at index i.
+        """
+        values = []
+        if self.pattern is None:
+            return text, values
+
+        def sentinel(match):
+            values.append(match.group())
+            return f"<{match.lastgroup.upper()}_{len(values) - 1}>"
+
+        return self.pattern.sub(sentinel, text), values
+
+    def restore(self, translation, values, source=None):
+        """
+        Puts the protected values back into a translation. The values of the sentinels of source, all the values
+        if source is None, that are missing from the translation are appended to it.
+        """
+        if not values:
+            return translation
+        restored = set()
+
+        def value(match):
+            idx = int(match.group(1))
+            if idx >= len(values):
+                return match.group()
+            restored.add(idx)
+            return values[idx]
+
+        translation = self.SENTINEL_PATTERN.sub(value, translation)
+        expected = range(len(values)) if source is None else \
+            [int(idx) for idx in self.SENTINEL_PATTERN.findall(source) if int(idx) < len(values)]
+        missing = [values[idx] for idx in expected if idx not in restored]
+        return " ".join([translation] + missing) if missing else translation
+
+    def is_protected(self, segment):
+        """Returns True if the segment has nothing left to translate besides its sentinels."""
+        return self.LETTER_PATTERN.search(self.SENTINEL_PATTERN.sub("", segment)) is None
+
+
+DEFAULT_PROTECTOR = PlaceholderProtector()
+
+
+def text_segments(text, source_lang, tokenizer=None, max_tokens=None, protector=DEFAULT_PROTECTOR):
     """
-    Splits the input text into sentences and creates batches of sentences to be fed into the model.
+    Splits a text into the segments to be translated, keeping its paragraph structure.
 
     Args:
-        text (str): The input text to be split into sentences.
-        source_lang (str): The language of the input text.
-        language_codes (dict): A dictionary mapping language names to their corresponding language codes.
-        input_length (int): The maximum number of tokens in a batch.
+        text (str): The input text.
+        source_lang (str): The language code of the input text.
+        tokenizer (transformers.PreTrainedTokenizer): The translation model tokenizer, the sentences are packed
+            by their number of words if None.
+        max_tokens (int): The number of tokens of a segment with a tokenizer, the model input length if None.
+        protector (PlaceholderProtector): Replaces the parts of the text that are not translated by sentinels.
 
     Returns:
-        A list of lists, where each inner list contains a batch of sentences. Each batch is represented as a list of strings.
-    """        
-
-    content = []
-    content_urls = []
-    content_emails = []
-    
-    language_codes = {
-        "en": "english",
-        "de": "german",
-        "fr": "french",
-        "es": "spanish",
-        "it": "italian",
-        "nl": "dutch",
-        "pl": "polish",
-        "pt": "portuguese",
-        "tr": "turkish",
-        "ru": "russian",
-        "ar": "arabic",
-        "zh": "chinese",
-        "ja": "japanese",
-        "ko": "korean",
-        "vi": "vietnamese",
-        "th": "thai",
-        "hi": "hindi",
-        "bn": "bengali",
-        "ro": "english",
-                     }
-   
-    url_pattern = r"\b(?:https?://|ftp://|www\.)\S+(?:/\S+)?\b"
-    email_pattern = r"\b[\w.-]+@[\w.-]+\.\w{2,4}\b"
-    output_texts = []
-    
-    for text in input_texts:
-        if source_lang == "zh":
-            paragraphs = text.split("\n")
-            t = [pipeline([i for i in re.split(r'[。！？]', p)]) if p else "\n" for p in paragraphs]
-            # print(t)
-            translation_result = "\n".join(["" if i == "\n" else " ".join([t['translation_text'] for t in i]) for i in t ])
-            # print("source_lang == zh")  
-            return translation_result  
+        A tuple (paragraphs, values): paragraphs is a list with, for each paragraph, the list of its segments
+        or None for an empty paragraph; values are the protected parts of the text.
+    """
+    text, values = protector.protect(text)
+    if source_lang == "zh":
+        paragraphs = [re.split(r'[。！？]', p) if p else None for p in text.split("\n")]
+        return paragraphs, values
+    paragraphs = [segments if segments else None
+                  for segments in process_text(text, language=LANGUAGE_CODES[source_lang], tokenizer=tokenizer,
+                                               max_tokens=max_tokens)]
+    return paragraphs, values
+
+
+def join_paragraph(translations, segments, source_lang, values=(), protector=DEFAULT_PROTECTOR):
+    """
+    Joins the translated segments of a paragraph and puts its protected values back.
+
+    Args:
+        translations (list): The translated segments of the paragraph, None for an empty paragraph.
+        segments (list): The source segments of the paragraph, None for an empty paragraph.
+        source_lang (str): The language code of the input text.
+        values (list): The protected parts of the text.
+        protector (PlaceholderProtector): The protector of the text.
+
+    Returns:
+        The translated paragraph.
+    """
+    if translations is None:
+        return "" if source_lang == "zh" else "\n"
+    return protector.restore(" ".join(translations), values, source=" ".join(segments))
+
+
+def join_translations(paragraphs, source_lang, values=(), source_paragraphs=None, protector=DEFAULT_PROTECTOR):
+    """
+    Joins the translated segments of a text back into paragraphs and puts the protected values back.
+
+    Args:
+        paragraphs (list): For each paragraph, the list of its translated segments or None.
+        source_lang (str): The language code of the input text.
+        values (list): The protected parts of the text.
+        source_paragraphs (list): The source segments of each paragraph, the dropped sentinels are appended to
+            their paragraph; to the text if None.
+        protector (PlaceholderProtector): The protector of the text.
+
+    Returns:
+        The translated text.
+    """
+    if source_paragraphs is None:
+        text = "\n".join([join_paragraph(p, p, source_lang) for p in paragraphs])
+        return protector.restore(text, values)
+    return "\n".join([join_paragraph(p, segments, source_lang, values=values, protector=protector)
+                      for p, segments in zip(paragraphs, source_paragraphs)])
+
+
+class TranslationMemory:
+    """
+    Thread-safe translation memory keyed by (model id, source language, normalized segment), with an in-memory
+    LRU and an optional SQLite tier shared between processes and restarts.
+
+    Args:
+        maxsize (int): The number of translations kept in memory.
+        path (str): The SQLite database file, no on-disk tier if None.
+    """
+
+    def __init__(self, maxsize=100000, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS translation_memory (model_id TEXT, source_lang TEXT, "
+                                     "segment TEXT, translation TEXT, PRIMARY KEY (model_id, source_lang, segment))")
+            self._connection.commit()
+
+    @staticmethod
+    def normalize(segment):
+        return " ".join(segment.split())
+
+    def _remember(self, key, translation):
+        self._items[key] = translation
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, model_id, source_lang, segment):
+        """Returns the translation of the segment, None if it is not in the memory."""
+        key = (model_id, source_lang, self.normalize(segment))
+        with self._lock:
+            translation = self._items.get(key)
+            if translation is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return translation
+            if self._connection is not None:
+                row = self._connection.execute("SELECT translation FROM translation_memory WHERE model_id = ? AND "
+                                               "source_lang = ? AND segment = ?", key).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put_many(self, model_id, source_lang, segments, translations):
+        """Stores the translations of the segments."""
+        rows = [(model_id, source_lang, self.normalize(segment), translation)
+                for segment, translation in zip(segments, translations)]
+        with self._lock:
+            for *key, translation in rows:
+                self._remember(tuple(key), translation)
+            if self._connection is not None:
+                self._connection.executemany("INSERT OR REPLACE INTO translation_memory VALUES (?, ?, ?, ?)", rows)
+                self._connection.commit()
+
+    def put(self, model_id, source_lang, segment, translation):
+        self.put_many(model_id, source_lang, [segment], [translation])
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "hit_rate": self.hit_rate,
+                "size": len(self)}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __len__(self):
+        return len(self._items)
+
+
+def pipeline_model_id(pipeline):
+    """Returns the name or path of the model of a transformers pipeline, to key a TranslationMemory."""
+    model = getattr(pipeline, "model", None)
+    return getattr(model, "name_or_path", None) or getattr(getattr(model, "config", None), "_name_or_path", None) \
+        or type(pipeline).__name__
+
+
+def translate_segments(segments, pipeline, batch_size=32, memory=None, source_lang=None, model_id=None,
+                       protector=None):
+    """
+    Translates the segments sorted by length in batches of batch_size, so that each generate call pads
+    segments of similar lengths. Identical segments are translated once, and with a translation memory
+    only the segments it does not have are sent to the pipeline.
+
+    Args:
+        segments (list): The segments to be translated.
+        pipeline (transformers.Pipeline): The translation pipeline.
+        batch_size (int): The number of segments per pipeline call.
+        memory (TranslationMemory): The translation memory.
+        source_lang (str): The language code of the segments, part of the translation memory key.
+        model_id (str): The model part of the translation memory key, the name of the pipeline model if None.
+        protector (PlaceholderProtector): The segments it reports as fully protected are kept as they are.
+
+    Returns:
+        The list of the translated segments, aligned with segments.
+    """
+    if memory is not None and model_id is None:
+        model_id = pipeline_model_id(pipeline)
+    outputs = {}
+    misses = []
+    for segment in dict.fromkeys(segments):
+        if protector is not None and protector.is_protected(segment):
+            outputs[segment] = segment
+            continue
+        translation = memory.get(model_id, source_lang, segment) if memory is not None else None
+        if translation is None:
+            misses.append(segment)
         else:
-            urls = re.findall(url_pattern, text)
-            emails = re.findall(email_pattern, text)
-            if urls: text = re.sub(url_pattern, "<URL>", text)
-            if emails: text = re.sub(email_pattern, "<EMAIL>", text)
-            translation_result = ["\n".join([" ".join([i["translation_text"] for i in pipeline(paragraph)])\
-                if paragraph else "\n" for paragraph in process_text(text,language=language_codes[source_lang])])][0]
-            
-            for url in urls:
-                translation_result = translation_result.replace("<URL>", " "+url, 1)
-            for email in emails:
-                translation_result = translation_result.replace("<EMAIL>", " "+email, 1)
-        output_texts.append(translation_result)
-    return output_texts
\ No newline at end of file
+            outputs[segment] = translation
+    misses.sort(key=len)
+    for i in range(0, len(misses), batch_size):
+        batch = misses[i:i + batch_size]
+        translations = [output["translation_text"] for output in pipeline(batch, batch_size=batch_size)]
+        outputs.update(zip(batch, translations))
+        if memory is not None:
+            memory.put_many(model_id, source_lang, batch, translations)
+    return [outputs[segment] for segment in segments]
+
+
+def pipeline_tokenizer(pipeline, max_tokens=None):
+    """Returns the tokenizer of the pipeline that the sentences are packed with, None for the word packing of a
+    pipeline without tokenizer."""
+    tokenizer = getattr(pipeline, "tokenizer", None)
+    if tokenizer is None and max_tokens is not None:
+        raise ValueError("max_tokens needs a tokenizer, the pipeline has none")
+    return tokenizer
+
+
+def text_translate(input_texts, source_lang, pipeline=None, batch_size=32, memory=None, model_id=None,
+                   tokenizer=None, max_tokens=None, protector=DEFAULT_PROTECTOR):
+    """
+    Splits the input texts into segments, translates the segments of all the texts together in batches
+    and reassembles the paragraphs of each text.
+
+    Args:
+        input_texts (list): The input texts.
+        source_lang (str): The language code of the input texts.
+        pipeline (transformers.Pipeline): The translation pipeline.
+        batch_size (int): The number of segments per pipeline call.
+        memory (TranslationMemory): The translation memory looked up before translating.
+        model_id (str): The model part of the translation memory key, the name of the pipeline model if None.
+        tokenizer (transformers.PreTrainedTokenizer): Packs the sentences by their number of tokens, the
+            tokenizer of the pipeline if None. Without any tokenizer the sentences are packed by 80 words.
+        max_tokens (int): The number of tokens of a segment, the model input length if None.
+        protector (PlaceholderProtector): Replaces the parts of the texts that are not translated, urls and
+            emails by default, by sentinels.
+
+    Returns:
+        The list of the translated texts.
+    """
+    if tokenizer is None:
+        tokenizer = pipeline_tokenizer(pipeline, max_tokens)
+    texts_segments = [text_segments(text, source_lang, tokenizer=tokenizer, max_tokens=max_tokens,
+                                    protector=protector)
+                      for text in input_texts]
+    segments = [segment for paragraphs, _ in texts_segments for p in paragraphs if p is not None
+                for segment in p]
+    translations = iter(translate_segments(segments, pipeline, batch_size=batch_size, memory=memory,
+                                          source_lang=source_lang, model_id=model_id, protector=protector))
+    output_texts = []
+    for paragraphs, values in texts_segments:
+        translated_paragraphs = [None if p is None else [next(translations) for _ in p] for p in paragraphs]
+        output_texts.append(join_translations(translated_paragraphs, source_lang, values=values,
+                                              source_paragraphs=paragraphs, protector=protector))
+    return output_texts
+
+
+def text_translate_stream(input_texts, source_lang, pipeline=None, batch_size=32, memory=None, model_id=None,
+                          tokenizer=None, max_tokens=None, protector=DEFAULT_PROTECTOR, prefetch=2):
+    """
+    Translates the input texts like text_translate, yielding each paragraph as soon as its segments are
+    translated. The segments are translated in document order by a background thread, batch_size at a time,
+    so the next batches are translated while the caller handles the yielded paragraphs.
+
+    Args:
+        input_texts (list): The input texts.
+        source_lang (str): The language code of the input texts.
+        pipeline (transformers.Pipeline): The translation pipeline.
+        batch_size (int): The number of segments per pipeline call.
+        memory (TranslationMemory): The translation memory looked up before translating.
+        model_id (str): The model part of the translation memory key, the name of the pipeline model if None.
+        tokenizer (transformers.PreTrainedTokenizer): Packs the sentences by their number of tokens, the
+            tokenizer of the pipeline if None. Without any tokenizer the sentences are packed by 80 words.
+        max_tokens (int): The number of tokens of a segment, the model input length if None.
+        protector (PlaceholderProtector): Replaces the parts of the texts that are not translated by sentinels.
+        prefetch (int): The number of translated batches waiting to be yielded.
+
+    Yields:
+        A dict with the text_idx and paragraph_idx of a translated paragraph, its translation and whether it is
+        the last paragraph of its text; "\n".join of the translations of a text is its text_translate output.
+    """
+    if tokenizer is None:
+        tokenizer = pipeline_tokenizer(pipeline, max_tokens)
+    texts_segments = [text_segments(text, source_lang, tokenizer=tokenizer, max_tokens=max_tokens,
+                                    protector=protector)
+                      for text in input_texts]
+    segments = [segment for paragraphs, _ in texts_segments for p in paragraphs if p is not None
+                for segment in p]
+    batches = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def translate():
+        try:
+            for i in range(0, len(segments), batch_size):
+                if not put(translate_segments(segments[i:i + batch_size], pipeline, batch_size=batch_size,
+                                              memory=memory, source_lang=source_lang, model_id=model_id,
+                                              protector=protector)):
+                    return
+        except Exception as e:
+            put(e)
+
+    worker = threading.Thread(target=translate, daemon=True)
+    worker.start()
+    translations = []
+    try:
+        for text_idx, (paragraphs, values) in enumerate(texts_segments):
+            for paragraph_idx, p in enumerate(paragraphs):
+                translated = None
+                if p is not None:
+                    while len(translations) < len(p):
+                        batch = batches.get()
+                        if isinstance(batch, Exception):
+                            raise batch
+                        translations.extend(batch)
+                    translated = translations[:len(p)]
+                    del translations[:len(p)]
+                translation = join_paragraph(translated, p, source_lang, values=values, protector=protector)
+                yield {"text_idx": text_idx, "paragraph_idx": paragraph_idx, "translation": translation,
+                       "last": paragraph_idx == len(paragraphs) - 1}
+    finally:
+        stop.set()
+        worker.join()
+
+
+def text_translate_stream_outputs(input_texts, source_lang, output_language, pipeline=None, **kwargs):
+    """
+    Streams text_translate_stream as TranslationOutput objects, each one with the partially translated texts
+    so far; the texts that are not started yet are empty strings.
+
+    Args:
+        input_texts (list): The input texts.
+        source_lang (str): The language code of the input texts.
+        output_language (str): The language code of the translations.
+        pipeline (transformers.Pipeline): The translation pipeline.
+        kwargs: The other arguments of text_translate_stream.
+
+    Yields:
+        TranslationOutput, with the text_idx, paragraph_idx and done keys added to its result.
+    """
+    paragraphs = [[] for _ in input_texts]
+    for item in text_translate_stream(input_texts, source_lang, pipeline=pipeline, **kwargs):
+        paragraphs[item["text_idx"]].append(item["translation"])
+        output = TranslationOutput(model_prediction=["\n".join(p) for p in paragraphs],
+                                   output_language=output_language)
+        output.output['data_json']['result'].update({"text_idx": item["text_idx"],
+                                                     "paragraph_idx": item["paragraph_idx"],
+                                                     "done": item["last"] and item["text_idx"] == len(input_texts) - 1})
+        yield output
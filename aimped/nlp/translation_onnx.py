@@ -0,0 +1,486 @@
+# Author AIMPED
+# Date 2026-October-19
+# Description This file contains the onnxruntime backend of the encoder-decoder translation models.
+
+import inspect
+import json
+import os
+
+import numpy as np
+
+ONNX_CONFIG_NAME = "onnx_config.json"
+
+
+def _num_decoder_layers(config):
+    for name in ["decoder_layers", "num_decoder_layers", "num_layers"]:
+        if getattr(config, name, None) is not None:
+            return getattr(config, name)
+    raise ValueError("The number of decoder layers of the model is not in its config")
+
+
+def _encoder_decoder_cache(past):
+    """It returns the past key values of a decoder step, from a list of (self key, self value, cross key,
+    cross value) per layer, in the format of the installed transformers version."""
+    try:
+        from transformers.cache_utils import EncoderDecoderCache
+    except ImportError:
+        return tuple(past)
+    if hasattr(EncoderDecoderCache, "from_legacy_cache"):
+        return EncoderDecoderCache.from_legacy_cache(tuple(past))
+    return EncoderDecoderCache(past)
+
+
+def _cache_tensors(cache, num_layers):
+    """It returns the list of (self key, self value, cross key, cross value) per layer of a decoder cache."""
+    if isinstance(cache, (tuple, list)):
+        return [tuple(layer) for layer in cache]
+    if hasattr(cache, "to_legacy_cache"):
+        return [tuple(layer) for layer in cache.to_legacy_cache()]
+    self_cache, cross_cache = cache.self_attention_cache, cache.cross_attention_cache
+    return [(self_cache.layers[i].keys, self_cache.layers[i].values,
+             cross_cache.layers[i].keys, cross_cache.layers[i].values) for i in range(num_layers)]
+
+
+# generation settings that OnnxSeq2SeqModel does not implement, with their neutral values
+UNSUPPORTED_GENERATION_SETTINGS = {
+    "do_sample": (None, False),
+    "num_beam_groups": (None, 1),
+    "diversity_penalty": (None, 0.0),
+    "encoder_repetition_penalty": (None, 1.0),
+    "encoder_no_repeat_ngram_size": (None, 0),
+    "sequence_bias": (None,),
+    "suppress_tokens": (None,),
+    "begin_suppress_tokens": (None,),
+    "exponential_decay_length_penalty": (None,),
+    "renormalize_logits": (None, False),
+    "force_words_ids": (None,),
+    "constraints": (None,),
+    "forced_decoder_ids": (None,),
+}
+
+
+def _generation_settings(generation_config, model_config):
+    """
+    It returns the generation settings that OnnxSeq2SeqModel applies like generate, and raises ValueError for
+    the settings it does not implement, so the exported model can not silently decode differently.
+    """
+    unsupported = [name for name, neutral in UNSUPPORTED_GENERATION_SETTINGS.items()
+                   if getattr(generation_config, name, None) not in neutral]
+    if unsupported:
+        raise ValueError(f"Generation settings not supported by the onnxruntime backend: {', '.join(unsupported)}")
+    eos_token_id = generation_config.eos_token_id if generation_config.eos_token_id is not None \
+        else model_config.eos_token_id
+    if isinstance(eos_token_id, list):
+        if len(eos_token_id) > 1:
+            raise ValueError(f"Only one eos token is supported by the onnxruntime backend: {eos_token_id}")
+        eos_token_id = eos_token_id[0]
+
+    def setting(name, default):
+        value = getattr(generation_config, name, None)
+        return default if value is None else value
+
+    return {
+        "eos_token_id": eos_token_id,
+        "forced_bos_token_id": setting("forced_bos_token_id", None),
+        "forced_eos_token_id": setting("forced_eos_token_id", None),
+        "bad_words_ids": [list(ids) for ids in setting("bad_words_ids", [])],
+        "repetition_penalty": setting("repetition_penalty", 1.0),
+        "no_repeat_ngram_size": setting("no_repeat_ngram_size", 0),
+        "min_length": setting("min_length", 0),
+        "min_new_tokens": setting("min_new_tokens", 0),
+        "max_length": setting("max_length", 256),
+        "num_beams": setting("num_beams", 1),
+        "length_penalty": setting("length_penalty", 1.0),
+        "early_stopping": setting("early_stopping", False),
+    }
+
+
+def export_seq2seq_onnx(model, output_dir, tokenizer=None, opset_version=17):
+    """
+    It exports an encoder-decoder model to three onnx graphs: the encoder, the first decoder step and the
+    decoder steps reading the past key values, with the generation settings of the model.
+    parameters:
+    ----------------
+    model: transformers.AutoModelForSeq2SeqLM
+    output_dir: str
+    tokenizer: transformers.PreTrainedTokenizer, saved with the graphs if given
+    opset_version: int
+    return:
+    ----------------
+    output_dir: str
+    """
+    import torch
+
+    num_layers = _num_decoder_layers(model.config)
+    attn_implementation, training = getattr(model.config, "_attn_implementation", None), model.training
+    # the attention masks of the eager implementation are traced with dynamic shapes
+    model.config._attn_implementation = "eager"
+    model.eval()
+
+    class Encoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.encoder = model.get_encoder()
+
+        def forward(self, input_ids, attention_mask):
+            return self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    class Decoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, decoder_input_ids, encoder_hidden_states, encoder_attention_mask):
+            outputs = self.model(encoder_outputs=(encoder_hidden_states,), attention_mask=encoder_attention_mask,
+                                 decoder_input_ids=decoder_input_ids, use_cache=True)
+            presents = [tensor for layer in _cache_tensors(outputs.past_key_values, num_layers) for tensor in layer]
+            return (outputs.logits, *presents)
+
+    class DecoderWithPast(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, decoder_input_ids, encoder_hidden_states, encoder_attention_mask, *past):
+            past_key_values = _encoder_decoder_cache([tuple(past[4 * i:4 * i + 4]) for i in range(num_layers)])
+            outputs = self.model(encoder_outputs=(encoder_hidden_states,), attention_mask=encoder_attention_mask,
+                                 decoder_input_ids=decoder_input_ids, past_key_values=past_key_values,
+                                 use_cache=True)
+            presents = [tensor for layer in _cache_tensors(outputs.past_key_values, num_layers)
+                        for tensor in layer[:2]]
+            return (outputs.logits, *presents)
+
+    os.makedirs(output_dir, exist_ok=True)
+    # the unsupported generation settings are rejected before the export
+    generation_settings = _generation_settings(getattr(model, "generation_config", None) or model.config,
+                                               model.config)
+    batch = {"input_ids": torch.tensor([[5, 6, 7, 8], [5, 6, 7, 8]]),
+             "attention_mask": torch.ones(2, 4, dtype=torch.long)}
+    # the TorchScript exporter, the dynamo one cannot take the past key values as varargs
+    export_kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    start = model.config.decoder_start_token_id
+    self_names = [name for i in range(num_layers) for name in [f"{i}.self_key", f"{i}.self_value"]]
+    cross_names = [name for i in range(num_layers) for name in [f"{i}.cross_key", f"{i}.cross_value"]]
+    layer_names = [name for i in range(num_layers)
+                   for name in [f"{i}.self_key", f"{i}.self_value", f"{i}.cross_key", f"{i}.cross_value"]]
+
+    try:
+        with torch.no_grad():
+            encoder = Encoder().eval()
+            torch.onnx.export(encoder, (batch["input_ids"], batch["attention_mask"]),
+                              os.path.join(output_dir, "encoder.onnx"),
+                              input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+                              dynamic_axes={"input_ids": {0: "batch", 1: "source"},
+                                            "attention_mask": {0: "batch", 1: "source"},
+                                            "last_hidden_state": {0: "batch", 1: "source"}},
+                              opset_version=opset_version, **export_kwargs)
+            encoder_hidden_states = encoder(batch["input_ids"], batch["attention_mask"])
+
+            decoder = Decoder().eval()
+            decoder_input_ids = torch.full((2, 1), start, dtype=torch.long)
+            decoder_inputs = (decoder_input_ids, encoder_hidden_states, batch["attention_mask"])
+            present_axes = {f"present.{name}": {0: "batch", 2: "target" if "self" in name else "source"}
+                            for name in layer_names}
+            torch.onnx.export(decoder, decoder_inputs, os.path.join(output_dir, "decoder.onnx"),
+                              input_names=["decoder_input_ids", "encoder_hidden_states", "encoder_attention_mask"],
+                              output_names=["logits"] + [f"present.{name}" for name in layer_names],
+                              dynamic_axes={"decoder_input_ids": {0: "batch", 1: "target"},
+                                            "encoder_hidden_states": {0: "batch", 1: "source"},
+                                            "encoder_attention_mask": {0: "batch", 1: "source"},
+                                            "logits": {0: "batch", 1: "target"}, **present_axes},
+                              opset_version=opset_version, **export_kwargs)
+            past = list(decoder(*decoder_inputs)[1:])
+
+            decoder_with_past = DecoderWithPast().eval()
+            past_axes = {f"past.{name}": {0: "batch", 2: "past" if "self" in name else "source"}
+                         for name in layer_names}
+            torch.onnx.export(decoder_with_past,
+                              (decoder_input_ids, encoder_hidden_states, batch["attention_mask"], *past),
+                              os.path.join(output_dir, "decoder_with_past.onnx"),
+                              input_names=["decoder_input_ids", "encoder_hidden_states", "encoder_attention_mask"]
+                                          + [f"past.{name}" for name in layer_names],
+                              output_names=["logits"] + [f"present.{name}" for name in self_names],
+                              dynamic_axes={"decoder_input_ids": {0: "batch"},
+                                            "encoder_hidden_states": {0: "batch", 1: "source"},
+                                            "encoder_attention_mask": {0: "batch", 1: "source"},
+                                            "logits": {0: "batch"}, **past_axes,
+                                            **{f"present.{name}": {0: "batch", 2: "target"}
+                                               for name in self_names}},
+                              opset_version=opset_version, **export_kwargs)
+    finally:
+        model.config._attn_implementation = attn_implementation
+        model.train(training)
+
+    config = {
+        "num_layers": num_layers,
+        "self_names": self_names,
+        "cross_names": cross_names,
+        "decoder_start_token_id": start,
+        "pad_token_id": model.config.pad_token_id,
+        **generation_settings,
+        "name_or_path": getattr(model.config, "_name_or_path", "") or output_dir,
+    }
+    with open(os.path.join(output_dir, ONNX_CONFIG_NAME), "w", encoding="utf8") as f:
+        json.dump(config, f, indent=2)
+    if tokenizer is not None:
+        tokenizer.save_pretrained(output_dir)
+    return output_dir
+
+
+def _log_softmax(logits):
+    logits = logits - logits.max(-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(-1, keepdims=True))
+
+
+class OnnxSeq2SeqModel:
+    """
+    Encoder-decoder model exported with export_seq2seq_onnx, run with onnxruntime. The encoder runs once per
+    batch and the decoder loop feeds the self-attention key values of the previous steps back, so each step
+    only computes the new token. Greedy and beam search follow the transformers generate defaults.
+    parameters:
+    ----------------
+    model_dir: str
+    providers: list of str, onnxruntime execution providers
+    session_options: onnxruntime.SessionOptions
+    """
+
+    def __init__(self, model_dir, providers=None, session_options=None):
+        import onnxruntime
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_NAME), encoding="utf8") as f:
+            self.config = json.load(f)
+        self.name_or_path = self.config.get("name_or_path") or model_dir
+        providers = providers or ["CPUExecutionProvider"]
+
+        def session(name):
+            return onnxruntime.InferenceSession(os.path.join(model_dir, name), sess_options=session_options,
+                                                providers=providers)
+
+        self.encoder = session("encoder.onnx")
+        self.decoder = session("decoder.onnx")
+        self.decoder_with_past = session("decoder_with_past.onnx")
+        # the exporter drops the inputs that a graph does not use
+        self._decoder_inputs = {node.name for node in self.decoder.get_inputs()}
+        self._decoder_with_past_inputs = {node.name for node in self.decoder_with_past.get_inputs()}
+
+    def _run(self, session, input_names, inputs):
+        return session.run(None, {name: value for name, value in inputs.items() if name in input_names})
+
+    def _process_logits(self, scores, sequences, max_length):
+        """
+        It applies the logits processors of generate, in its order: repetition penalty, repeated n-grams,
+        banned words, minimum length, forced bos token and eos token forced at max_length.
+        parameters:
+        ----------------
+        scores: numpy.ndarray (sequences, vocabulary), the logits in greedy search, the log probabilities in
+            beam search like generate
+        sequences: numpy.ndarray (sequences, length), the tokens generated so far
+        max_length: int
+        """
+        config = self.config
+        length = sequences.shape[1]
+        rows = np.arange(len(sequences))[:, None]
+        penalty = config.get("repetition_penalty", 1.0)
+        if penalty != 1.0:
+            selected = scores[rows, sequences]
+            scores[rows, sequences] = np.where(selected < 0, selected * penalty, selected / penalty)
+        ngram_size = config.get("no_repeat_ngram_size", 0)
+        if ngram_size and length + 1 >= ngram_size:
+            for row, sequence in enumerate(sequences.tolist()):
+                prefix = sequence[length - ngram_size + 1:] if ngram_size > 1 else []
+                banned = [sequence[i + ngram_size - 1] for i in range(length - ngram_size + 1)
+                          if sequence[i:i + ngram_size - 1] == prefix]
+                scores[row, banned] = -np.inf
+        eos_token_id = config["eos_token_id"]
+        bad_words_ids = config.get("bad_words_ids", [[token_id] for token_id in config.get("bad_token_ids", [])])
+        for ids in bad_words_ids:
+            if ids == [eos_token_id]:
+                continue
+            if len(ids) == 1:
+                scores[:, ids[0]] = -np.inf
+            elif length >= len(ids) - 1:
+                matches = (sequences[:, length - len(ids) + 1:] == np.asarray(ids[:-1])).all(-1)
+                scores[matches, ids[-1]] = -np.inf
+        if eos_token_id is not None and (length < config.get("min_length", 0)
+                                         or length - 1 < config.get("min_new_tokens", 0)):
+            scores[:, eos_token_id] = -np.inf
+        forced_bos_token_id = config.get("forced_bos_token_id")
+        if forced_bos_token_id is not None and length == 1:
+            scores[:, :] = -np.inf
+            scores[:, forced_bos_token_id] = 0
+        forced_eos_token_id = config["forced_eos_token_id"]
+        if forced_eos_token_id is not None and length == max_length - 1:
+            scores[:, :] = -np.inf
+            scores[:, forced_eos_token_id] = 0
+        return scores
+
+    def _first_step(self, decoder_input_ids, encoder_hidden_states, attention_mask):
+        outputs = self._run(self.decoder, self._decoder_inputs, {
+            "decoder_input_ids": decoder_input_ids, "encoder_hidden_states": encoder_hidden_states,
+            "encoder_attention_mask": attention_mask})
+        num_layers = self.config["num_layers"]
+        self_past = [outputs[1 + 4 * i + j] for i in range(num_layers) for j in range(2)]
+        cross_past = [outputs[3 + 4 * i + j] for i in range(num_layers) for j in range(2)]
+        return outputs[0][:, -1], self_past, cross_past
+
+    def _next_step(self, decoder_input_ids, encoder_hidden_states, attention_mask, self_past, cross_past):
+        inputs = {"decoder_input_ids": decoder_input_ids, "encoder_hidden_states": encoder_hidden_states,
+                  "encoder_attention_mask": attention_mask}
+        for i in range(self.config["num_layers"]):
+            inputs[f"past.{i}.self_key"], inputs[f"past.{i}.self_value"] = self_past[2 * i], self_past[2 * i + 1]
+            inputs[f"past.{i}.cross_key"], inputs[f"past.{i}.cross_value"] = cross_past[2 * i], cross_past[2 * i + 1]
+        outputs = self._run(self.decoder_with_past, self._decoder_with_past_inputs, inputs)
+        return outputs[0][:, -1], outputs[1:]
+
+    def generate(self, input_ids, attention_mask=None, num_beams=None, max_length=None):
+        """
+        It generates the output token ids.
+        parameters:
+        ----------------
+        input_ids: numpy.ndarray (batch, source)
+        attention_mask: numpy.ndarray (batch, source)
+        num_beams: int, greedy search if 1, the exported generation setting if None
+        max_length: int, the maximum number of output tokens with the decoder start token
+        return:
+        ----------------
+        sequences: list of numpy.ndarray, the output ids of each input, starting with the decoder start token
+        """
+        input_ids = np.asarray(input_ids, dtype=np.int64)
+        attention_mask = np.ones_like(input_ids) if attention_mask is None else np.asarray(attention_mask,
+                                                                                           dtype=np.int64)
+        num_beams = num_beams or self.config["num_beams"]
+        max_length = max_length or self.config["max_length"]
+        encoder_hidden_states = self._run(self.encoder, {"input_ids", "attention_mask"},
+                                          {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+        if num_beams == 1:
+            return self._greedy_search(encoder_hidden_states, attention_mask, max_length)
+        return self._beam_search(encoder_hidden_states, attention_mask, num_beams, max_length)
+
+    def _greedy_search(self, encoder_hidden_states, attention_mask, max_length):
+        batch_size = len(attention_mask)
+        eos_token_id, pad_token_id = self.config["eos_token_id"], self.config["pad_token_id"]
+        sequences = np.full((batch_size, 1), self.config["decoder_start_token_id"], dtype=np.int64)
+        finished = np.zeros(batch_size, dtype=bool)
+        logits, self_past, cross_past = self._first_step(sequences, encoder_hidden_states, attention_mask)
+        while True:
+            logits = self._process_logits(logits, sequences, max_length)
+            next_tokens = np.where(finished, pad_token_id, logits.argmax(-1))
+            sequences = np.concatenate([sequences, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == eos_token_id
+            if finished.all() or sequences.shape[1] >= max_length:
+                break
+            logits, self_past = self._next_step(next_tokens[:, None], encoder_hidden_states, attention_mask,
+                                                self_past, cross_past)
+        return [sequence[:np.argmax(sequence == eos_token_id) + 1] if (sequence == eos_token_id).any() else sequence
+                for sequence in sequences]
+
+    def _beam_search(self, encoder_hidden_states, attention_mask, num_beams, max_length):
+        batch_size = len(attention_mask)
+        eos_token_id = self.config["eos_token_id"]
+        length_penalty, early_stopping = self.config["length_penalty"], self.config["early_stopping"]
+        encoder_hidden_states = np.repeat(encoder_hidden_states, num_beams, axis=0)
+        attention_mask = np.repeat(attention_mask, num_beams, axis=0)
+        sequences = np.full((batch_size * num_beams, 1), self.config["decoder_start_token_id"], dtype=np.int64)
+        # only the first beam of each input is live before the first step
+        beam_scores = np.tile(np.array([0.0] + [-1e9] * (num_beams - 1)), batch_size)
+        hypotheses = [[] for _ in range(batch_size)]
+        done = np.zeros(batch_size, dtype=bool)
+        logits, self_past, cross_past = self._first_step(sequences, encoder_hidden_states, attention_mask)
+
+        def add_hypothesis(batch_idx, tokens, score):
+            score = score / ((len(tokens) - 1) ** length_penalty)
+            hypotheses[batch_idx].append((score, tokens))
+            hypotheses[batch_idx].sort(key=lambda hypothesis: -hypothesis[0])
+            del hypotheses[batch_idx][num_beams:]
+
+        while True:
+            length = sequences.shape[1]
+            # like generate, the processors are applied to the log probabilities in beam search
+            scores = self._process_logits(_log_softmax(logits.astype(np.float64)), sequences, max_length)
+            scores = (scores + beam_scores[:, None]).reshape(batch_size, -1)
+            vocab_size = scores.shape[1] // num_beams
+            candidates = np.argsort(-scores, axis=1, kind="stable")[:, :2 * num_beams]
+            next_scores = np.zeros(batch_size * num_beams)
+            next_tokens = np.zeros(batch_size * num_beams, dtype=np.int64)
+            next_beams = np.zeros(batch_size * num_beams, dtype=np.int64)
+            for batch_idx in range(batch_size):
+                offset = batch_idx * num_beams
+                if done[batch_idx]:
+                    next_beams[offset:offset + num_beams] = offset
+                    next_tokens[offset:offset + num_beams] = self.config["pad_token_id"]
+                    continue
+                position = 0
+                for rank, candidate in enumerate(candidates[batch_idx]):
+                    beam, token = offset + candidate // vocab_size, candidate % vocab_size
+                    score = scores[batch_idx, candidate]
+                    if token == eos_token_id:
+                        if rank < num_beams:
+                            add_hypothesis(batch_idx, np.append(sequences[beam], token), score)
+                        continue
+                    next_scores[offset + position], next_tokens[offset + position] = score, token
+                    next_beams[offset + position] = beam
+                    position += 1
+                    if position == num_beams:
+                        break
+                if len(hypotheses[batch_idx]) == num_beams:
+                    if early_stopping is True:
+                        done[batch_idx] = True
+                    else:
+                        best_running = next_scores[offset:offset + num_beams].max()
+                        highest_attainable = best_running / (length ** length_penalty)
+                        done[batch_idx] = hypotheses[batch_idx][-1][0] >= highest_attainable
+            sequences = np.concatenate([sequences[next_beams], next_tokens[:, None]], axis=1)
+            beam_scores = next_scores
+            if done.all() or sequences.shape[1] >= max_length:
+                break
+            self_past = [past[next_beams] for past in self_past]
+            logits, self_past = self._next_step(next_tokens[:, None], encoder_hidden_states, attention_mask,
+                                                self_past, cross_past)
+        for batch_idx in range(batch_size):
+            if done[batch_idx]:
+                continue
+            for beam in range(batch_idx * num_beams, (batch_idx + 1) * num_beams):
+                add_hypothesis(batch_idx, sequences[beam], beam_scores[beam])
+        return [hypotheses[batch_idx][0][1] for batch_idx in range(batch_size)]
+
+
+class OnnxTranslationPipeline:
+    """
+    Callable with the interface of a transformers translation pipeline, to be passed as the pipeline argument
+    of aimped.nlp.translation.text_translate.
+    parameters:
+    ----------------
+    model: OnnxSeq2SeqModel or str, the directory of an exported model
+    tokenizer: transformers.PreTrainedTokenizer, loaded from the model directory if None
+    num_beams: int, the exported generation setting if None
+    max_length: int, the maximum number of output tokens, the exported generation setting if None
+    max_input_length: int, the inputs are truncated to max_input_length tokens
+    """
+
+    def __init__(self, model, tokenizer=None, num_beams=None, max_length=None, max_input_length=512):
+        if isinstance(model, str):
+            if tokenizer is None:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(model)
+            model = OnnxSeq2SeqModel(model)
+        self.model = model
+        self.tokenizer = tokenizer
+        self.num_beams = num_beams
+        self.max_length = max_length
+        self.max_input_length = max_input_length
+
+    def __call__(self, texts, batch_size=None, num_beams=None, max_length=None, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        texts = list(texts)
+        batch_size = batch_size or len(texts) or 1
+        outputs = []
+        for i in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[i:i + batch_size], padding=True, truncation=True,
+                                    max_length=self.max_input_length, return_tensors="np")
+            sequences = self.model.generate(inputs["input_ids"], inputs["attention_mask"],
+                                            num_beams=num_beams or self.num_beams,
+                                            max_length=max_length or self.max_length)
+            outputs.extend({"translation_text": self.tokenizer.decode(sequence, skip_special_tokens=True)}
+                           for sequence in sequences)
+        return outputs
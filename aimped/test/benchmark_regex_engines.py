@@ -0,0 +1,72 @@
+# Benchmark of the "individual" and "combined" regex engines on a ~1 MB clinical note and on its sentences,
+# for rule sets with disjoint matches, with overlapping matches and with many keyword rules.
+# usage: python -m aimped.test.benchmark_regex_engines
+
+import random
+import time
+
+from aimped.nlp.regex_parser import RegexRule, CombinedRegexMatcher, RegexModelOutputMerger, scan_matches
+
+random.seed(0)
+drugs = ["aspirin", "ibuprofen", "metformin", "insulin", "heparin", "warfarin", "lisinopril", "atorvastatin",
+         "omeprazole", "amoxicillin", "prednisone", "albuterol", "gabapentin", "losartan", "sertraline", "tramadol",
+         "furosemide", "clopidogrel", "levothyroxine", "simvastatin"]
+words = ["patient", "denies", "pain", "admitted", "discharged", "seen on", "MRN", "follow", "up", "with", "dr.",
+         "smith", "blood", "pressure", "stable", "date", "ID"]
+sentences = []
+size = 0
+while size < 1_000_000:
+    sentence = " ".join(random.choices(words, k=12))
+    if random.random() < 0.3:
+        sentence += f" {random.randint(1, 28):02d}/{random.randint(1, 12):02d}/{random.randint(2000, 2023)}"
+    if random.random() < 0.2:
+        sentence += f" AB{random.randint(0, 999999):06d}"
+    if random.random() < 0.1:
+        sentence += f" {random.randint(100, 999)}-{random.randint(10, 99)}-{random.randint(1000, 9999)}"
+    if random.random() < 0.1:
+        sentence += f" john{random.randint(1, 99)}@mail.com"
+    if random.random() < 0.1:
+        sentence += f" tel: 555-{random.randint(1000, 9999)}"
+    if random.random() < 0.1:
+        sentence += f" on {random.choice(drugs)}"
+    sentences.append(sentence + ".")
+    size += len(sentence) + 2
+text = "\n".join(sentences)
+short_texts = sentences[:3000]
+
+disjoint = [RegexRule("DATE", r"\b\d{2}/\d{2}/\d{4}\b"), RegexRule("ID", r"\b[A-Z]{2}\d{6}\b"),
+            RegexRule("SSN", r"\b\d{3}-\d{2}-\d{4}\b"), RegexRule("EMAIL", r"[\w.-]+@[\w.-]+\.\w{2,4}"),
+            RegexRule("PHONE", r"(?i)tel: (\d{3}-\d{4})")]
+rule_sets = {
+    "disjoint": disjoint,
+    "overlapping": [RegexRule("DATE", r"\d{2}/\d{2}/\d{4}"), RegexRule("YEAR", r"\d{4}"),
+                    RegexRule("NUMBER", r"\d+"), RegexRule("ID", r"[A-Z]{2}\d{6}")],
+    "many": disjoint + [RegexRule("DRUG", rf"\b{drug}\b") for drug in drugs],
+}
+
+print(f"text: {len(text) / 1e6:.2f} MB, {len(short_texts)} short texts")
+for name, rules in rule_sets.items():
+    matcher = CombinedRegexMatcher(rules)
+    labels = sorted({rule.label for rule in rules})
+    for corpus_name, corpus in [("1 MB text", [text]), ("short texts", short_texts)]:
+        times = {}
+        for engine, parsed_rules in [("individual", rules), ("combined", matcher)]:
+            start = time.perf_counter()
+            results = [RegexModelOutputMerger(parsed_rules, [], document, labels, engine=engine)
+                       for document in corpus]
+            times[engine] = time.perf_counter() - start
+            times[engine + "_results"] = results
+        assert times["individual_results"] == times["combined_results"]
+        print(f"{name} ({len(rules)} rules), {corpus_name}: individual {times['individual']:.3f}s, "
+              f"combined {times['combined']:.3f}s, speedup x{times['individual'] / times['combined']:.2f}")
+    # share of the combined engine spent checking the positions that the single scan skipped
+    active = tuple(idx for idx, rule in enumerate(rules) if rule.may_match(text))
+    pattern, groups = matcher._pattern(active)
+    start = time.perf_counter()
+    matches, _ = scan_matches(pattern, text)
+    scan_time = time.perf_counter() - start
+    start = time.perf_counter()
+    conflicts = matcher._conflicts(text, matches, groups, active)
+    conflict_time = time.perf_counter() - start
+    print(f"    single scan {scan_time:.3f}s, conflict check {conflict_time:.3f}s, "
+          f"rescanned rules {sorted(rules[idx].label for idx in conflicts)}")
@@ -0,0 +1,76 @@
+# Benchmark of the regex NER parser on a ~1 MB clinical note with thousands of date/ID matches.
+# usage: python -m aimped.test.benchmark_regex_parser
+
+import json
+import os
+import random
+import re
+import tempfile
+import time
+
+from aimped.nlp.regex_parser import RegexNerParser, RegexRuleSet
+
+
+def LegacyRegexNerParser(path, text, white_label_list):
+    """findall/str.find based parser that RegexNerParser replaced, kept for comparison."""
+    with open(path, 'r', encoding="utf8") as f:
+        file = json.load(f)
+    parser_results = []
+    if file["label"] in white_label_list:
+        chunks = re.findall(file["regex"], text)
+        for chunk in set(chunks):
+            seek = 0
+            for i in range(chunks.count(chunk)):
+                begin = text.find(chunk, seek)
+                end = begin + len(chunk)
+                before = text[max(begin - file["contextLength"], 0):begin]
+                after = text[end:end + file["contextLength"]]
+                seek = end
+                left_context = [pre.lower() in before.lower() for pre in file["prefix"]]
+                right_context = [sfx.lower() in after.lower() for sfx in file["suffix"]]
+                if any(left_context) or any(right_context) or (not file["prefix"] and not file["suffix"]):
+                    parser_results.append(
+                        {'chunk': chunk, 'confidence': 1, 'begin': begin, 'end': end, 'entity': file["label"]})
+    return parser_results
+
+
+rules = {
+    "date.json": {"label": "DATE", "regex": r"\b\d{2}/\d{2}/\d{4}\b", "contextLength": 30,
+                  "prefix": ["admitted", "discharged", "seen on", "date"], "suffix": []},
+    "id.json": {"label": "ID", "regex": r"\b[A-Z]{2}\d{6}\b", "contextLength": 20,
+                "prefix": ["MRN", "ID"], "suffix": ["(mrn)"]},
+}
+
+random.seed(0)
+words = ["patient", "denies", "pain", "admitted", "discharged", "seen on", "MRN", "follow", "up", "with", "dr.",
+         "smith", "blood", "pressure", "stable", "date", "ID"]
+parts = []
+size = 0
+while size < 1_000_000:
+    part = " ".join(random.choices(words, k=12))
+    if random.random() < 0.3:
+        part += f" {random.randint(1, 28):02d}/{random.randint(1, 12):02d}/{random.randint(2000, 2023)}"
+    if random.random() < 0.2:
+        part += f" AB{random.randint(0, 999999):06d}"
+    parts.append(part + ".")
+    size += len(part) + 2
+text = "\n".join(parts)
+
+rules_dir = tempfile.mkdtemp()
+for name, rule in rules.items():
+    with open(os.path.join(rules_dir, name), "w", encoding="utf8") as f:
+        json.dump(rule, f)
+rule_set = RegexRuleSet.get(rules_dir)
+white_label_list = ["DATE", "ID"]
+
+print(f"text: {len(text) / 1e6:.2f} MB")
+for rule in rule_set.rules(white_label_list):
+    start = time.perf_counter()
+    legacy = LegacyRegexNerParser(rule.path, text, white_label_list)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    results = RegexNerParser(rule, text, white_label_list)
+    new_time = time.perf_counter() - start
+    assert sorted(results, key=lambda r: r["begin"]) == sorted(legacy, key=lambda r: r["begin"])
+    print(f"{rule.label}: {len(results)} entities, legacy {legacy_time:.3f}s, finditer {new_time:.3f}s, "
+          f"speedup x{legacy_time / new_time:.1f}")
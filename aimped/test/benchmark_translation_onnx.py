@@ -0,0 +1,84 @@
+# Benchmark of the onnxruntime translation backend against the torch model on CPU: latency and BLEU parity.
+# usage: python -m aimped.test.benchmark_translation_onnx [model_path]
+# without model_path a tiny randomly initialized Marian model is used.
+
+import os
+import re
+import sys
+import tempfile
+import time
+import warnings
+
+import torch
+from nltk.translate.bleu_score import corpus_bleu, SmoothingFunction
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, BertTokenizerFast, MarianConfig, MarianMTModel
+
+from aimped.nlp.translation_onnx import export_seq2seq_onnx, OnnxTranslationPipeline
+
+warnings.filterwarnings("ignore")
+torch.set_num_threads(os.cpu_count() or 1)
+
+sentences = ["The patient was admitted with chest pain and shortness of breath.",
+             "She denies fever, chills or night sweats.",
+             "Blood pressure was stable during the night.",
+             "He was discharged home in good condition.",
+             "Follow up with the cardiologist in two weeks.",
+             "No known drug allergies.",
+             "The wound is clean and dry without signs of infection.",
+             "Continue the current medications and monitor the blood glucose."] * 4
+
+if len(sys.argv) > 1:
+    tokenizer = AutoTokenizer.from_pretrained(sys.argv[1])
+    model = AutoModelForSeq2SeqLM.from_pretrained(sys.argv[1]).eval()
+    max_length = 128
+else:
+    torch.manual_seed(0)
+    model_dir = tempfile.mkdtemp()
+    words = sorted({word for sentence in sentences for word in re.findall(r"\w+", sentence.lower())})
+    with open(os.path.join(model_dir, "vocab.txt"), "w", encoding="utf8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", ",", "."] + words))
+    tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+    model = MarianMTModel(MarianConfig(vocab_size=len(tokenizer), d_model=256, encoder_layers=3, decoder_layers=3,
+                                       encoder_attention_heads=4, decoder_attention_heads=4,
+                                       encoder_ffn_dim=1024, decoder_ffn_dim=1024, pad_token_id=0,
+                                       eos_token_id=3, decoder_start_token_id=0)).eval()
+    max_length = 64
+
+model_dir = tempfile.mkdtemp()
+start = time.perf_counter()
+export_seq2seq_onnx(model, model_dir, tokenizer=tokenizer)
+print(f"export: {time.perf_counter() - start:.1f}s")
+onnx_pipeline = OnnxTranslationPipeline(model_dir, tokenizer=tokenizer)
+
+
+def torch_translate(texts, num_beams):
+    batch = tokenizer(texts, padding=True, truncation=True, max_length=512, return_token_type_ids=False,
+                      return_tensors="pt")
+    with torch.no_grad():
+        sequences = model.generate(**batch, num_beams=num_beams, max_length=max_length, do_sample=False)
+    return tokenizer.batch_decode(sequences, skip_special_tokens=True)
+
+
+def onnx_translate(texts, num_beams):
+    outputs = onnx_pipeline(texts, num_beams=num_beams, max_length=max_length)
+    return [output["translation_text"] for output in outputs]
+
+
+for num_beams in [1, 4]:
+    for batch_size in [1, 8]:
+        results = {}
+        for name, translate in [("torch", torch_translate), ("onnxruntime", onnx_translate)]:
+            translate(sentences[:batch_size], num_beams)
+            start = time.perf_counter()
+            results[name] = [translation for i in range(0, len(sentences), batch_size)
+                             for translation in translate(sentences[i:i + batch_size], num_beams)]
+            results[name + "_time"] = time.perf_counter() - start
+        bleu = corpus_bleu([[reference.split()] for reference in results["torch"]],
+                           [translation.split() for translation in results["onnxruntime"]],
+                           smoothing_function=SmoothingFunction().method1)
+        exact = sum(a == b for a, b in zip(results["torch"], results["onnxruntime"])) / len(sentences)
+        print(f"num_beams {num_beams}, batch_size {batch_size}: "
+              f"torch {1000 * results['torch_time'] / len(sentences):.1f} ms/sentence, "
+              f"onnxruntime {1000 * results['onnxruntime_time'] / len(sentences):.1f} ms/sentence, "
+              f"speedup x{results['torch_time'] / results['onnxruntime_time']:.2f}, "
+              f"BLEU vs torch {100 * bleu:.1f}, exact match {100 * exact:.0f}%")
@@ -0,0 +1,50 @@
+from aimped.nlp.assertion import AssertionModelResults, AssertionMarkSentence, AssertionBatchResults, AssertionCache
+
+sentences = ["Patient has a headache and fever.", "No alopecia noted.", "She denies pain."]
+ner_results = [
+    {"entity": "problem", "chunk": "a headache", "begin": 12, "end": 22, "sent_idx": 0, "sent_begin": 12, "sent_end": 22},
+    {"entity": "problem", "chunk": "fever", "begin": 27, "end": 32, "sent_idx": 0, "sent_begin": 27, "sent_end": 32},
+    {"entity": "problem", "chunk": "alopecia", "begin": 37, "end": 45, "sent_idx": 1, "sent_begin": 3, "sent_end": 11},
+    {"entity": "problem", "chunk": "pain", "begin": 64, "end": 68, "sent_idx": 2, "sent_begin": 11, "sent_end": 15},
+]
+assertion_white_label_list = ["present", "absent"]
+
+
+def classifier(texts, **kwargs):
+    """fake assertion classifier: 'absent' if the sentence has a negation"""
+    return [{"label": "absent" if "No " in text or "denies" in text else "present", "score": 0.9} for text in texts]
+
+
+assert AssertionMarkSentence(sentences[1], 3, 11) == "No   [Entity]  alopecia  [Entity]   noted."
+
+results = AssertionModelResults(ner_results, sentences, classifier, assertion_white_label_list)
+assert [(r["chunk"], r["assertion"]) for r in results] == [
+    ("a headache", "present"), ("fever", "present"), ("alopecia", "absent"), ("pain", "absent")]
+assert list(results[0]) == ["begin", "end", "ner_label", "chunk", "assertion", "score"]
+
+results = AssertionModelResults(ner_results, sentences, classifier, ["absent"], resolver=True)
+assert results == [{"begin": 37, "end": 45, "entity": "problem", "chunk": "alopecia", "sent_idx": 1, "assertion": "absent"},
+                   {"begin": 64, "end": 68, "entity": "problem", "chunk": "pain", "sent_idx": 2, "assertion": "absent"}]
+assert AssertionModelResults([], sentences, classifier, assertion_white_label_list) == []
+print("assertion results:", results)
+
+# batching across documents with deduplication and cache
+calls = []
+
+
+def counting_classifier(texts, batch_size=None):
+    calls.append((list(texts), batch_size))
+    return classifier(texts)
+
+
+cache = AssertionCache(maxsize=100)
+results_list = AssertionBatchResults([ner_results, ner_results, []], [sentences, sentences, []], counting_classifier,
+                                     assertion_white_label_list, batch_size=3, cache=cache)
+assert results_list[0] == results_list[1] == AssertionModelResults(ner_results, sentences, classifier,
+                                                                   assertion_white_label_list)
+assert results_list[2] == []
+assert [len(texts) for texts, _ in calls] == [3, 1] and all(batch_size == 3 for _, batch_size in calls)
+assert [len(text) for texts, _ in calls for text in texts] == sorted(len(text) for texts, _ in calls for text in texts)
+calls.clear()
+AssertionBatchResults([ner_results], [sentences], counting_classifier, assertion_white_label_list, cache=cache)
+assert calls == [] and cache.hits == 4 and len(cache) == 4
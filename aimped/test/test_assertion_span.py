@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+import torch
+from transformers import BertConfig, BertModel, BertTokenizerFast
+
+from aimped.nlp.assertion_span import SpanAssertionModel, SpanAssertionModelResults
+
+# tiny randomly initialized model
+torch.manual_seed(0)
+vocab_dir = tempfile.mkdtemp()
+with open(os.path.join(vocab_dir, "vocab.txt"), "w", encoding="utf8") as f:
+    f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "patient", "has", "a", "headache", "and",
+                       "fever", "no", "alopecia", "noted", "she", "denies", "pain", "."]))
+tokenizer = BertTokenizerFast.from_pretrained(vocab_dir)
+encoder = BertModel(BertConfig(vocab_size=18, hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                               intermediate_size=32))
+model = SpanAssertionModel(encoder, {0: "present", 1: "absent", 2: "possible"})
+
+sentences = ["Patient has a headache and fever.", "No alopecia noted.", "She denies pain."]
+ner_results = [
+    {"entity": "problem", "chunk": "a headache", "begin": 12, "end": 22, "sent_idx": 0, "sent_begin": 12, "sent_end": 22},
+    {"entity": "problem", "chunk": "fever", "begin": 27, "end": 32, "sent_idx": 0, "sent_begin": 27, "sent_end": 32},
+    {"entity": "problem", "chunk": "alopecia", "begin": 37, "end": 45, "sent_idx": 1, "sent_begin": 3, "sent_end": 11},
+    {"entity": "problem", "chunk": "pain", "begin": 64, "end": 68, "sent_idx": 2, "sent_begin": 11, "sent_end": 15},
+]
+labels = ["present", "absent", "possible"]
+
+# one encoder forward pass per batch of sentences, not per entity
+forward_passes = []
+encoder.register_forward_hook(lambda module, inputs, outputs: forward_passes.append(1))
+results = SpanAssertionModelResults(ner_results, sentences, tokenizer, model, labels, batch_size=2)
+assert len(forward_passes) == 2
+assert [r["chunk"] for r in results] == ["a headache", "fever", "alopecia", "pain"]
+assert list(results[0]) == ["begin", "end", "ner_label", "chunk", "assertion", "score"]
+assert all(r["assertion"] in labels and 0 < r["score"] <= 1 for r in results)
+
+# the prediction of an entity does not depend on the other entities of its sentence
+single = SpanAssertionModelResults(ner_results[1:2], sentences, tokenizer, model, labels)
+assert single[0]["assertion"] == results[1]["assertion"] and abs(single[0]["score"] - results[1]["score"]) < 1e-5
+
+resolver_results = SpanAssertionModelResults(ner_results, sentences, tokenizer, model, labels, resolver=True)
+assert [r["sent_idx"] for r in resolver_results] == [0, 0, 1, 2]
+
+model_path = tempfile.mkdtemp()
+model.save_pretrained(model_path)
+loaded = SpanAssertionModel.from_pretrained(model_path)
+assert SpanAssertionModelResults(ner_results, sentences, tokenizer, loaded, labels) == \
+       SpanAssertionModelResults(ner_results, sentences, tokenizer, model, labels)
+print("span assertion results:", results)
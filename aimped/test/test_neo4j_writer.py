@@ -0,0 +1,198 @@
+from aimped.nlp.relation import Neo4j
+
+
+class RecordingTransaction:
+    def __init__(self, log):
+        self.log = log
+        self.queries = []
+
+    def run(self, query, parameters=None, **kwargs):
+        self.queries.append((query, dict(parameters or {}, **kwargs)))
+
+    def commit(self):
+        self.log.append(("transaction", self.queries))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class RecordingSession:
+    def __init__(self, log):
+        self.log = log
+
+    def run(self, query, parameters=None, **kwargs):
+        self.log.append(("run", query))
+        return []
+
+    def begin_transaction(self):
+        return RecordingTransaction(self.log)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class RecordingDriver:
+    """fake neo4j driver recording the queries and the transactions"""
+
+    def __init__(self):
+        self.log = []
+        self.databases = []
+
+    def session(self, database=None):
+        self.databases.append(database)
+        return RecordingSession(self.log)
+
+    def close(self):
+        pass
+
+
+relations = [
+    [{"entity1": "DRUG", "chunk1": "aspirin", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": "rash"},
+     {"entity1": "DRUG", "chunk1": "aspirin", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": "nausea"},
+     {"entity1": "DRUG", "chunk1": "aspirin", "label": "DOSAGE-DRUG", "entity2": "DOSAGE", "chunk2": "81 mg"}],
+    [{"entity1": "DRUG", "chunk1": "aspirin", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": "rash"},
+     {"entity1": "DRUG", "chunk1": "o'brien's", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": "head-ache"}],
+]
+json_output = {"output": {"data_json": {"result": relations}}}
+
+driver = RecordingDriver()
+neo4j = Neo4j("bolt://localhost:7687", "neo4j", "password", db="graph", driver=driver)
+summary = neo4j.write_relations(json_output=json_output, batch_size=2)
+assert summary == {"relations": 5, "queries": 2, "transactions": 3}
+assert set(driver.databases) == {"graph"}
+
+constraints = [entry[1] for entry in driver.log if entry[0] == "run"]
+assert constraints == ["CREATE CONSTRAINT IF NOT EXISTS FOR (n:`ADE`) REQUIRE n.name IS UNIQUE",
+                       "CREATE CONSTRAINT IF NOT EXISTS FOR (n:`DOSAGE`) REQUIRE n.name IS UNIQUE",
+                       "CREATE CONSTRAINT IF NOT EXISTS FOR (n:`DRUG`) REQUIRE n.name IS UNIQUE"]
+assert driver.log.index(("run", constraints[-1])) < [entry[0] for entry in driver.log].index("transaction")
+
+transactions = [entry[1] for entry in driver.log if entry[0] == "transaction"]
+assert all(len(queries) == 1 for queries in transactions)
+query, parameters = transactions[0][0]
+assert query.startswith("UNWIND $rows AS row") and "MERGE (e1)-[:`ADE_DRUG`]->(e2)" in query
+assert parameters == {"rows": [{"chunk1": "aspirin", "chunk2": "rash"}, {"chunk1": "aspirin", "chunk2": "nausea"}]}
+# the chunks are parameters, written as they are
+assert transactions[1][0][1] == {"rows": [{"chunk1": "o'brien's", "chunk2": "head-ache"}]}
+assert "`DOSAGE_DRUG`" in transactions[2][0][0]
+
+# RelationResults outputs, without constraints
+driver = RecordingDriver()
+neo4j = Neo4j("bolt://localhost:7687", "neo4j", "password", driver=driver)
+summary = neo4j.write_relations(relations=relations[0], create_constraints=False)
+assert summary == {"relations": 3, "queries": 2, "transactions": 2}
+assert [entry[0] for entry in driver.log] == ["transaction", "transaction"]
+assert len(neo4j.create_neo4j_query(json_output=json_output)) == 5
+
+# any name is quoted, the backticks of a name are escaped
+queries = neo4j.create_unwind_queries([("DRUG`) DETACH DELETE n //", "x", "MAY CAUSE", "İlaç", "y")])
+query = next(iter(queries))
+assert "(e1:`DRUG``) DETACH DELETE n //` {name: row.chunk1})" in query
+assert "[:`MAY CAUSE`]" in query and "(e2:`İlaç` {name: row.chunk2})" in query
+try:
+    neo4j.create_unwind_queries([("", "x", "R", "ADE", "y")])
+    raise AssertionError("an empty label must be rejected")
+except ValueError:
+    pass
+print("neo4j writer:", summary)
+
+# background writer
+import threading
+import time
+from neo4j.exceptions import ServiceUnavailable, TransientError
+from aimped.nlp.relation import Neo4jWriter
+
+
+class FlakyDriver(RecordingDriver):
+    """fake driver failing the first transactions and constraints with a transient error, and slow to commit"""
+
+    def __init__(self, failures, delay, run_failures=0):
+        super().__init__()
+        self.failures = failures
+        self.delay = delay
+        self.run_failures = run_failures
+        self.lock = threading.Lock()
+
+    def session(self, database=None):
+        driver = self
+
+        class FlakyTransaction(RecordingTransaction):
+            def commit(self):
+                time.sleep(driver.delay)
+                with driver.lock:
+                    if driver.failures:
+                        driver.failures -= 1
+                        raise TransientError("deadlock detected")
+                    super().commit()
+
+        class FlakySession(RecordingSession):
+            def run(self, query, parameters=None, **kwargs):
+                with driver.lock:
+                    if driver.run_failures:
+                        driver.run_failures -= 1
+                        raise ServiceUnavailable("connection lost")
+                return super().run(query, parameters, **kwargs)
+
+            def begin_transaction(self):
+                return FlakyTransaction(self.log)
+
+        return FlakySession(self.log)
+
+
+rows = [[{"entity1": "DRUG", "chunk1": f"drug {i}", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": f"ade {i}"}]
+        for i in range(40)]
+driver = FlakyDriver(failures=2, delay=0.01)
+neo4j = Neo4j("bolt://localhost:7687", "neo4j", "password", driver=driver)
+with Neo4jWriter(neo4j, batch_size=4, workers=2, max_queue_size=2, retry_delay=0.001) as writer:
+    start = time.perf_counter()
+    writer.put(relations=rows)
+    # 10 batches through a queue of 2 batches and 2 workers: put waits for the writes
+    assert time.perf_counter() - start > 0.02
+    writer.flush()
+    assert writer.written == 40 and writer.retries == 2
+written = [row["chunk1"] for entry in driver.log if entry[0] == "transaction" for row in entry[1][0][1]["rows"]]
+assert sorted(written) == sorted(f"drug {i}" for i in range(40))
+assert [entry[0] for entry in driver.log].count("run") == 2
+
+# the constraints are created by a worker with retries, before the batches of their labels
+driver = FlakyDriver(failures=0, delay=0.01, run_failures=1)
+with Neo4jWriter(Neo4j("bolt://localhost:7687", "neo4j", "password", driver=driver), batch_size=4,
+                 retry_delay=0.001) as writer:
+    writer.put(relations=rows)
+    writer.put(relations=relations)
+assert writer.written == 44 and writer.retries == 1 and writer.labels == {"ADE", "DOSAGE", "DRUG"}
+kinds = [entry[0] for entry in driver.log]
+assert kinds.count("run") == 3 and kinds.index("transaction") > kinds.index("run") + 1
+# constraints that still fail are raised by flush, and tried again by the next put of their labels
+driver = FlakyDriver(failures=0, delay=0, run_failures=2)
+writer = Neo4jWriter(Neo4j("bolt://localhost:7687", "neo4j", "password", driver=driver), max_retries=1,
+                     retry_delay=0.001)
+writer.put(relations=rows[:1])
+try:
+    writer.flush()
+    raise AssertionError("failed constraints must be raised")
+except RuntimeError as e:
+    assert isinstance(e.__cause__, ServiceUnavailable) and writer.labels == set() and writer.written == 1
+writer.put(relations=rows[1:2])
+writer.close()
+assert writer.labels == {"ADE", "DRUG"} and [entry[0] for entry in driver.log].count("run") == 2
+
+driver = FlakyDriver(failures=100, delay=0)
+writer = Neo4jWriter(Neo4j("bolt://localhost:7687", "neo4j", "password", driver=driver), max_retries=1,
+                     retry_delay=0.001, create_constraints=False)
+writer.put(relations=rows[:1])
+try:
+    writer.close()
+    raise AssertionError("a failed batch must be raised")
+except RuntimeError as e:
+    assert isinstance(e.__cause__, TransientError)
+print("neo4j background writer:", writer)
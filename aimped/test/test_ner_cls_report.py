@@ -0,0 +1,132 @@
+import contextlib
+import io
+import os
+import tempfile
+
+import numpy as np
+import torch
+from transformers import BertConfig, BertForTokenClassification, BertTokenizerFast
+
+from aimped.nlp.ner_cls_report import (ReadConll, ConllSentences, FirstSubtokenPositions, NerModelPredictions,
+                                       ClsReportNerModel, AlignTruths, IterConll, AlignedConllDataset,
+                                       NerDatasetPredictions)
+
+
+def LegacyPredictions(sents_tokens_list, tokenizer, model, device):
+    """one forward pass per sentence, the loop that NerModelPredictions replaced"""
+    preds_list = []
+    for sent_token_list in sents_tokens_list:
+        model_inputs = tokenizer(sent_token_list, is_split_into_words=True, truncation=True, padding=False,
+                                 max_length=512, return_tensors="pt").to(device)
+        word_ids = model_inputs.word_ids()
+        with torch.no_grad():
+            predictions = model(**model_inputs).logits.argmax(dim=-1).tolist()[0]
+        preds = []
+        idx = 1
+        while idx < len(word_ids) - 1:
+            label = model.config.id2label[predictions[idx]]
+            if word_ids[idx] == word_ids[idx + 1]:
+                word_id = word_ids[idx]
+                while word_id == word_ids[idx]:
+                    idx += 1
+                idx -= 1
+            preds.append(label)
+            idx += 1
+        preds_list.append(preds)
+    return preds_list
+
+
+# tiny randomly initialized model, "headache" and "alopecia" are split into sub tokens
+torch.manual_seed(0)
+vocab_dir = tempfile.mkdtemp()
+with open(os.path.join(vocab_dir, "vocab.txt"), "w", encoding="utf8") as f:
+    f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "patient", "has", "a", "head", "##ache", "and",
+                       "fever", "no", "alo", "##pec", "##ia", "she", "denies", "pain", "."]))
+tokenizer = BertTokenizerFast.from_pretrained(vocab_dir)
+labels = ["O", "B-PROBLEM", "I-PROBLEM"]
+model = BertForTokenClassification(BertConfig(vocab_size=20, hidden_size=16, num_hidden_layers=1,
+                                              num_attention_heads=2, intermediate_size=32, num_labels=3,
+                                              id2label=dict(enumerate(labels)),
+                                              label2id={label: idx for idx, label in enumerate(labels)})).eval()
+
+conll_path = os.path.join(vocab_dir, "test.conll")
+with open(conll_path, "w", encoding="utf8") as f:
+    f.write("-DOCSTART- -X- -X- O\n\n"
+            "Patient NN O O\nhas VB O O\na DT O B-PROBLEM\nheadache NN O I-PROBLEM\n. . O O\n\n"
+            "No DT O O\nalopecia NN O B-PROBLEM\n\n"
+            "She PRP O O\ndenies VB O O\nfever NN O B-PROBLEM\nand CC O O\npain NN O B-PROBLEM\n. . O O\n\n"
+            "Fever NN O B-PROBLEM\n")
+
+sents_tokens_list, truth_list = ConllSentences(ReadConll(conll_path))
+assert sents_tokens_list[1] == ["No", "alopecia"] and truth_list[1] == ["O", "B-PROBLEM"]
+assert [len(tokens) for tokens in sents_tokens_list] == [5, 2, 6, 1]
+
+word_ids = np.array([[-1, 0, 1, 1, 2, -1, -1], [-1, 0, 0, 0, 1, 1, -1]])
+rows, columns, words = FirstSubtokenPositions(word_ids)
+assert rows.tolist() == [0, 0, 0, 1, 1] and columns.tolist() == [1, 2, 4, 1, 4] and words.tolist() == [0, 1, 2, 0, 1]
+
+# batched predictions of the first sub tokens are the predictions of the per-sentence loop
+expected = LegacyPredictions(sents_tokens_list, tokenizer, model, "cpu")
+for batch_size in [1, 2, 32]:
+    preds_list, word_idxs_list = NerModelPredictions(sents_tokens_list, tokenizer, model, "cpu",
+                                                     batch_size=batch_size)
+    assert preds_list == expected and word_idxs_list == [list(range(len(tokens))) for tokens in sents_tokens_list]
+
+# the truncated words are left out of the report
+preds_list, word_idxs_list = NerModelPredictions(sents_tokens_list, tokenizer, model, "cpu", max_length=4)
+assert [len(preds) for preds in preds_list] == [2, 2, 2, 1] and word_idxs_list[0] == [0, 1]
+
+# a word without sub tokens has no prediction, the next words keep their own truths
+preds_list, word_idxs_list = NerModelPredictions([["a", "\u200b", "fever"]], tokenizer, model, "cpu")
+assert word_idxs_list == [[0, 2]] and preds_list == LegacyPredictions([["a", "\u200b", "fever"]], tokenizer, model,
+                                                                      "cpu")
+assert AlignTruths([["O", "O", "B-PROBLEM"]], word_idxs_list) == [["O", "B-PROBLEM"]]
+
+with contextlib.redirect_stdout(io.StringIO()) as output:
+    results = ClsReportNerModel(conll_path, tokenizer, model, "cpu", batch_size=2)
+assert results["preds"] == expected and results["truths"] == truth_list
+assert results["sentences"] == 4 and results["tokens"] == 14 and results["tokens_per_second"] > 0
+assert "sentences/sec" in output.getvalue() and "PROBLEM" in output.getvalue()
+print(output.getvalue())
+
+empty_word_path = os.path.join(vocab_dir, "empty_word.conll")
+with open(empty_word_path, "w", encoding="utf8") as f:
+    f.write("Patient NN O O\n\u200b NN O O\nfever NN O B-PROBLEM\nand CC O O\npain NN O B-PROBLEM\n")
+with contextlib.redirect_stdout(io.StringIO()):
+    empty_word_results = ClsReportNerModel(empty_word_path, tokenizer, model, "cpu")
+assert empty_word_results["truths"] == [["O", "B-PROBLEM", "O", "B-PROBLEM"]]
+assert len(empty_word_results["preds"][0]) == 4
+
+# streaming reader
+assert [list(sentence) for sentence in zip(*IterConll(conll_path))] == [sents_tokens_list, truth_list]
+
+# cached tokenized dataset
+cache_dir = tempfile.mkdtemp()
+dataset = AlignedConllDataset.get(conll_path, tokenizer, cache_dir, chunk_sentences=3)
+assert len(dataset) == 4 and dataset.truths() == truth_list and isinstance(dataset.input_ids, np.memmap)
+model_inputs, word_ids = dataset.batch(np.array([1, 0]))
+expected_inputs = tokenizer([sents_tokens_list[1], sents_tokens_list[0]], is_split_into_words=True, padding=True,
+                            return_tensors="pt")
+assert all((model_inputs[key] == expected_inputs[key]).all() for key in expected_inputs)
+assert word_ids[0].tolist() == [-1, 0, 1, 1, 1, -1, -1, -1]
+assert NerDatasetPredictions(dataset, model, "cpu", batch_size=2) == NerModelPredictions(sents_tokens_list, tokenizer,
+                                                                                         model, "cpu")
+
+# the checkpoints sharing the tokenizer reuse the dataset, another max_length or file is another dataset
+tokenizer_dir = tempfile.mkdtemp()
+tokenizer.save_pretrained(tokenizer_dir)
+assert AlignedConllDataset.get(conll_path, BertTokenizerFast.from_pretrained(tokenizer_dir), cache_dir).path == \
+       dataset.path
+assert AlignedConllDataset.get(conll_path, tokenizer, cache_dir, max_length=4).path != dataset.path
+assert len(os.listdir(cache_dir)) == 2
+with contextlib.redirect_stdout(io.StringIO()):
+    cached_results = ClsReportNerModel(conll_path, tokenizer, model, "cpu", cache_dir=cache_dir)
+assert cached_results["preds"] == results["preds"] and cached_results["truths"] == results["truths"]
+assert len(os.listdir(cache_dir)) == 2
+
+# the cached and the tokenized reports agree when a word has no sub tokens
+with contextlib.redirect_stdout(io.StringIO()):
+    cached_results = ClsReportNerModel(empty_word_path, tokenizer, model, "cpu", cache_dir=cache_dir)
+assert cached_results["preds"] == empty_word_results["preds"]
+assert cached_results["truths"] == empty_word_results["truths"] == [["O", "B-PROBLEM", "O", "B-PROBLEM"]]
+print("dataset:", dataset)
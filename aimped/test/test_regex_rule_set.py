@@ -0,0 +1,191 @@
+import json
+import os
+import tempfile
+import time
+import warnings
+
+from aimped.nlp.regex_parser import (RegexRuleSet, RegexRule, RegexNerParser, RegexModelOutputMerger,
+                                     AhoCorasick, ContextKeywordMatcher, PriorityNerMerger, RegexModelNerMerger,
+                                     CombinedRegexMatcher, RegexProfile, profile_rules)
+
+# rule files
+rules_dir = tempfile.mkdtemp()
+rules = {
+    "date.json": {"label": "DATE", "regex": r"\d{2}/\d{2}/\d{4}", "contextLength": 20,
+                  "prefix": ["Admitted", "Discharged"], "suffix": []},
+    "email.json": {"label": "EMAIL", "regex": r"[\w.-]+@[\w.-]+\.\w{2,4}", "contextLength": 0,
+                   "prefix": [], "suffix": []},
+    "ssn.json": {"label": "SSN", "regex": r"\d{3}-\d{2}-\d{4}", "contextLength": 10,
+                 "prefix": [], "suffix": []},
+}
+for name, rule in rules.items():
+    with open(os.path.join(rules_dir, name), "w", encoding="utf8") as f:
+        json.dump(rule, f)
+
+text = "Admitted 01/02/2023, seen 03/04/2023. Contact: john.doe@mail.com SSN 123-45-6789"
+white_label_list = ["DATE", "EMAIL"]
+
+rule_set = RegexRuleSet.get(rules_dir)
+assert RegexRuleSet.get(rules_dir) is rule_set
+assert [rule.label for rule in rule_set.rules(white_label_list)] == ["DATE", "EMAIL"]
+assert rule_set.rules(white_label_list) is rule_set.rules(white_label_list)
+assert rule_set.rules(white_label_list)[0].prefix == ["admitted", "discharged"]
+
+# the compiled rules give the same results as the rule files
+for rule in rule_set.rules():
+    assert RegexNerParser(rule, text, white_label_list) == RegexNerParser(rule.path, text, white_label_list)
+
+merged_results = RegexModelOutputMerger(rule_set.rules(white_label_list), [], text, white_label_list)
+assert [(r["entity"], r["chunk"]) for r in merged_results] == [("DATE", "01/02/2023"), ("EMAIL", "john.doe@mail.com")]
+
+# no reload until a rule file changes
+assert not rule_set.refresh()
+time.sleep(0.01)
+rules["ssn.json"]["label"] = "ID"
+with open(os.path.join(rules_dir, "ssn.json"), "w", encoding="utf8") as f:
+    json.dump(rules["ssn.json"], f)
+os.utime(os.path.join(rules_dir, "ssn.json"), ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+# an edited file is seen at the next check of the file mtimes, not on every call
+assert not rule_set.refresh() and rule_set.rules(["ID"]) == ()
+assert rule_set.refresh(force=True) and RegexRuleSet.get(rules_dir).rules(["ID"])[0].label == "ID"
+rule_set.check_interval = 0
+rules["ssn.json"]["label"] = "SSN"
+with open(os.path.join(rules_dir, "ssn.json"), "w", encoding="utf8") as f:
+    json.dump(rules["ssn.json"], f)
+os.utime(os.path.join(rules_dir, "ssn.json"), ns=(time.time_ns() + 2 * 10**9, time.time_ns() + 2 * 10**9))
+assert RegexRuleSet.get(rules_dir).rules(["SSN"])[0].label == "SSN"
+# an added file changes the directory mtime and is seen on the next call
+rule_set.check_interval = 3600
+rule_set.refresh(force=True)
+with open(os.path.join(rules_dir, "zip.json"), "w", encoding="utf8") as f:
+    json.dump({"label": "ZIP", "regex": r"\d{5}", "contextLength": 0, "prefix": [], "suffix": []}, f)
+os.utime(rules_dir, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+assert RegexRuleSet.get(rules_dir).rules(["ZIP"])[0].label == "ZIP"
+# a matcher built from the rules of a previous load is not stored against the reloaded rules
+state = rule_set._state
+old_matcher = rule_set.matcher(["ZIP"])
+os.utime(os.path.join(rules_dir, "zip.json"), ns=(time.time_ns() + 2 * 10**9, time.time_ns() + 2 * 10**9))
+assert rule_set.refresh(force=True)
+assert rule_set._filter(state, ["ZIP"]) is old_matcher.rules and old_matcher.rules not in rule_set._state[2]
+assert rule_set.matcher(["ZIP"]) is not old_matcher and rule_set.matcher(["ZIP"]).rules is rule_set.rules(["ZIP"])
+print("rule set:", rule_set)
+
+# single-scan matcher
+rules = {
+    "a_date.json": {"label": "DATE", "regex": r"\d{2}/\d{2}/\d{4}", "contextLength": 20,
+                    "prefix": ["Admitted"], "suffix": []},
+    "b_phone.json": {"label": "PHONE", "regex": r"(?i)tel: (\d{3}-\d{4})", "contextLength": 0,
+                     "prefix": [], "suffix": []},
+    "c_repeat.json": {"label": "ID", "regex": r"\b(\w)\1(\d{4})\b", "contextLength": 0,
+                      "prefix": [], "suffix": []},
+    "d_number.json": {"label": "NUMBER", "regex": r"\d{4}", "contextLength": 0, "prefix": [], "suffix": []},
+}
+rules_dir = tempfile.mkdtemp()
+for name, rule in rules.items():
+    with open(os.path.join(rules_dir, name), "w", encoding="utf8") as f:
+        json.dump(rule, f)
+text = "Admitted 01/02/2023, TEL: 555-1234, id AA1234, code 9876."
+white_label_list = ["DATE", "PHONE", "ID", "NUMBER"]
+model_results = [{"entity": "PATIENT", "confidence": 0.9, "chunk": "Admitted", "begin": 0, "end": 8}]
+
+matcher = RegexRuleSet.get(rules_dir).matcher(white_label_list)
+assert matcher.modes == {"a_date.json": "combined", "b_phone.json": "combined",
+                         "c_repeat.json": "individual", "d_number.json": "combined"}
+individual = RegexModelOutputMerger(RegexRuleSet.get(rules_dir).rules(white_label_list), list(model_results), text,
+                                    white_label_list)
+combined = RegexModelOutputMerger(matcher, list(model_results), text, white_label_list, engine="combined")
+assert combined == individual
+assert [(r["entity"], r["chunk"]) for r in combined] == [
+    ("PATIENT", "Admitted"), ("DATE", "01/02/2023"), ("PHONE", "555-1234"), ("ID", "AA1234"), ("NUMBER", "9876")]
+print("matcher:", matcher)
+
+# a lower priority rule matching earlier does not hide an overlapping higher priority match
+rules = [RegexRule("DATE", r"\d{4}-\d{2}"), RegexRule("ID", r"x\d{4}"), RegexRule("NUMBER", r"\d+")]
+for text in ["x2023-05", "id x2023-05 and 2023-06, x1234", "2023-0512"]:
+    expected = [RegexNerParser(rule, text, ["DATE", "ID", "NUMBER"]) for rule in rules]
+    assert CombinedRegexMatcher(rules).parse(text) == expected
+assert CombinedRegexMatcher(rules).parse("x2023-05")[0][0]["chunk"] == "2023-05"
+
+# the skipped positions are only tried where the start of a rule is found in the match texts of the others
+matcher = CombinedRegexMatcher([RegexRule("DATE", r"\b\d{2}/\d{2}\b"), RegexRule("EMAIL", r"[\w.-]+@\w+"),
+                                RegexRule("PHONE", r"(?i)tel: \d+"), RegexRule("ANY", r"(?:ab)?c?")])
+assert matcher._starts[0][0].pattern == r"(?=\b[\d]{2}/[\d]{2}\b)" and matcher._starts[0][1] == 5
+assert matcher._starts[1][2] and matcher._starts[2][0].pattern == r"(?=(?i:t)(?i:e)(?i:l)(?i::)(?i:\ )(?i:[\d]){1})"
+assert matcher._starts[3] is None
+rules = [RegexRule("WORD", r"[a-z]+\d"), RegexRule("DATE", r"\b\d{2}/\d{2}\b"), RegexRule("EMAIL", r"[\w.-]+@\w+"),
+         RegexRule("TEL", r"(?i)tel: \d+"), RegexRule("NUMBER", r"\d+")]
+for text in ["ab01/02 x", "01/02", "a.b1@c TEL: 12", "john.doe@mail tel: 5", "ab12/34@x", "xtel: 1", "1@b"]:
+    expected = [RegexNerParser(rule, text, [rule.label]) for rule in rules]
+    assert CombinedRegexMatcher(rules).parse(text) == expected
+
+# aho-corasick context matching
+automaton = AhoCorasick(["he", "she", "his", "hers"])
+assert sorted(automaton.iter("ushers")) == [(1, 1), (2, 0), (2, 3)]
+
+rules = [RegexRule("DATE", r"\d{2}/\d{2}", context_length=12, prefix=["Seen", "seen on", "on"], suffix=["MRN"]),
+         RegexRule("ID", r"\d{3}", context_length=5, prefix=["id:"], suffix=[]),
+         RegexRule("NUMBER", r"\d+", context_length=3, prefix=[], suffix=[""])]
+text = "seen on 01/02 id: 123, 03/04 MRN, 05/06 nothing, ID: 456 on 07/08"
+white_label_list = ["DATE", "ID", "NUMBER"]
+expected = [RegexNerParser(rule, text, white_label_list) for rule in rules]
+context_matcher = ContextKeywordMatcher(rules, min_keywords=0)
+assert context_matcher.select(text, [(rule, list(rule.spans(text))) for rule in rules]) == expected
+assert RegexModelOutputMerger(rules, [], text, white_label_list, context_matcher=context_matcher) == \
+       RegexModelOutputMerger(rules, [], text, white_label_list)
+
+# priority merging: a result is dropped only by the kept results of higher priority lists
+first = [{"begin": 10, "end": 20, "entity": "A"}]
+second = [{"begin": 5, "end": 12, "entity": "B"}, {"begin": 30, "end": 40, "entity": "B"}]
+third = [{"begin": 0, "end": 6, "entity": "C"}, {"begin": 35, "end": 36, "entity": "C"}, {"begin": 40, "end": 45, "entity": "C"}]
+merged = PriorityNerMerger([first, second, third])
+assert [(r["entity"], r["begin"]) for r in merged] == [("C", 0), ("A", 10), ("B", 30), ("C", 40)]
+assert RegexModelNerMerger(first, second) == [first[0], second[1]]
+assert len(second) == 2
+
+# literal prefilter
+email = RegexRule("EMAIL", r"[\w.-]+@[\w.-]+\.\w{2,4}")
+ssn = RegexRule("SSN", r"(?i)ssn[: ]+(\d{3}-\d{2}-\d{4})")
+mrn = RegexRule("MEDICALRECORD", r"\b\d{7}\b", requires=["MRN", "medical record"])
+assert ("@", False) in email.literals and ssn.literals[0] == ("ssn", True)
+assert not email.may_match("no address here") and email.may_match("mail: a@b.com")
+assert ssn.may_match("SSN: 123-45-6789") and not ssn.may_match("123-45-6789")
+assert not mrn.may_match("code 1234567") and mrn.may_match("Medical Record 1234567")
+text = "SSN: 123-45-6789, code 1234567"
+assert RegexNerParser(mrn, text, ["MEDICALRECORD"]) == []
+assert [r["chunk"] for r in RegexNerParser(ssn, text, ["SSN"])] == ["123-45-6789"]
+matcher = CombinedRegexMatcher([email, ssn, mrn])
+assert matcher.parse(text) == [[], RegexNerParser(ssn, text, ["SSN"]), []]
+
+# time budgets and profiling
+rules = {
+    "date.json": {"label": "DATE", "regex": r"\d{2}/\d{2}/\d{4}", "contextLength": 0, "prefix": [], "suffix": []},
+    "slow.json": {"label": "ID", "regex": r"(x+x+)+y", "contextLength": 0, "prefix": [], "suffix": []},
+}
+rules_dir = tempfile.mkdtemp()
+for name, rule in rules.items():
+    with open(os.path.join(rules_dir, name), "w", encoding="utf8") as f:
+        json.dump(rule, f)
+text = ("x" * 16 + " 01/02/2023 ") * 20 + "y"
+slow = RegexRuleSet.get(rules_dir).rules(["ID"])[0]
+spans, timed_out = slow.scan(text, time_budget=0.05, chunk_size=100, overlap=20)
+assert timed_out and spans == []
+text = ("x" * 13 + " 01/02/2023 ") * 2000 + "y"
+date = RegexRuleSet.get(rules_dir).rules(["DATE"])[0]
+assert date.scan(text, time_budget=10, chunk_size=7, overlap=10) == (list(date.spans(text)), False)
+
+profile = RegexProfile()
+with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter("always")
+    merged_results = RegexModelOutputMerger(RegexRuleSet.get(rules_dir).rules(), [], text, ["DATE", "ID"],
+                                            time_budget=0.05, profile=profile)
+assert len(merged_results) == 2000 and any("slow.json" in str(warning.message) for warning in caught)
+report = profile.report()
+assert report[0]["rule"] == "slow.json" and report[0]["timeouts"] == 1
+assert report[1]["rule"] == "date.json" and report[1]["accepted"] == 2000
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    report = profile_rules(rules_dir, [text[-2000:], "no match here"], time_budget=0.05)
+assert [stats["rule"] for stats in report] == ["slow.json", "date.json"]
+assert report[1]["calls"] == 2 and report[1]["skipped"] == 1
+print("profile:", report)
@@ -0,0 +1,95 @@
+import csv
+import json
+import os
+import tempfile
+
+from aimped.nlp.relation_graph import RelationCsvExporter, RelationNodeId
+
+relations = [
+    [{"entity1": "DRUG", "chunk1": "aspirin", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": "rash"},
+     {"entity1": "DRUG", "chunk1": "aspirin", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": "nausea"},
+     {"entity1": "DRUG", "chunk1": "aspirin", "label": "DOSAGE-DRUG", "entity2": "DOSAGE", "chunk2": "81 mg"}],
+    [{"entity1": "DRUG", "chunk1": "aspirin", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": "rash"},
+     {"entity1": "DRUG", "chunk1": "ibuprofen, 200 \"mg\"", "label": "ADE-DRUG", "entity2": "ADE", "chunk2": "rash"}],
+]
+
+
+def read_rows(paths):
+    rows = []
+    for path in paths:
+        with open(path, newline="", encoding="utf8") as f:
+            rows.extend(csv.reader(f))
+    return rows
+
+
+output_dir = tempfile.mkdtemp()
+json_file = os.path.join(output_dir, "result.json")
+with open(json_file, "w") as f:
+    json.dump({"output": {"data_json": {"result": relations[:1]}}}, f)
+with RelationCsvExporter(output_dir, chunk_rows=2) as exporter:
+    exporter.add(json_file=json_file)
+    exporter.add(relations=relations[1])
+assert exporter.summary() == {"nodes": 5, "relationships": 4, "duplicates": 1, "node_files": 3,
+                              "relationship_files": 2}
+
+nodes = read_rows(exporter.nodes.files())
+assert nodes[0] == ["id:ID", "name", ":LABEL"]
+assert nodes[1] == [RelationNodeId("DRUG", "aspirin"), "aspirin", "DRUG"]
+assert ["ibuprofen, 200 \"mg\"", "DRUG"] in [node[1:] for node in nodes]
+assert len({node[0] for node in nodes[1:]}) == 5
+relationships = read_rows(exporter.relationships.files())
+assert relationships[0] == [":START_ID", ":END_ID", ":TYPE"]
+assert relationships[3] == [RelationNodeId("DRUG", "aspirin"), RelationNodeId("DOSAGE", "81 mg"), "DOSAGE_DRUG"]
+assert {relationship[0] for relationship in relationships[1:]} <= {node[0] for node in nodes[1:]}
+assert exporter.import_command().startswith("neo4j-admin database import full --nodes=")
+print("relation csv export:", exporter.summary())
+
+# a chunk is one node whether it is the first or the second entity of its relations
+with RelationCsvExporter(tempfile.mkdtemp()) as exporter:
+    exporter.add(relations=[{"entity1": "DRUG", "chunk1": "o'brien-salt", "label": "ADE-DRUG", "entity2": "ADE",
+                             "chunk2": "skin-rash"},
+                            {"entity1": "ADE", "chunk1": "skin-rash", "label": "SYMPTOM-OF", "entity2": "DRUG",
+                             "chunk2": "o'brien-salt"}])
+assert exporter.summary()["nodes"] == 2
+assert sorted(node[1] for node in read_rows(exporter.nodes.files())[1:]) == ["o'brien-salt", "skin-rash"]
+
+# in-memory graph index
+from aimped.nlp.relation_graph import RelationGraph
+
+graph = RelationGraph()
+graph.add(relations=relations)
+graph.add(relations=[{"entity1": "ADE", "chunk1": "rash", "label": "SYMPTOM-OF", "entity2": "DISEASE",
+                      "chunk2": "allergy"}])
+aspirin, rash = graph.node_id("DRUG", "aspirin"), graph.node_id("ADE", "rash")
+assert graph.node(aspirin) == ("DRUG", "aspirin") and graph.node_id("DRUG", "unknown") is None
+assert [graph.node(node_id)[1] for node_id in graph.neighbours(aspirin, "ADE_DRUG")] == ["rash", "nausea"]
+assert graph.degree(aspirin) == 3 and graph.degree(rash, direction="in") == 2
+assert graph.weight(aspirin, rash, "ADE_DRUG") == 2 and graph.weight(rash, aspirin, "ADE_DRUG") == 0
+ibuprofen, allergy = graph.node_id("DRUG", "ibuprofen, 200 \"mg\""), graph.node_id("DISEASE", "allergy")
+assert graph.path(aspirin, allergy) == [aspirin, rash, allergy]
+assert graph.path(aspirin, ibuprofen) is None
+assert graph.path(aspirin, ibuprofen, direction="both") == [aspirin, rash, ibuprofen]
+assert graph.path(aspirin, allergy, max_depth=1) is None
+
+graph_dir = tempfile.mkdtemp()
+graph.save(graph_dir)
+loaded = RelationGraph.load(graph_dir)
+assert len(loaded) == len(graph) and loaded.relations == graph.relations
+assert loaded.node_id("ADE", "rash") == rash and loaded.node(ibuprofen) == graph.node(ibuprofen)
+assert list(loaded.neighbours(rash, direction="in")) == list(graph.neighbours(rash, direction="in"))
+assert loaded.weight(aspirin, rash, "ADE_DRUG") == 2
+loaded.add(relations=[{"entity1": "DRUG", "chunk1": "aspirin", "label": "ADE-DRUG", "entity2": "ADE",
+                       "chunk2": "tinnitus"}])
+assert graph.degree(aspirin) == 3 and loaded.degree(aspirin) == 4 and loaded.weight(aspirin, rash, "ADE_DRUG") == 2
+
+# the chunks are not normalized, a chunk is the same node on both sides of its relations
+graph = RelationGraph()
+graph.add(relations=[{"entity1": "DRUG", "chunk1": "aspirin", "label": "ADE-DRUG", "entity2": "ADE",
+                      "chunk2": "skin-rash"},
+                     {"entity1": "ADE", "chunk1": "skin-rash", "label": "SYMPTOM-OF", "entity2": "DISEASE",
+                      "chunk2": "o'brien's disease"}])
+assert len(graph) == 3
+aspirin, disease = graph.node_id("DRUG", "aspirin"), graph.node_id("DISEASE", "o'brien's disease")
+assert graph.path(aspirin, disease) == [aspirin, graph.node_id("ADE", "skin-rash"), disease]
+assert graph.degree(aspirin, "ADE-DRUG") == graph.degree(aspirin, "ADE_DRUG") == 1
+print("relation graph:", loaded)
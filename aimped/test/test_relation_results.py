@@ -0,0 +1,105 @@
+from aimped.nlp.relation import RelationResults, RelationCandidates, RelationMarkSentence
+
+sentences = ["Aspirin 100 mg caused a rash and nausea.", "Ibuprofen was stopped."]
+ner_chunk_results = [
+    {"entity": "DRUG", "chunk": "Aspirin", "begin": 0, "end": 7, "sent_idx": 0, "sent_begin": 0, "sent_end": 7},
+    {"entity": "DOSAGE", "chunk": "100 mg", "begin": 8, "end": 14, "sent_idx": 0, "sent_begin": 8, "sent_end": 14},
+    {"entity": "ADE", "chunk": "rash", "begin": 24, "end": 28, "sent_idx": 0, "sent_begin": 24, "sent_end": 28},
+    {"entity": "ADE", "chunk": "nausea", "begin": 33, "end": 39, "sent_idx": 0, "sent_begin": 33, "sent_end": 39},
+    {"entity": "DRUG", "chunk": "Ibuprofen", "begin": 41, "end": 50, "sent_idx": 1, "sent_begin": 0, "sent_end": 9},
+]
+relation_pairs = [("DRUG", "ADE"), ("DRUG", "DOSAGE"), ("ADE", "DRUG")]
+
+
+def relation_classifier(texts):
+    """fake relation classifier: 'ADE-DRUG' unless the dosage is marked"""
+    return [{"label": "DOSAGE-DRUG" if "100 mg  e2e" in text else "ADE-DRUG", "score": 0.8} for text in texts]
+
+
+entities = [list(result.values()) for result in ner_chunk_results[:4]]
+assert RelationCandidates(entities, set(relation_pairs)) == [(0, 1), (0, 2), (0, 3)]
+assert RelationCandidates(entities, {("ADE", "ADE")}) == [(2, 3)]
+assert RelationCandidates(entities, set()) == []
+assert RelationMarkSentence(sentences[0], 8, 14, 24, 28) == "Aspirin e1b  100 mg  e1e caused a  e2b rash  e2e and nausea."
+
+results = RelationResults(sentences, ner_chunk_results, relation_classifier, ["ADE-DRUG", "DOSAGE-DRUG"],
+                          relation_pairs, return_svg=False)
+assert [(r["chunk1"], r["chunk2"], r["label"]) for r in results] == [
+    ("Aspirin", "100 mg", "DOSAGE-DRUG"), ("Aspirin", "rash", "ADE-DRUG"), ("Aspirin", "nausea", "ADE-DRUG")]
+assert list(results[0]) == ["firstCharEnt1", "lastCharEnt1", "entity1", "chunk1", "firstCharEnt2", "lastCharEnt2",
+                            "entity2", "chunk2", "label", "score"]
+
+results = RelationResults(sentences, ner_chunk_results, relation_classifier, ["DOSAGE-DRUG"], relation_pairs,
+                          return_svg=True)
+assert results == [{"sentID": 0, "sentence": sentences[0],
+                    "firstCharEnt1": 0, "sent_begin1": 0, "lastCharEnt1": 7, "sent_end1": 7,
+                    "entity1": "DRUG", "chunk1": "Aspirin",
+                    "firstCharEnt2": 8, "sent_begin2": 8, "lastCharEnt2": 14, "sent_end2": 14,
+                    "entity2": "DOSAGE", "chunk2": "100 mg", "label": "DOSAGE-DRUG", "score": 0.8}]
+assert RelationResults(sentences, [], relation_classifier, ["ADE-DRUG"], relation_pairs, return_svg=True) == []
+print("relation results:", results)
+
+# candidate pruning
+from aimped.nlp.relation import RelationPruning
+
+sentence = "Meds: aspirin 81 mg, metformin 500 mg, lisinopril 10 mg, atorvastatin 40 mg daily."
+chunks = [("DRUG", "aspirin"), ("DOSAGE", "81 mg"), ("DRUG", "metformin"), ("DOSAGE", "500 mg"),
+          ("DRUG", "lisinopril"), ("DOSAGE", "10 mg"), ("DRUG", "atorvastatin"), ("DOSAGE", "40 mg")]
+entities = []
+for label, chunk in chunks:
+    begin = sentence.index(chunk)
+    entities.append([label, chunk, begin, begin + len(chunk), 0, begin, begin + len(chunk)])
+candidates = RelationCandidates(entities, {("DRUG", "DOSAGE")})
+assert len(candidates) == 10
+
+pruning = RelationPruning(max_char_distance=5)
+assert pruning.prune(entities, candidates, sentence) == [(0, 1), (2, 3), (4, 5), (6, 7)]
+pruning = RelationPruning(max_token_distance=2)
+assert pruning.prune(entities, candidates, sentence) == [(0, 1), (2, 3), (4, 5), (6, 7)]
+pruning = RelationPruning(max_token_distance=4)
+assert len(pruning.prune(entities, candidates, sentence)) == 7
+pruning = RelationPruning(nearest_k=1)
+assert pruning.prune(entities, candidates, sentence) == [(0, 1), (2, 3), (4, 5), (6, 7)]
+pruning = RelationPruning(max_candidates_per_entity=2)
+kept = pruning.prune(entities, candidates, sentence)
+assert all(sum(position in candidate for candidate in kept) <= 2 for position in range(len(entities)))
+assert (0, 1) in kept and (6, 7) in kept and kept == sorted(kept)
+assert pruning.report()["pruned_by"] == {"distance": 0, "nearest_k": 0,
+                                         "max_candidates_per_entity": len(candidates) - len(kept)}
+
+ner_chunk_results = [dict(zip(["entity", "chunk", "begin", "end", "sent_idx", "sent_begin", "sent_end"], entity))
+                     for entity in entities]
+pruning = RelationPruning(max_char_distance=5)
+results = RelationResults([sentence], ner_chunk_results, relation_classifier, ["ADE-DRUG", "DOSAGE-DRUG"],
+                          [("DRUG", "DOSAGE")], return_svg=False, pruning=pruning)
+assert [(r["chunk1"], r["chunk2"]) for r in results] == [
+    ("aspirin", "81 mg"), ("metformin", "500 mg"), ("lisinopril", "10 mg"), ("atorvastatin", "40 mg")]
+assert pruning.report() == {"sentences": 1, "candidates": 10, "kept": 4, "pruned": 6,
+                            "pruned_by": {"distance": 6, "nearest_k": 0, "max_candidates_per_entity": 0}}
+print("pruning:", pruning.report())
+
+# batching across sentences and texts
+from aimped.nlp.relation import RelationBatchResults, RelationClassify
+
+calls = []
+
+
+def counting_classifier(texts, batch_size=None):
+    calls.append((len(texts), batch_size))
+    return relation_classifier(texts)
+
+
+new_sentences = ["a" * 5, "a", "a" * 3, "a" * 4, "a" * 2]
+assert RelationClassify(new_sentences, counting_classifier, batch_size=2) == relation_classifier(new_sentences)
+assert calls == [(2, 2), (2, 2), (1, 2)]
+
+sentences_list = [[sentence], [sentence], []]
+ner_chunk_results_list = [ner_chunk_results[:4], ner_chunk_results, []]
+calls.clear()
+batch_results = RelationBatchResults(sentences_list, ner_chunk_results_list, counting_classifier,
+                                     ["ADE-DRUG", "DOSAGE-DRUG"], [("DRUG", "DOSAGE")], return_svg=True, batch_size=4)
+assert [len(results) for results in batch_results] == [3, 10, 0]
+assert calls == [(4, 4), (4, 4), (4, 4), (1, 4)]
+assert batch_results[1] == RelationResults([sentence], ner_chunk_results, relation_classifier,
+                                           ["ADE-DRUG", "DOSAGE-DRUG"], [("DRUG", "DOSAGE")], return_svg=True)
+print("batch results:", [len(results) for results in batch_results])
@@ -0,0 +1,178 @@
+from aimped.nlp.translation import text_translate, text_segments, translate_segments
+
+calls = []
+
+
+def pipeline(segments, batch_size=None):
+    """fake translation pipeline upper-casing the segments"""
+    calls.append(list(segments))
+    return [{"translation_text": segment.upper()} for segment in segments]
+
+
+input_texts = ["The patient is stable. See www.example.com for details.\n\nContact: doc@example.com",
+               "Second report.\nNo changes.",
+               ""]
+paragraphs, values = text_segments(input_texts[0], "en")
+assert paragraphs[1] is None and values == ["www.example.com", "doc@example.com"]
+assert paragraphs[0] == ["The patient is stable. See <URL_0> for details."]
+
+assert translate_segments(["ccc", "a", "bb"], pipeline, batch_size=2) == ["CCC", "A", "BB"]
+assert calls == [["a", "bb"], ["ccc"]]
+
+calls.clear()
+output_texts = text_translate(input_texts, "en", pipeline=pipeline, batch_size=2)
+assert len(calls) == 2 and all(len(call) <= 2 for call in calls)
+assert output_texts[1] == "SECOND REPORT.\nNO CHANGES."
+assert output_texts[0].startswith("THE PATIENT IS STABLE.") and " www.example.com" in output_texts[0]
+assert output_texts[0].endswith(" doc@example.com") and "\n\n\n" in output_texts[0]
+assert output_texts[2] == "\n"
+
+# every Chinese text is translated, not only the first one
+output_texts = text_translate(["你好。世界\n\n再见", "谢谢"], "zh", pipeline=pipeline)
+assert output_texts == ["你好 世界\n\n再见", "谢谢"]
+print("translation:", output_texts)
+
+# translation memory
+import os
+import tempfile
+from aimped.nlp.translation import TranslationMemory
+
+path = os.path.join(tempfile.mkdtemp(), "memory.sqlite")
+memory = TranslationMemory(maxsize=2, path=path)
+input_texts = ["Discharge summary.\nThe patient is stable.", "Discharge summary.\nNo changes."]
+assert TranslationMemory.normalize(" The  patient\tis stable. ") == "The patient is stable."
+calls.clear()
+output_texts = text_translate(input_texts, "en", pipeline=pipeline, memory=memory, model_id="model")
+assert output_texts[0] == "DISCHARGE SUMMARY.\nTHE PATIENT IS STABLE."
+assert sum(len(call) for call in calls) == 3 and memory.misses == 3
+calls.clear()
+assert text_translate(input_texts[:1], "en", pipeline=pipeline, memory=memory, model_id="model") == output_texts[:1]
+assert calls == [] and memory.hits == 2
+assert text_translate(input_texts[:1], "de", pipeline=pipeline, memory=memory, model_id="model") == output_texts[:1]
+assert len(calls) == 1
+
+# the on-disk tier outlives the process memory
+memory.close()
+memory = TranslationMemory(maxsize=2, path=path)
+calls.clear()
+assert text_translate(input_texts[:1], "en", pipeline=pipeline, memory=memory, model_id="model") == output_texts[:1]
+assert calls == [] and memory.disk_hits == 2 and memory.hit_rate == 1.0
+assert text_translate(input_texts[:1], "en", pipeline=pipeline, memory=memory, model_id="other model") \
+       == output_texts[:1] and len(calls) == 1
+print("translation memory:", memory.stats())
+
+# segments packed by the tokens of the translation model
+from transformers import BertTokenizerFast
+from aimped.nlp.translation import concat_sentences, token_lengths
+
+vocab_dir = tempfile.mkdtemp()
+with open(os.path.join(vocab_dir, "vocab.txt"), "w", encoding="utf8") as f:
+    f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "the", "patient", "has", "hyper", "##tension",
+                       "and", "dia", "##bet", "##es", "."]))
+tokenizer = BertTokenizerFast.from_pretrained(vocab_dir)
+sentences = ["The patient has hypertension.", "And diabetes.", "The patient has diabetes and hypertension."]
+assert token_lengths(sentences, tokenizer) == [6, 5, 10]
+assert concat_sentences(sentences, tokenizer=tokenizer, max_tokens=11) == [
+    "The patient has hypertension. And diabetes.", "The patient has diabetes and hypertension."]
+# a sentence longer than the budget is split instead of truncated
+assert concat_sentences(sentences[2:], tokenizer=tokenizer, max_tokens=6) == [
+    "The patient has diabetes", "and hypertension."]
+assert all(length <= 510 for length in token_lengths(concat_sentences(sentences * 100, tokenizer=tokenizer),
+                                                     tokenizer))
+
+calls.clear()
+output_texts = text_translate([" ".join(sentences)], "en", pipeline=pipeline, tokenizer=tokenizer, max_tokens=11)
+assert calls == [["The patient has diabetes and hypertension.", "The patient has hypertension. And diabetes."]]
+print("token packing:", output_texts)
+
+
+class TokenizerPipeline:
+    """fake translation pipeline with the tokenizer of its model, like transformers pipelines"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __call__(self, segments, batch_size=None):
+        return pipeline(segments, batch_size=batch_size)
+
+
+# the tokenizer of the pipeline packs the sentences by default, the word packing is only for pipelines without one
+calls.clear()
+assert text_translate([" ".join(sentences)], "en", pipeline=TokenizerPipeline(tokenizer), max_tokens=11) == \
+       output_texts
+assert calls == [["The patient has diabetes and hypertension.", "The patient has hypertension. And diabetes."]]
+calls.clear()
+text_translate([" ".join(sentences)], "en", pipeline=pipeline)
+assert calls == [[" ".join(sentences)]]
+try:
+    text_translate([" ".join(sentences)], "en", pipeline=pipeline, max_tokens=11)
+    raise AssertionError("max_tokens without a tokenizer must be rejected")
+except ValueError:
+    pass
+
+# streaming
+import time
+from aimped.nlp.translation import text_translate_stream, text_translate_stream_outputs
+
+input_texts = ["First paragraph. It is short.\n\nSecond paragraph, see www.example.com.", "Another text.\nEnd."]
+expected = text_translate(input_texts, "en", pipeline=pipeline)
+events = []
+
+
+def slow_pipeline(segments, batch_size=None):
+    events.append(("batch", len(segments)))
+    time.sleep(0.05)
+    return pipeline(segments)
+
+
+paragraphs = [[], []]
+for item in text_translate_stream(input_texts, "en", pipeline=slow_pipeline, batch_size=1):
+    events.append(("paragraph", item["text_idx"], item["paragraph_idx"]))
+    paragraphs[item["text_idx"]].append(item["translation"])
+assert ["\n".join(p) for p in paragraphs] == expected
+# the first paragraph is yielded before the last batch is translated
+assert events.index(("paragraph", 0, 0)) < len(events) - 2 and events[-1][0] == "paragraph"
+
+outputs = list(text_translate_stream_outputs(input_texts, "en", "de", pipeline=pipeline))
+result = outputs[-1].output["data_json"]["result"]
+assert result["translated_text"] == expected and result["output_language"] == "de" and result["done"]
+assert outputs[0].output["data_json"]["result"]["translated_text"][1] == ""
+
+# the worker stops when the caller stops reading
+stream = text_translate_stream(input_texts * 10, "en", pipeline=slow_pipeline, batch_size=1, prefetch=1)
+next(stream)
+stream.close()
+print("translation stream:", result)
+
+# placeholder protection
+from aimped.nlp.translation import PlaceholderProtector
+
+protector = PlaceholderProtector(categories=("url", "email", "dosage", "icd", "number"))
+text, values = protector.protect("Give 10 mg/kg twice for E11.9, see https://x.org/a or call 555.")
+assert text == "Give <DOSAGE_0> twice for <ICD_1>, see <URL_2> or call <NUMBER_3>."
+assert values == ["10 mg/kg", "E11.9", "https://x.org/a", "555"]
+# reordered, lower-cased and dropped sentinels
+assert protector.restore("<icd_1>: <DOSAGE_0>, < URL_2 >.", values) == "E11.9: 10 mg/kg, https://x.org/a. 555"
+assert protector.restore("<NUMBER_3>", values, source="call <NUMBER_3>") == "555"
+assert protector.is_protected("<URL_2> - <NUMBER_3>.") and not protector.is_protected("see <URL_2>")
+try:
+    PlaceholderProtector(categories=("phone",))
+    raise AssertionError("an unknown category must be rejected")
+except ValueError:
+    pass
+
+calls.clear()
+output_texts = text_translate(["Dose: 5 mg.\nhttps://example.org/guide\nSee https://example.org/guide now."], "en",
+                              pipeline=pipeline, protector=protector)
+assert output_texts == ["DOSE: 5 mg.\nhttps://example.org/guide\nSEE https://example.org/guide NOW."]
+# the paragraph made of a url only is not sent to the model
+assert calls == [["See <URL_2> now.", "Dose: <DOSAGE_0>."]]
+
+
+def dropping_pipeline(segments, batch_size=None):
+    return [{"translation_text": segment.replace("<URL_0>", "").upper()} for segment in segments]
+
+
+assert text_translate(["Visit www.example.com today.\nThanks."], "en", pipeline=dropping_pipeline) == \
+       ["VISIT  TODAY. www.example.com\nTHANKS."]
+print("placeholders:", output_texts)
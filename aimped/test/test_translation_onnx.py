@@ -0,0 +1,94 @@
+import os
+import tempfile
+import warnings
+
+import numpy as np
+import torch
+from transformers import BertTokenizerFast, MarianConfig, MarianMTModel
+
+from aimped.model.load import load_model
+from aimped.nlp.translation import text_translate
+from aimped.nlp.translation_onnx import export_seq2seq_onnx, OnnxSeq2SeqModel, OnnxTranslationPipeline
+
+warnings.filterwarnings("ignore")
+
+# tiny randomly initialized model, the token ids follow the test tokenizer: [PAD] 0, [SEP] 3
+torch.manual_seed(0)
+words = ["patient", "is", "stable", "has", "a", "headache", "and", "fever", "no", "pain", "she", "denies", "."]
+model_dir = tempfile.mkdtemp()
+with open(os.path.join(model_dir, "vocab.txt"), "w", encoding="utf8") as f:
+    f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+config = MarianConfig(vocab_size=len(words) + 5, d_model=32, encoder_layers=2, decoder_layers=2,
+                      encoder_attention_heads=4, decoder_attention_heads=4, encoder_ffn_dim=64, decoder_ffn_dim=64,
+                      max_position_embeddings=64, pad_token_id=0, eos_token_id=3, decoder_start_token_id=0,
+                      forced_eos_token_id=3, scale_embedding=True)
+model = MarianMTModel(config).eval()
+with torch.no_grad():
+    for parameter in model.parameters():
+        parameter.mul_(3)
+model.generation_config.bad_words_ids = [[0]]
+model.generation_config.max_length = 12
+
+export_seq2seq_onnx(model, model_dir, tokenizer=tokenizer)
+assert {"encoder.onnx", "decoder.onnx", "decoder_with_past.onnx", "onnx_config.json"} <= set(os.listdir(model_dir))
+# the export leaves the model as it was
+assert not model.training
+onnx_model = OnnxSeq2SeqModel(model_dir)
+
+# greedy and beam search give the sequences of generate
+inputs = tokenizer(["patient is stable .", "she denies pain and fever .", "no headache"], padding=True,
+                   return_token_type_ids=False, return_tensors="pt")
+for num_beams in [1, 3]:
+    with torch.no_grad():
+        expected = model.generate(**inputs, num_beams=num_beams, max_length=12, do_sample=False).numpy()
+    sequences = onnx_model.generate(inputs["input_ids"].numpy(), inputs["attention_mask"].numpy(),
+                                    num_beams=num_beams, max_length=12)
+    for expected_sequence, sequence in zip(expected, sequences):
+        assert np.array_equal(expected_sequence[:len(sequence)], sequence)
+        assert (expected_sequence[len(sequence):] == 0).all()
+print("onnx sequences:", [sequence.tolist() for sequence in sequences])
+
+# drop-in pipeline of text_translate
+onnx_pipeline = OnnxTranslationPipeline(model_dir)
+texts = ["Patient is stable. She denies pain.\n\nNo headache.", "Patient has a fever."]
+
+
+def torch_pipeline(segments, batch_size=None):
+    batch = tokenizer(list(segments), padding=True, return_token_type_ids=False, return_tensors="pt")
+    with torch.no_grad():
+        sequences = model.generate(**batch, num_beams=1, max_length=12, do_sample=False)
+    return [{"translation_text": tokenizer.decode(sequence, skip_special_tokens=True)} for sequence in sequences]
+
+
+expected = text_translate(texts, "en", pipeline=torch_pipeline, batch_size=2)
+assert text_translate(texts, "en", pipeline=onnx_pipeline, batch_size=2, model_id="onnx") == expected
+print("onnx translation:", expected)
+
+# load_model backend
+loaded_model, loaded_tokenizer = load_model(model_dir, "Translation", backend="onnx")
+assert isinstance(loaded_model, OnnxSeq2SeqModel) and loaded_tokenizer.pad_token_id == 0
+
+# the target language token of multilingual models and the other logits processors of generate
+model.generation_config.forced_bos_token_id = 7
+model.generation_config.no_repeat_ngram_size = 2
+model.generation_config.repetition_penalty = 1.5
+model.generation_config.min_length = 6
+processors_dir = export_seq2seq_onnx(model, tempfile.mkdtemp())
+onnx_model = OnnxSeq2SeqModel(processors_dir)
+for num_beams in [1, 3]:
+    with torch.no_grad():
+        expected = model.generate(**inputs, num_beams=num_beams, max_length=12, do_sample=False).numpy()
+    sequences = onnx_model.generate(inputs["input_ids"].numpy(), inputs["attention_mask"].numpy(),
+                                    num_beams=num_beams, max_length=12)
+    for expected_sequence, sequence in zip(expected, sequences):
+        assert sequence[1] == 7 and np.array_equal(expected_sequence[:len(sequence)], sequence)
+        assert (expected_sequence[len(sequence):] == 0).all()
+
+# the generation settings that the backend does not implement are rejected
+model.generation_config.suppress_tokens = [5]
+try:
+    export_seq2seq_onnx(model, tempfile.mkdtemp())
+    raise AssertionError("suppress_tokens must be rejected")
+except ValueError as error:
+    assert "suppress_tokens" in str(error)